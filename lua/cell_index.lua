@@ -0,0 +1,248 @@
+-- Index of the block tags (<cell>, </cell>, <markdown>, ..., </output>) of Volcano buffers.
+-- Tags are kept in a list sorted by line, updated from nvim_buf_attach on_lines events, so
+-- finding the block around a line is a binary search instead of a walk over the buffer.
+--
+-- Blocks are matched the way cell_format.parse_blocks matches them: inside a block every tag up
+-- to its own closing tag is content, so an output that prints "<cell>" doesn't end it. Which
+-- block each tag belongs to is worked out lazily, for a prefix of the list that edits cut back.
+local M = {}
+
+local OPENING = { ["<cell>"] = "cell", ["<markdown>"] = "markdown", ["<raw>"] = "raw", ["<output>"] = "output" }
+local CLOSING = { ["</cell>"] = "cell", ["</markdown>"] = "markdown", ["</raw>"] = "raw", ["</output>"] = "output" }
+
+-- an output kept out of the buffer, see output_store.py. It's a block of its own.
+local ANCHOR = "<output/>"
+
+-- bufnr -> {
+--   rows = { 0-based line, ... }, tags = { tag, ... },
+--   valid = how many of the tags the fields below are up to date for,
+--   owner = { index of the tag opening the block the tag is in, 0 outside of any block, ... },
+--   open = { index of the block still open after the tag, 0 if none, ... },
+--   close = { [index of an opening tag] = index of its closing tag },
+-- }
+local indexes = {}
+
+local function scan(bufnr, first, last, rows, tags)
+  local lines = vim.api.nvim_buf_get_lines(bufnr, first, last, false)
+  for i, line in ipairs(lines) do
+    local tag = vim.trim(line)
+    if tag:match("^<output id=%d+/>$") then
+      tag = ANCHOR
+    end
+    if OPENING[tag] or CLOSING[tag] or tag == ANCHOR then
+      table.insert(rows, first + i - 1)
+      table.insert(tags, tag)
+    end
+  end
+end
+
+-- index of the first tag on or after row, #rows + 1 if there is none
+local function lower_bound(rows, row)
+  local lo, hi = 1, #rows + 1
+  while lo < hi do
+    local mid = math.floor((lo + hi) / 2)
+    if rows[mid] < row then
+      lo = mid + 1
+    else
+      hi = mid
+    end
+  end
+  return lo
+end
+
+local function build(bufnr)
+  local index = { rows = {}, tags = {}, valid = 0, owner = {}, open = {}, close = {} }
+  scan(bufnr, 0, -1, index.rows, index.tags)
+  indexes[bufnr] = index
+end
+
+local function on_lines(_, bufnr, _, first, last, new_last)
+  local index = indexes[bufnr]
+  if index == nil then
+    -- detach
+    return true
+  end
+
+  local rows, tags = index.rows, index.tags
+  local lo = lower_bound(rows, first)
+  local hi = lower_bound(rows, last)
+  local new_rows, new_tags = {}, {}
+  scan(bufnr, first, new_last, new_rows, new_tags)
+
+  -- the tags after the changed lines move to make room, in place
+  local count = #rows
+  local shift = #new_rows - (hi - lo)
+  if shift ~= 0 then
+    table.move(rows, hi, count, hi + shift)
+    table.move(tags, hi, count, hi + shift)
+    for i = count + shift + 1, count do
+      rows[i] = nil
+      tags[i] = nil
+    end
+  end
+  for i = 1, #new_rows do
+    rows[lo + i - 1] = new_rows[i]
+    tags[lo + i - 1] = new_tags[i]
+  end
+  local delta = new_last - last
+  if delta ~= 0 then
+    for i = lo + #new_rows, #rows do
+      rows[i] = rows[i] + delta
+    end
+  end
+  index.valid = math.min(index.valid, lo - 1)
+end
+
+-- work out the blocks of the tags up to n
+local function resolve(index, n)
+  local tags, owner, open, close = index.tags, index.owner, index.open, index.close
+  n = math.min(n, #tags)
+  local current = index.valid > 0 and open[index.valid] or 0
+  for i = index.valid + 1, n do
+    local tag = tags[i]
+    if current == 0 then
+      if OPENING[tag] then
+        current = i
+        owner[i] = i
+        close[i] = nil
+      elseif tag == ANCHOR then
+        owner[i] = i
+      else
+        -- a closing tag without a block
+        owner[i] = 0
+      end
+    else
+      owner[i] = current
+      if CLOSING[tag] == OPENING[tags[current]] then
+        close[current] = i
+        current = 0
+      end
+    end
+    open[i] = current
+  end
+  if n > index.valid then
+    index.valid = n
+  end
+end
+
+-- index of the tag closing the block opened by the tag at o, nil if the block is never closed
+local function closer(index, o)
+  resolve(index, o)
+  while index.open[index.valid] == o do
+    if index.valid >= #index.tags then
+      return nil
+    end
+    resolve(index, index.valid + 1)
+  end
+  return index.close[o]
+end
+
+local function matches(block, kind)
+  return block ~= nil and (kind == nil or kind == vim.NIL or block[3] == kind)
+end
+
+local function get(bufnr)
+  if bufnr == 0 then
+    bufnr = vim.api.nvim_get_current_buf()
+  end
+  if indexes[bufnr] == nil then
+    build(bufnr)
+    vim.api.nvim_buf_attach(bufnr, false, {
+      on_lines = on_lines,
+      on_reload = function(_, b)
+        build(b)
+      end,
+      on_detach = function(_, b)
+        indexes[b] = nil
+      end,
+    })
+  end
+  return indexes[bufnr]
+end
+
+-- the complete block opened by the tag at position i, nil if it doesn't open one
+local function block_from(index, i)
+  resolve(index, i)
+  if index.owner[i] ~= i then
+    return nil
+  end
+  if index.tags[i] == ANCHOR then
+    return { index.rows[i], index.rows[i], "output" }
+  end
+  local c = closer(index, i)
+  if c == nil then
+    return nil
+  end
+  return { index.rows[i], index.rows[c], OPENING[index.tags[i]] }
+end
+
+--- The block that contains row, tag lines included.
+--- Returns: { start, end, kind } with kind one of cell, markdown, raw or output, or nil
+M.block_at = function(bufnr, row)
+  local index = get(bufnr)
+  -- the last tag on or before row
+  local i = lower_bound(index.rows, row + 1) - 1
+  if i < 1 then
+    return nil
+  end
+  resolve(index, i)
+  local o = index.owner[i]
+  if o == 0 then
+    return nil
+  end
+  local block = block_from(index, o)
+  if block ~= nil and block[2] >= row then
+    return block
+  end
+  return nil
+end
+
+--- The first complete block that starts on or after row, only counting blocks of the given kind
+--- if one is given
+M.next_block = function(bufnr, row, kind)
+  local index = get(bufnr)
+  for i = lower_bound(index.rows, row), #index.rows do
+    local block = block_from(index, i)
+    if matches(block, kind) then
+      return block
+    end
+  end
+  return nil
+end
+
+--- The last complete block that ends before row, only counting blocks of the given kind if one is
+--- given
+M.prev_block = function(bufnr, row, kind)
+  local index = get(bufnr)
+  for i = lower_bound(index.rows, row) - 1, 1, -1 do
+    local block = block_from(index, i)
+    if block ~= nil and block[2] < row and matches(block, kind) then
+      return block
+    end
+  end
+  return nil
+end
+
+--- Whether the notebook is over one of the large notebook thresholds: g:volcano_large_notebook_lines,
+--- g:volcano_large_notebook_cells or g:volcano_large_notebook_output_bytes
+M.is_large = function(bufnr)
+  local index = get(bufnr)
+  local lines = vim.api.nvim_buf_line_count(bufnr)
+  local cells, output_bytes = 0, 0
+  resolve(index, #index.tags)
+  for i = 1, #index.rows do
+    local block = block_from(index, i)
+    if block ~= nil and block[3] == "cell" then
+      cells = cells + 1
+    elseif block ~= nil and block[3] == "output" then
+      output_bytes = output_bytes
+        + vim.api.nvim_buf_get_offset(bufnr, block[2] + 1)
+        - vim.api.nvim_buf_get_offset(bufnr, block[1])
+    end
+  end
+  return lines > (vim.g.volcano_large_notebook_lines or 20000)
+    or cells > (vim.g.volcano_large_notebook_cells or 1000)
+    or output_bytes > (vim.g.volcano_large_notebook_output_bytes or 5 * 1024 * 1024)
+end
+
+return M
@@ -0,0 +1,55 @@
+-- Forwards CursorMoved and WinScrolled to the python plugin. Only buffers that have a kernel or an
+-- output store (b:molten_attached) forward anything, and a burst of events is coalesced into a
+-- single call made once things have been still for g:volcano_event_debounce_ms (50 by default).
+-- The python functions are async, so the editor never waits on the host for a cursor move.
+local M = {}
+
+local uv = vim.uv or vim.loop
+
+local timer = nil
+local scrolled = false
+
+local function attached()
+  return vim.b.molten_attached == 1
+end
+
+local function flush()
+  local was_scrolled = scrolled
+  scrolled = false
+  -- the current buffer might have changed while we were waiting
+  if not attached() then
+    return
+  end
+  if was_scrolled then
+    vim.fn.MoltenOnWinScrolled()
+  else
+    vim.fn.MoltenOnCursorMoved()
+  end
+end
+
+---Called by the CursorMoved, CursorMovedI and WinScrolled autocommands
+---@param event string
+M.on_event = function(event)
+  if not attached() then
+    return
+  end
+  if event == "WinScrolled" then
+    scrolled = true
+  elseif vim.b.volcano_large_notebook == 1 then
+    -- large notebooks don't update the interface on every cursor move
+    return
+  end
+
+  local delay = vim.g.volcano_event_debounce_ms or 50
+  if delay <= 0 then
+    flush()
+    return
+  end
+  if timer == nil then
+    timer = uv.new_timer()
+  end
+  timer:stop()
+  timer:start(delay, 0, vim.schedule_wrap(flush))
+end
+
+return M
@@ -20,4 +20,10 @@ M.all_kernels = function()
   return vim.fn.MoltenStatusLineKernels()
 end
 
+---Display a string when the current notebook is in large notebook mode, and "" otherwise
+---@return string
+M.large_notebook = function()
+  return vim.b.volcano_large_notebook == 1 and "Large notebook" or ""
+end
+
 return M
@@ -1,17 +1,33 @@
 import json
 import os
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 from itertools import chain
 
 import pynvim
 from pynvim.api import Buffer
+from molten.background import BackgroundEval, BackgroundStatus, prune_finished
+from molten.cell_magics import parse_cell_magics
+from molten.buffer_transaction import BufferTransaction
+from molten.cell_format import (
+    blocks_to_cells,
+    cells_to_lines,
+    output_range,
+    parse_blocks,
+    select_outputs,
+)
+from molten.cell_index import CellIndex
 from molten.code_cell import CodeCell
 from molten.images import Canvas, get_canvas_given_provider, WeztermCanvas
 from molten.info_window import create_info_window
 from molten.ipynb import export_outputs, get_default_import_export_file, import_outputs
 from molten.save_load import MoltenIOError, get_default_save_file, load, save
 from molten.moltenbuffer import MoltenKernel
+from molten.eval_remote import TOKEN_ENV, EvalConnection, RemoteEvalWorker
+from molten.eval_worker import EvalWorker, NotebookWorker
+from molten.limits import EvalLimits, limits_from_values, parse_limits_magic
 from molten.options import MoltenOptions
+from molten.output_store import OutputStore, output_anchor, parse_output_anchor
+from molten.parallel import parse_parallel_spec
 from molten.outputbuffer import OutputBuffer
 from molten.position import DynamicPosition, Position
 from molten.runtime import get_available_kernels
@@ -20,7 +36,6 @@ from pynvim import Nvim
 
 import time
 import sys
-import traceback
 
 import threading
 import queue
@@ -28,13 +43,8 @@ import queue
 import multiprocessing
 import signal
 
-import io
 import json
 
-from types import ModuleType
-
-import codeop
-
 import subprocess
 
 import sys
@@ -57,7 +67,13 @@ class Molten:
     extmark_namespace: int
 
     timer: Optional[int]
-    input_timer: Optional[int]
+    """the pending one-shot MoltenTick timer"""
+    tick_due: float
+    """time.monotonic() at which the pending timer fires"""
+    idle_ticks: int
+    apply_lock: threading.Lock
+    apply_scheduled: bool
+    """an _apply_messages call is on its way to the main thread"""
 
     options: MoltenOptions
 
@@ -69,13 +85,17 @@ class Molten:
 
     def __init__(self, nvim: Nvim):
         self.nvim = nvim
+        self.cell_index = CellIndex(nvim)
         self.initialized = False
 
         self.canvas = None
         self.buffers = {}
         self.timer = None
-        self.input_timer = None
+        self.tick_due = 0.0
+        self.idle_ticks = 0
         self.molten_kernels = {}
+        self.apply_lock = threading.Lock()
+        self.apply_scheduled = False
 
         self.eval_counter = 0
         self.eval_queue = queue.Queue()
@@ -89,6 +109,25 @@ class Molten:
 
         self.eval_wait = False
 
+        # eval id to the cells that were started with %%background
+        self.background_evals: Dict[int, BackgroundEval] = {}
+        # held while the host merges a cell's variables into the namespace file
+        self.namespace_lock = threading.Lock()
+        # bufnr to the worker that runs the queued cells of that notebook, see NotebookWorker
+        self.notebook_workers: Dict[int, NotebookWorker] = {}
+        # g:volcano_eval_worker address to the connection to that eval worker server
+        self.eval_connections: Dict[str, EvalConnection] = {}
+        # bufnr to the out-of-band outputs of that notebook, see g:volcano_output_store
+        self.output_stores: Dict[int, OutputStore] = {}
+        # bufnr to the ids of the stored outputs that are rendered
+        self.rendered_outputs: Dict[int, Set[int]] = {}
+        # the stored outputs of the last VolcanoCopyCell by id, pasted as copies of their own
+        self.copied_outputs: Dict[int, List[str]] = {}
+        # bufnrs of the notebooks in large notebook mode
+        self.large_notebooks: Set[int] = set()
+        # extmark namespaces of the Volcano outputs, by name
+        self.volcano_namespaces: Dict[str, int] = {}
+
     def _initialize(self) -> None:
         assert not self.initialized
 
@@ -100,13 +139,7 @@ class Molten:
         self.highlight_namespace = self.nvim.funcs.nvim_create_namespace("molten-highlights")
         self.extmark_namespace = self.nvim.funcs.nvim_create_namespace("molten-extmarks")
 
-        self.timer = self.nvim.eval(
-            f"timer_start({self.options.tick_rate}, 'MoltenTick', {{'repeat': -1}})"
-        )  # type: ignore
-
-        self.input_timer = self.nvim.eval(
-            f"timer_start({self.options.tick_rate}, 'MoltenTickInput', {{'repeat': -1}})"
-        )  # type: ignore
+        self._schedule_tick(self.options.tick_rate)
 
         self._setup_highlights()
         self._set_autocommands()
@@ -119,9 +152,16 @@ class Molten:
 
     def _set_autocommands(self) -> None:
         self.nvim.command("augroup molten")
-        self.nvim.command("autocmd CursorMoved  * call MoltenOnCursorMoved()")
-        self.nvim.command("autocmd CursorMovedI * call MoltenOnCursorMoved()")
-        self.nvim.command("autocmd WinScrolled  * call MoltenOnWinScrolled()")
+        # gated to attached buffers and debounced on the lua side, see lua/molten/events.lua
+        self.nvim.command(
+            "autocmd CursorMoved  * lua require('molten.events').on_event('CursorMoved')"
+        )
+        self.nvim.command(
+            "autocmd CursorMovedI * lua require('molten.events').on_event('CursorMovedI')"
+        )
+        self.nvim.command(
+            "autocmd WinScrolled  * lua require('molten.events').on_event('WinScrolled')"
+        )
         self.nvim.command("autocmd BufEnter     * call MoltenUpdateInterface()")
         self.nvim.command("autocmd BufLeave     * call MoltenBufLeave()")
         self.nvim.command("autocmd BufUnload    * call MoltenOnBufferUnload()")
@@ -134,6 +174,7 @@ class Molten:
         hl_utils.set_default_highlights(self.options.hl.defaults)
 
     def _deinitialize(self) -> None:
+        self._stop_notebook_workers()
         for molten_kernels in self.buffers.values():
             for molten_kernel in molten_kernels:
                 molten_kernel.deinit()
@@ -141,8 +182,22 @@ class Molten:
             self.canvas.deinit()
         if self.timer is not None:
             self.nvim.funcs.timer_stop(self.timer)
-        if self.input_timer is not None:
-            self.nvim.funcs.timer_stop(self.input_timer)
+            self.timer = None
+
+    def _schedule_tick(self, delay: int) -> None:
+        """Run MoltenTick in delay ms, unless a tick is already due sooner"""
+        due = time.monotonic() + delay / 1000
+        if self.timer is not None:
+            if self.tick_due <= due:
+                return
+            self.nvim.funcs.timer_stop(self.timer)
+        self.tick_due = due
+        self.timer = self.nvim.funcs.timer_start(delay, "MoltenTick")
+
+    def _wake_tick(self) -> None:
+        """A kernel was given work, tick right away and at the full rate until it's done"""
+        self.idle_ticks = 0
+        self._schedule_tick(0)
 
     def _initialize_if_necessary(self) -> None:
         if not self.initialized:
@@ -206,6 +261,7 @@ class Molten:
             if molten is not None:
                 molten.add_nvim_buffer(self.nvim.current.buffer)
                 self.buffers[self.nvim.current.buffer.number] = [molten]
+                self.nvim.current.buffer.vars["molten_attached"] = 1
                 return molten
 
             notify_warn(
@@ -249,276 +305,64 @@ class Molten:
             self.buffers[buffer.number] = [kernel]
         else:
             self.buffers[buffer.number].append(kernel)
+        buffer.vars["molten_attached"] = 1
 
         self.molten_kernels[kernel_id] = kernel
+        kernel.large_notebook = buffer.number in self.large_notebooks
+        kernel.wake_tick = self._wake_tick
+        kernel.runtime.notify = self._notify_messages
+        # the kernel is starting up
+        self._wake_tick()
 
     def _move_cursor_to(self, win, line):
         win.cursor = (line + 1, 0)
 
-    def _restore_cursor_pos(self, old_buf, new_buf, win, old_cursor_pos):
-        if len(old_buf) < len(new_buf):
-            pass # might not need this if statement
-        elif len(old_buf) > len(new_buf):
-            win.cursor = (old_cursor_pos[0] - (len(old_buf) - len(new_buf)), 0)
-            self.nvim.command("normal! zz")
-        elif len(old_buf) == len(new_buf):
-            pass # might not need this if statement
-
     def _is_output_block_under_current_element_block(self, buf, win, cursor_pos):
-        cursor_pos = cursor_pos[0]
-        try:
-            while True:
-                if buf[cursor_pos].strip() in ("<markdown>", "<cell>", "<raw>"):
-                    return False
-                elif buf[cursor_pos].strip() == "<output>":
-                    return True
-                cursor_pos += 1
-        except Exception:
-            return False
+        block = self.cell_index.next_block(buf, cursor_pos[0])
+        return block is not None and block.kind == "output"
 
     def _is_cursor_above_cell_block(self, buf, win, cursor_pos):
-        start_cell_block_element = False
-        end_cell_block_element = False
-        cursor_pos = cursor_pos[0] - 1
-
-        try:
-            up_cursor_pos = cursor_pos
-            first_line = True
-            while True:
-                if buf[up_cursor_pos].strip() == "":
-                    first_line = False
-                elif buf[up_cursor_pos].strip() == "<cell>":
-                    start_cell_block_element = True
-                    break
-                elif buf[up_cursor_pos].strip() == "</cell>":
-                    if first_line == True:
-                        first_line = False
-                        pass
-                    elif first_line == False:
-                        break
-                up_cursor_pos -= 1
-        except Exception:
-            pass
-
-        try:
-            down_cursor_pos = cursor_pos
-            while True:
-                if buf[down_cursor_pos].strip() == "":
-                    pass
-                if buf[down_cursor_pos].strip() == "</cell>":
-                    end_cell_block_element = True
-                    break
-                elif buf[down_cursor_pos].strip() == "<cell>":
-                    if start_cell_block_element == True:
-                        pass
-                    elif start_cell_block_element == False:
-                        break
-                down_cursor_pos += 1
-        except Exception:
-            pass
-
-        if start_cell_block_element == True and end_cell_block_element == True:
-            return True
-        elif start_cell_block_element != True or end_cell_block_element != True:
-            return False
-
-    def _delete_output_block_elements(self, script_in_parts, cursor_pos, delete="Entire", amount=0): # 'amount=0' means it will delete as much as it can
-        script = "\n".join(script_in_parts)
-
-        if delete == "Entire":
-            while "<output>" in script and "</output>\n" in script:
-                first_instance_start_output = script.find("<output>")
-                first_instance_end_output = script.find("</output>\n", first_instance_start_output)
-                if first_instance_end_output == -1:
-                    break
-                first_instance_end_output += len("</output>\n")
-                if first_instance_end_output < len(script) and script[first_instance_end_output] == "\n":
-                    first_instance_end_output += 1
-                script = script[:first_instance_start_output] + script[first_instance_end_output:]
-            return script.rstrip().splitlines()
-
-        elif delete == "Up":
-            cursor_pos = cursor_pos[0] - 1
-            script = script_in_parts[:]
-            try:
-                while cursor_pos >= 0:
-                    # find the closing tag first, going upward
-                    while cursor_pos >= 0 and script[cursor_pos].strip() != "</output>":
-                        cursor_pos -= 1
-                    if cursor_pos < 0:
-                        break
-                    # then remove upward until the opening tag
-                    while cursor_pos >= 0:
-                        line = script[cursor_pos].strip()
-                        script.pop(cursor_pos)
-                        cursor_pos -= 1
-                        if line == "<output>":
-                            script.pop(cursor_pos)
-                            if amount != 0:
-                                amount -= 1
-                                if amount == 0:
-                                    return script
-                            break
-            except Exception:
-                pass
-            return script
-
-        elif delete == "Down":
-            cursor_pos = cursor_pos[0] - 1
-            script = script_in_parts[:]
-            try:
-                while cursor_pos < len(script):
-                    while cursor_pos < len(script) and script[cursor_pos].strip() != "<output>":
-                        cursor_pos += 1
-                    if cursor_pos >= len(script):
-                        break
-                    while cursor_pos < len(script):
-                        line = script[cursor_pos].strip()
-                        script.pop(cursor_pos)
-                        if line == "</output>":
-                            script.pop(cursor_pos)
-                            if amount != 0:
-                                amount -= 1
-                                if amount == 0:
-                                    return script
-                            break
-            except Exception:
-                pass
-            return script
-
-    def _clean_output_blocks(self, lines: List[str]) -> List[str]:
-        source = "\n".join(lines)
-        open_tags = source.count("<output>")
-        close_tags = source.count("</output>")
-        if open_tags == close_tags and (open_tags + close_tags) % 2 == 0:
-            cleaned = re.sub(r"^<output>.*?</output>\n?", "", source, flags=re.DOTALL | re.MULTILINE)
-            cleaned = re.sub(r"\n{3,}", "\n\n", cleaned)
-            cleaned = cleaned.rstrip()
-            return cleaned.splitlines()
-        elif open_tags != close_tags or (open_tags + close_tags) % 2 != 0:
-            return False
+        return self.cell_index.cell_at(buf, cursor_pos[0] - 1) is not None
+
+    def _delete_outputs(self, buf, row: Optional[int] = None, delete="Entire", amount=0) -> None:
+        """Remove output blocks from buf with range edits. delete is "Entire" for all of them, or
+        "Up"/"Down" for the ones above/below row. amount=0 means as many as it can."""
+        lines = buf[:]
+        outputs = select_outputs(parse_blocks(lines), row, delete, amount)
+        with BufferTransaction(self.nvim, buf) as transaction:
+            for block in outputs:
+                transaction.set_lines(*output_range(lines, block), [])
+        for block in outputs:
+            if block.output_id is not None:
+                self._forget_stored_output(buf, block.output_id)
+        store = self.output_stores.get(buf.number)
+        if store is not None:
+            store.save()
+        self._update_large_notebook(buf)
 
     def _return_cell_block_element(self, buf, win, cursor_pos):
-        cursor_pos = cursor_pos[0] - 1
-        start_cell_block_element = None
-        end_cell_block_element = None
-
-        try:
-            up_cursor_pos = cursor_pos
-            first_line = True
-            while True:
-                if buf[up_cursor_pos].strip() == "":
-                    first_line = False
-                elif buf[up_cursor_pos].strip() == "<cell>":
-                    start_cell_block_element = up_cursor_pos
-                    break
-                elif buf[up_cursor_pos].strip() == "</cell>":
-                    if first_line:
-                        first_line = False
-                    else:
-                        break
-                up_cursor_pos -= 1
-        except Exception:
-            pass
-
-        try:
-            down_cursor_pos = cursor_pos
-            while True:
-                if buf[down_cursor_pos].strip() == "</cell>":
-                    end_cell_block_element = down_cursor_pos
-                    break
-                elif buf[down_cursor_pos].strip() == "<cell>" and start_cell_block_element is None:
-                    break
-                down_cursor_pos += 1
-        except Exception:
-            pass
-
-        cell_block_element = []
-        if start_cell_block_element is not None and end_cell_block_element is not None:
-            cell_block_element = buf[start_cell_block_element + 1:end_cell_block_element]
+        block = self.cell_index.cell_at(buf, cursor_pos[0] - 1)
+        if block is None:
+            return "\n", None, None
 
-        return "\n".join(cell_block_element).strip() + "\n", start_cell_block_element, end_cell_block_element
+        cell_block_element = buf.api.get_lines(block.start + 1, block.end, False)
+        return "\n".join(cell_block_element).strip() + "\n", block.start, block.end
 
     def _switch_cell_type(self, direction: str) -> None:
         buf = self.nvim.current.buffer
         cursor_row = self.nvim.current.window.cursor[0]
 
-        tag_order = ["<cell>", "<markdown>", "<raw>"]
-        closing_tag_order = ["</cell>", "</markdown>", "</raw>"]
-
-        def rotate_tag(tag, is_closing):
-            tags = closing_tag_order if is_closing else tag_order
-            idx = tags.index(tag) if tag in tags else -1
-            if idx == -1:
-                return tag
-            if direction == "forward":
-                return tags[(idx + 1) % len(tags)]
-            else:
-                return tags[(idx - 1) % len(tags)]
+        kinds = ["cell", "markdown", "raw"]
 
         def run():
-            row = cursor_row - 1
-
-            def is_opening_tag(line):
-                return line.strip() in tag_order
-
-            def is_closing_tag(line):
-                return line.strip() in closing_tag_order
-
-            # Case 1: Cursor is directly on an opening tag
-            if is_opening_tag(buf[row]):
-                try:
-                    next_line = 1
-                    while True:
-                        if is_closing_tag(buf[row + next_line]):
-                            buf[row] = rotate_tag(buf[row], is_closing=False)
-                            buf[row + next_line] = rotate_tag(buf[row + next_line], is_closing=True)
-                            return
-                        next_line += 1
-                except IndexError:
-                    return
-
-            # Case 2: Cursor is directly on a closing tag
-            elif is_closing_tag(buf[row]):
-                try:
-                    prev_line = -1
-                    while True:
-                        if is_opening_tag(buf[row + prev_line]):
-                            buf[row + prev_line] = rotate_tag(buf[row + prev_line], is_closing=False)
-                            buf[row] = rotate_tag(buf[row], is_closing=True)
-                            return
-                        prev_line -= 1
-                except IndexError:
-                    return
-
-            # Case 3: Cursor is inside a block (must find BOTH tags)
-            else:
-                try:
-                    # Search upward for opening tag
-                    start = row
-                    while start >= 0 and not is_opening_tag(buf[start]):
-                        if is_closing_tag(buf[start]):
-                            return  # hit another block, not inside one
-                        start -= 1
-
-                    if start < 0 or not is_opening_tag(buf[start]):
-                        return
-
-                    # Search downward for closing tag
-                    end = row
-                    while end < len(buf) and not is_closing_tag(buf[end]):
-                        if is_opening_tag(buf[end]):
-                            return  # hit another block, not inside one
-                        end += 1
-
-                    if end >= len(buf) or not is_closing_tag(buf[end]):
-                        return
-
-                    # Valid block boundaries found
-                    buf[start] = rotate_tag(buf[start], is_closing=False)
-                    buf[end] = rotate_tag(buf[end], is_closing=True)
-                except IndexError:
-                    return
+            block = self.cell_index.block_at(buf, cursor_row - 1)
+            if block is None or block.kind not in kinds:
+                return
+            step = 1 if direction == "forward" else -1
+            kind = kinds[(kinds.index(block.kind) + step) % len(kinds)]
+            with BufferTransaction(self.nvim, buf) as transaction:
+                transaction.set_lines(block.start, block.start + 1, [f"<{kind}>"])
+                transaction.set_lines(block.end, block.end + 1, [f"</{kind}>"])
 
         self.nvim.async_call(run)
 
@@ -633,84 +477,279 @@ class Molten:
     def _move_cell(self, direction: str) -> None:
         buf = self.nvim.current.buffer
         cursor_row = self.nvim.current.window.cursor[0]
-        total_lines = len(buf)
-
-        def find_cell_boundaries(row: int):
-            """Find <cell> and </cell> boundaries around cursor."""
-            start, end = None, None
-
-            # Find start (<cell>)
-            for i in range(row, -1, -1):
-                if buf[i].strip() == "<cell>":
-                    start = i
-                    break
-
-            # Find end (</cell>)
-            for j in range(row, total_lines):
-                if buf[j].strip() == "</cell>":
-                    end = j
-                    break
-
-            return start, end
 
         def find_adjacent_cell(direction: str, start: int, end: int):
             """Find the next cell boundaries above or below."""
             if direction == "upward":
-                for i in range(start - 1, -1, -1):
-                    if buf[i].strip() == "</cell>":
-                        upper_end = i
-                        # find matching <cell>
-                        for j in range(i, -1, -1):
-                            if buf[j].strip() == "<cell>":
-                                return j, upper_end
-                return None, None
-
-            elif direction == "downward":
-                for i in range(end + 1, total_lines):
-                    if buf[i].strip() == "<cell>":
-                        lower_start = i
-                        # find matching </cell>
-                        for j in range(i, total_lines):
-                            if buf[j].strip() == "</cell>":
-                                return lower_start, j
+                block = self.cell_index.prev_block(buf, start, "cell")
+            else:
+                block = self.cell_index.next_block(buf, end + 1, "cell")
+            if block is None:
                 return None, None
+            return block.start, block.end
 
         def move_cell(direction: str, start: int, end: int):
             """Move the cell upward or downward."""
-            cell_lines = buf[start:end + 1]
-
-            if direction == "upward":
-                adj_start, adj_end = find_adjacent_cell("upward", start, end)
-                if adj_start is None:
-                    self.nvim.out_write("No cell above.\n")
-                    return
-                above_block = buf[adj_start:adj_end + 1]
-                buf[adj_start:end + 1] = cell_lines + [""] + above_block
-                self.nvim.current.window.cursor = (adj_start + 1, 0)
+            adj_start, adj_end = find_adjacent_cell(direction, start, end)
+            if adj_start is None:
+                self.nvim.out_write(f"No cell {'above' if direction == 'upward' else 'below'}.\n")
+                return
 
-            elif direction == "downward":
-                adj_start, adj_end = find_adjacent_cell("downward", start, end)
-                if adj_start is None:
-                    self.nvim.out_write("No cell below.\n")
-                    return
-                below_block = buf[adj_start:adj_end + 1]
-                buf[start:adj_end + 1] = below_block + [""] + cell_lines
-                self.nvim.current.window.cursor = (adj_start + 1, 0)
+            with BufferTransaction(self.nvim, buf) as transaction:
+                if direction == "upward":
+                    lines = transaction.snapshot(adj_start, end + 1)
+                    cell_lines = lines[start - adj_start:]
+                    above_block = lines[:adj_end - adj_start + 1]
+                    transaction.set_lines(adj_start, end + 1, cell_lines + [""] + above_block)
+                else:
+                    lines = transaction.snapshot(start, adj_end + 1)
+                    cell_lines = lines[:end - start + 1]
+                    below_block = lines[adj_start - start:]
+                    transaction.set_lines(start, adj_end + 1, below_block + [""] + cell_lines)
+                transaction.set_cursor(self.nvim.current.window, adj_start + 1)
 
         def run():
-            row = cursor_row - 1
-            start, end = find_cell_boundaries(row)
-            if start is None or end is None:
+            block = self.cell_index.cell_at(buf, cursor_row - 1)
+            if block is None:
                 self.nvim.out_write("Cursor not inside a valid <cell> block.\n")
                 return
-            move_cell(direction, start, end)
+            move_cell(direction, block.start, block.end)
 
         self.nvim.async_call(run)
     
-    def _insert_output_block(self, buf, end_cell_block_element):
-        output_block = ["", "<output>", f"[{self.eval_counter}][*] ...", "</output>"]
-        buf.api.set_lines(end_cell_block_element + 1, end_cell_block_element + 1, False, output_block)
-        self.nvim.command("undojoin")
+    def _insert_output_block(self, buf, end_cell_block_element) -> Optional[int]:
+        """Put an output block under the cell, in place of the one it already has.
+        Returns: the id of the output when outputs are kept in the OutputStore"""
+        status = f"[{self.eval_counter}][*] ..."
+        output_block = ["", "<output>", status, "</output>"]
+        output_id = None
+        store = self._get_output_store(buf)
+        if store is not None:
+            output_id = store.new_id()
+            store.put(output_id, [status])
+            output_block = ["", output_anchor(output_id)]
+
+        start = end = end_cell_block_element + 1
+        # an output the cell already has is replaced, along with the blank line in front of it
+        existing = self.cell_index.output_after(buf, end_cell_block_element)
+        if existing is not None:
+            start, end = existing.start, existing.end + 1
+            lines = buf.api.get_lines(start - 1, end, False)
+            if not lines[0].strip():
+                start -= 1
+            old_id = parse_output_anchor(lines[-1])
+            if old_id is not None:
+                self._forget_stored_output(buf, old_id)
+        with BufferTransaction(self.nvim, buf, undojoin=True) as transaction:
+            transaction.set_lines(start, end, output_block)
+
+        if output_id is not None:
+            self._render_stored_output(buf, output_id, start + 1)
+        else:
+            # the output is written through these, they follow the placeholder and the cell
+            # however the buffer is edited while the cell runs
+            buf.api.set_extmark(
+                self._get_namespace("volcano-streaming"),
+                start + 2,
+                0,
+                {"id": self.eval_counter, "invalidate": True},
+            )
+            buf.api.set_extmark(
+                self._get_namespace("volcano-cells"),
+                end_cell_block_element,
+                0,
+                {"id": self.eval_counter, "invalidate": True},
+            )
+        return output_id
+
+    def _get_output_store(self, buf) -> Optional[OutputStore]:
+        """The OutputStore of the notebook, None unless g:volcano_output_store is set or it's a large
+        notebook"""
+        if buf.number not in self.large_notebooks and not self.nvim.vars.get(
+            "volcano_output_store", False
+        ):
+            return None
+        store = self.output_stores.get(buf.number)
+        if store is None:
+            store = self.output_stores[buf.number] = OutputStore(buf.name)
+            # scrolling renders the stored outputs
+            buf.vars["molten_attached"] = 1
+        return store
+
+    def _get_namespace(self, name: str) -> int:
+        namespace = self.volcano_namespaces.get(name)
+        if namespace is None:
+            namespace = self.volcano_namespaces[name] = self.nvim.funcs.nvim_create_namespace(name)
+        return namespace  # type: ignore
+
+    def _virt_output_lines(self, lines: List[str], tail: bool = False) -> List[List[List[str]]]:
+        """virt_lines for an output, capped at g:volcano_virt_output_max_lines. Keeps the first
+        lines, or the last ones with tail."""
+        max_lines = int(self.nvim.vars.get("volcano_virt_output_max_lines", 40))
+        hidden = len(lines) - max_lines
+        if hidden <= 0:
+            shown = lines
+        elif tail:
+            shown = [f"... {hidden} lines above"] + lines[-max_lines:]
+        else:
+            shown = lines[:max_lines] + [f"... {hidden} more lines, see :VolcanoOpenOutput"]
+        return [[[line, "Comment"]] for line in shown]
+
+    def _render_stored_output(self, buf, output_id: int, row: Optional[int] = None) -> None:
+        """Show a stored output as virtual lines under its anchor. The anchor is found through the
+        extmark of an earlier render when row isn't given."""
+        store = self.output_stores.get(buf.number)
+        if store is None:
+            return
+        namespace = self._get_namespace("volcano-outputs")
+        if row is None:
+            position = buf.api.get_extmark_by_id(namespace, output_id, {})
+            if not position:
+                return
+            row = position[0]
+
+        shown = self._virt_output_lines(store.get(output_id))
+        buf.api.set_extmark(
+            namespace,
+            row,
+            0,
+            {"id": output_id, "virt_lines": shown or [[["", "Comment"]]], "invalidate": True},
+        )
+        self.rendered_outputs.setdefault(buf.number, set()).add(output_id)
+
+    def _render_stored_outputs(self, buf, margin: int = 50) -> None:
+        """Render the stored outputs around the part of the notebook that's on screen, the rest is
+        rendered as it's scrolled into view"""
+        store = self._get_output_store(buf)
+        if store is None:
+            return
+        top, bottom = self.nvim.eval("[line('w0'), line('w$')]")
+        start = max(top - 1 - margin, 0)
+        rendered = self.rendered_outputs.setdefault(buf.number, set())
+        for i, line in enumerate(buf.api.get_lines(start, bottom + margin, False)):
+            output_id = parse_output_anchor(line) if line.startswith("<output id=") else None
+            if output_id is not None and output_id not in rendered:
+                self._render_stored_output(buf, output_id, start + i)
+
+    def _update_large_notebook(self, buf) -> None:
+        """Turn large notebook mode on or off for the buffer, depending on the thresholds. In
+        large notebooks the interface isn't updated on cursor moves, only the outputs around the
+        window get virtual text, and new outputs go to the OutputStore."""
+        large = bool(self.nvim.exec_lua("return require('cell_index').is_large(...)", buf.number))
+        if large == (buf.number in self.large_notebooks):
+            return
+
+        if large:
+            self.large_notebooks.add(buf.number)
+            notify_info(self.nvim, "Large notebook, some features are throttled")
+        else:
+            self.large_notebooks.discard(buf.number)
+        buf.vars["volcano_large_notebook"] = int(large)
+        for kernel in self.buffers.get(buf.number, []):
+            kernel.large_notebook = large
+
+    def _copy_stored_outputs(
+        self, buf, lines: List[str]
+    ) -> Tuple[List[str], List[Tuple[int, int]]]:
+        """Give the output anchors of pasted lines ids of their own, with a copy of the output, so
+        the original and the copy don't share one. Without an OutputStore in buf they become
+        <output> blocks. Returns: the lines, and the index and id of each anchor in them"""
+        store = self._get_output_store(buf)
+        result: List[str] = []
+        anchors: List[Tuple[int, int]] = []
+        for line in lines:
+            output_id = parse_output_anchor(line)
+            if output_id is None:
+                result.append(line)
+                continue
+            copied = self.copied_outputs.get(output_id)
+            if copied is None:
+                source = self.output_stores.get(buf.number)
+                copied = list(source.get(output_id)) if source is not None else []
+            if store is None:
+                result.extend(["<output>", *copied, "</output>"])
+                continue
+            new_id = store.new_id()
+            store.put(new_id, copied)
+            anchors.append((len(result), new_id))
+            result.append(output_anchor(new_id))
+        return result, anchors
+
+    def _forget_stored_output(self, buf, output_id: int) -> None:
+        store = self.output_stores.get(buf.number)
+        if store is not None:
+            store.remove(output_id)
+        self.rendered_outputs.get(buf.number, set()).discard(output_id)
+        buf.api.del_extmark(self._get_namespace("volcano-outputs"), output_id)
+
+    def _write_output(
+        self, bufnr: int, eval_id: int, output_id: Optional[int], lines, final: bool
+    ) -> None:
+        """Update the output of a cell, found through the extmarks _insert_output_block set. Has to
+        run on the nvim thread.
+
+        Inline outputs are only written to the buffer when final is set. Until then they're drawn
+        over the placeholder with an extmark, so a running cell doesn't add to the undo history."""
+        buf = self.nvim.buffers[bufnr]
+        while lines and not lines[-1].strip():
+            lines.pop()
+        if output_id is not None:
+            store = self.output_stores[bufnr]
+            store.put(output_id, lines)
+            self._render_stored_output(buf, output_id)
+            if final:
+                store.save()
+            return
+
+        namespace = self._get_namespace("volcano-streaming")
+        output = None
+        position = self._extmark_row(buf, namespace, eval_id)
+        if position is not None:
+            output = self.cell_index.block_at(buf, position)
+        if output is not None and output.kind != "output":
+            output = None
+
+        if not final:
+            if output is not None and output.end > output.start + 1:
+                buf.api.set_extmark(
+                    namespace,
+                    output.start + 1,
+                    0,
+                    {
+                        "id": eval_id,
+                        "invalidate": True,
+                        "virt_text": [[lines[0] if lines else "", "Comment"]],
+                        "virt_text_pos": "overlay",
+                        "virt_lines": self._virt_output_lines(lines[1:], tail=True),
+                    },
+                )
+            return
+
+        cells_namespace = self._get_namespace("volcano-cells")
+        cell_row = self._extmark_row(buf, cells_namespace, eval_id)
+        buf.api.del_extmark(namespace, eval_id)
+        buf.api.del_extmark(cells_namespace, eval_id)
+        if output is not None:
+            with BufferTransaction(self.nvim, buf) as transaction:
+                transaction.set_lines(output.start + 1, output.end, lines)
+        else:
+            # The placeholder is gone. If the cell has an output again it's the one of a newer
+            # run, otherwise the output was deleted and this one goes back under the cell.
+            cell = self.cell_index.cell_at(buf, cell_row) if cell_row is not None else None
+            if cell is None or self.cell_index.output_after(buf, cell.end) is not None:
+                return
+            with BufferTransaction(self.nvim, buf) as transaction:
+                transaction.set_lines(
+                    cell.end + 1, cell.end + 1, ["", "<output>"] + lines + ["</output>"]
+                )
+        self._update_large_notebook(buf)
+
+    def _extmark_row(self, buf, namespace: int, mark_id: int) -> Optional[int]:
+        """Row of an extmark, None if it's gone or the line it was on was deleted"""
+        position = buf.api.get_extmark_by_id(namespace, mark_id, {"details": True})
+        if not position or position[2].get("invalid"):
+            return None
+        return position[0]
 
     def _evaluate_cell(self, delay: bool = False):
         buf = self.nvim.current.buffer
@@ -720,6 +759,13 @@ class Molten:
         if self._is_cursor_above_cell_block(buf, win, cursor_pos) == True:
 
             code, start_cell_block_element, end_cell_block_element = self._return_cell_block_element(buf, win, cursor_pos)
+            magics, code = parse_cell_magics(code)
+            parallel = None
+            if "parallel" in magics:
+                parallel = parse_parallel_spec(magics["parallel"])
+            limits = self._get_eval_limits()
+            if "limits" in magics:
+                limits = limits.merge(parse_limits_magic(magics["limits"]))
 
             # Exit evaluation if code is empty or only whitespace or is empty shell command
             if not code or not code.strip() or not code[1:].strip():
@@ -731,10 +777,8 @@ class Molten:
             if code.startswith("!"):
                 command = code[1:].strip()
 
-                if self._is_output_block_under_current_element_block(buf, win, cursor_pos) == True:
-                    buf.api.set_lines(0, -1, False, self._delete_output_block_elements(script_in_parts=buf[:], cursor_pos=cursor_pos, delete="Down", amount=1))
-
-                self._insert_output_block(buf, end_cell_block_element)
+                output_id = self._insert_output_block(buf, end_cell_block_element)
+                eval_id = self.eval_counter
 
                 def run(command=command):
                     try:
@@ -745,8 +789,13 @@ class Molten:
                     except Exception as e:
                         output = f"Error executing shell command:\n{e}"
                     def update_output():
-                        lines = ["", "<output>"] + output.splitlines() + ["</output>", ""]
-                        buf.api.set_lines(end_cell_block_element + 1, end_cell_block_element + 6, False, lines)
+                        self._write_output(
+                            buf.number,
+                            eval_id,
+                            output_id,
+                            output.splitlines(),
+                            final=True,
+                        )
                     self.nvim.async_call(update_output)
                 threading.Thread(target=run, daemon=True).start()
                 return
@@ -754,12 +803,14 @@ class Molten:
             # If it's not shell command then it's python code
             else:
 
-                if self._is_output_block_under_current_element_block(buf, win, cursor_pos) == True:
-                    buf.api.set_lines(0, -1, False, self._delete_output_block_elements(script_in_parts=buf[:], cursor_pos=cursor_pos, delete="Down", amount=1))
-                self._insert_output_block(buf, end_cell_block_element)
+                output_id = self._insert_output_block(buf, end_cell_block_element)
 
-                # Queue up async evaluation
-                self.eval_queue.put({
+                eval_worker = self.nvim.vars.get("volcano_eval_worker")
+                if eval_worker:
+                    # connect now, so an invalid address is reported right away
+                    self._get_eval_connection(eval_worker)
+
+                item = {
                     "bufnr": buf.number,
                     "expr": code,
                     "start_line": start_cell_block_element,
@@ -768,7 +819,42 @@ class Molten:
                     "cursor_pos": cursor_pos,
                     "win_handle": win.handle,
                     "delay": delay, 
-                })
+                    "parallel": parallel,
+                    "limits": limits,
+                    "eval_worker": eval_worker,
+                    "output_id": output_id,
+                }
+
+                # Background cells get their own worker and don't hold up the queue
+                if "background" in magics:
+                    prune_finished(self.background_evals)
+                    job = BackgroundEval(self.eval_counter, buf.number)
+                    self.background_evals[job.eval_id] = job
+                    threading.Thread(target=self._run_background_eval, args=(item, job), daemon=True).start()
+                    return
+
+                # Queue up async evaluation
+                self.eval_queue.put(item)
+
+    def _get_eval_limits(self) -> EvalLimits:
+        """The limits set for the current notebook with b:volcano_memory_limit, b:volcano_cpu_limit
+        and b:volcano_timeout, falling back to the g: variables of the same name"""
+        memory, cpu, timeout = self.nvim.eval(
+            "map(['memory_limit', 'cpu_limit', 'timeout'],"
+            " {_, name -> get(b:, 'volcano_' . name, get(g:, 'volcano_' . name, 0))})"
+        )
+        return limits_from_values(memory, cpu, timeout)
+
+    def _get_eval_connection(self, address: str) -> EvalConnection:
+        connection = self.eval_connections.get(address)
+        if connection is None:
+            token = self.nvim.vars.get("volcano_eval_worker_token") or os.environ.get(TOKEN_ENV)
+            if not token:
+                raise MoltenException(
+                    f"Set g:volcano_eval_worker_token or ${TOKEN_ENV} to the eval worker's token"
+                )
+            connection = self.eval_connections[address] = EvalConnection(address, token)
+        return connection
 
     def _evaluate_all_cells(self, delay=False):
         pass
@@ -783,273 +869,228 @@ class Molten:
                     self.eval_queue.task_done()
                     break
 
-                bufnr = item["bufnr"]
-                expr = item["expr"]
-                start_line = item["start_line"]
-                end_line = item["end_line"]
-                eval_id = item["eval_id"]
-                cursor_pos = item["cursor_pos"]
-                win_handle = item["win_handle"]
-                delay = item.get("delay", False)
-
-                def update_output_block(lines):
-                    def _do_update():
-                        try:
-                            buf = self.nvim.buffers[bufnr]
-                            code_lines = expr.splitlines()
-
-                            out_start, out_end = None, None
-                            found_output = False
-                            for j in range(end_line + 1, len(buf)):
-                                line = buf[j].strip()
-                                if not found_output and line == "<output>":
-                                    out_start = j
-                                    found_output = True
-                                elif found_output and line == "</output>":
-                                    out_end = j
-                                    break
-                            while lines and not lines[-1].strip():
-                                lines.pop()
-                            if out_start is not None and out_end is not None:
-                                buf.api.set_lines(out_start + 1, out_end, False, lines)
-                                self.nvim.command("undojoin")
-                            else:
-                                insert_lines = ["", "<output>"] + lines + ["</output>"]
-                                buf.api.set_lines(end_line + 1, end_line + 1, False, insert_lines)
-                                self.nvim.command("undojoin")
-                        except Exception:
-                            pass
-                    self.nvim.async_call(_do_update)
-
-                ns_result = []
-                ns_ready = threading.Event()
-                def _load_namespaces():
-                    try:
-                        namespaces_path = f"{self.nvim.eval('expand(\"%:p\")')}.json"
-                        if os.path.exists(namespaces_path):
-                            try:
-                                with open(namespaces_path, "r", encoding="utf-8") as f:
-                                    ns = json.load(f)
-                            except Exception:
-                                ns = {"variables": {}, "imports": []}
-                        else:
-                            ns = {"variables": {}, "imports": []}
-                        ns_result.append((namespaces_path, ns))
-                    finally:
-                        ns_ready.set()
-                self.nvim.async_call(_load_namespaces)
-                ns_ready.wait()
-                load_namespaces, ns = ns_result[0]
-
-                lines_so_far = [f"[{eval_id}][*] 0.00 seconds..."]
-
-                if delay:
-                    while self.eval_wait:
-                        time.sleep(1)
-
-                output_queue = multiprocessing.Queue()
-
-                def run_eval(code, q, pre_vars, imports_initial, load_namespaces):
-
-                    class StreamingStdout(io.TextIOBase):
-                        def __init__(self, qq):
-                            self.q = qq
-                            self._buffer = ""
-                        def write(self, text):
-                            if not text:
-                                return
-                            self._buffer += text
-                            while "\n" in self._buffer:
-                                line, self._buffer = self._buffer.split("\n", 1)
-                                self.q.put(("line", line))
-                        def flush(self):
-                            if self._buffer:
-                                self.q.put(("line", self._buffer))
-                                self._buffer = ""
-
-                    def jsonable_vars(globs, baseline_keys):
-                        out = {}
-                        for k, v in globs.items():
-                            if k in baseline_keys or k.startswith("__"):
-                                continue
-                            if isinstance(v, ModuleType):
-                                continue
-                            try:
-                                json.dumps(v)
-                            except Exception:
-                                continue
-                            out[k] = v
-                        return out
-
-                    def extract_imports_from_src(src):
-                        imps = []
-                        for _line in src.splitlines():
-                            s = _line.strip()
-                            if s.startswith("import ") or s.startswith("from "):
-                                imps.append(s)
-                        return imps
-
-                    def atomic_json_write(path, payload):
-                        tmp = path + ".tmp"
-                        with open(tmp, "w", encoding="utf-8") as f:
-                            json.dump(payload, f, indent=2, ensure_ascii=False)
-                        os.replace(tmp, path)
-
-                    error_happened = False
-                    globs = {}
-                    globs.update(pre_vars)
-
-                    imports_live = list(imports_initial) if imports_initial else []
-                    for imp in imports_live:
-                        try:
-                            exec(imp, globs)
-                        except Exception:
-                            pass
-
-                    old_stdout, old_stderr = sys.stdout, sys.stderr
-                    sys.stdout = sys.stderr = StreamingStdout(q)
-
-                    compiler = codeop.CommandCompiler()
-                    lines = code.splitlines()
-                    buf_accum = []
-                    baseline_keys = set(globs.keys())
-                    start_idx = 0
-
-                    try:
-                        for i, line in enumerate(lines):
-                            buf_accum.append(line)
-                            src = "\n".join(buf_accum)
-                            codeobj = compiler(src, filename="<string>", symbol="exec")
-                            if codeobj is None:
-                                continue
-                            try:
-                                exec(codeobj, globs)
-                            except BaseException as e:
-                                error_happened = True
-                                tb = traceback.extract_tb(e.__traceback__)
-                                code_lines = code.splitlines()
-                                user_lineno = None
-                                for frame in tb:
-                                    if frame.filename == "<string>":
-                                        user_lineno = frame.lineno + start_idx
-                                        break
-                                q.put(("line", "-" * 75))
-                                q.put(("line", f"{type(e).__name__}{' ' * 33}Traceback (most recent call last)"))
-                                if user_lineno is not None and 1 <= user_lineno <= len(code_lines):
-                                    q.put(("line", f"Cell In[{eval_id}], line {user_lineno}"))
-                                    q.put(("line", f"----> {user_lineno} {code_lines[user_lineno - 1].strip()}"))
-                                    q.put(("line", ""))
-                                q.put(("line", f"{type(e).__name__}: {e}"))
-                                break
-
-                            new_imps = extract_imports_from_src(src)
-                            for imp in new_imps:
-                                if imp not in imports_live:
-                                    imports_live.append(imp)
-                            new_vars = jsonable_vars(globs, baseline_keys)
-                            baseline_keys = set(globs.keys())
-                            q.put(("globals", (new_vars, new_imps)))
-
-                            try:
-                                if os.path.exists(load_namespaces):
-                                    try:
-                                        with open(load_namespaces, "r", encoding="utf-8") as f:
-                                            ns_disk = json.load(f)
-                                    except Exception:
-                                        ns_disk = {"variables": {}, "imports": []}
-                                else:
-                                    ns_disk = {"variables": {}, "imports": []}
-
-                                ns_disk["variables"].update(new_vars)
-                                for imp in imports_live:
-                                    if imp not in ns_disk.get("imports", []):
-                                        ns_disk.setdefault("imports", []).append(imp)
+                self._run_eval_item(item)
 
-                                atomic_json_write(load_namespaces, ns_disk)
-
-                            except Exception as _e:
-                                q.put(("line", f"[persist warning] {type(_e).__name__}: {_e}"))
-
-                            buf_accum = []
-                            start_idx = i + 1
-                    finally:
-                        sys.stdout = old_stdout
-                        sys.stderr = old_stderr
-                        q.put(("done", error_happened))
-
-                process = multiprocessing.Process(
-                    target=run_eval,
-                    args=(expr, output_queue, ns["variables"], ns.get("imports", []), load_namespaces),
-                )
-                process.start()
-
-                start_time = time.time()
-                last_update_time = start_time
-                update_interval = 0.3
-                saw_done = False
-                error_occurred = False
+                self.eval_queue.task_done()
 
-                try:
-                    while True:
-                        got_item = False
-                        try:
-                            kind, payload = output_queue.get(timeout=0.05)
-                            got_item = True
-                        except queue.Empty:
-                            pass
-                        if got_item:
-                            if kind == "line":
-                                lines_so_far.append(str(payload))
-
-
-                            elif kind == "globals":
-                                new_vars, new_imports = payload
-                                ns["variables"].update(new_vars)
-                                for imp in new_imports:
-                                    if imp not in ns.setdefault("imports", []):
-                                        ns["imports"].append(imp)
-                            elif kind == "done":
-                                saw_done = True
-                                error_occurred = bool(payload)
-
-                        elapsed = time.time() - start_time
-                        lines_so_far[0] = f"[{eval_id}][*] {elapsed:.2f} seconds..."
-                        now = time.time()
-                        if now - last_update_time > update_interval:
-                            update_output_block(lines_so_far.copy())
-                            last_update_time = now
-                        if not process.is_alive() and saw_done:
-                            break
-                        if not process.is_alive() and not got_item:
-                            break
-                finally:
-                    if process.is_alive():
-                        try:
-                            os.kill(process.pid, signal.SIGKILL)
-                        except ProcessLookupError:
-                            pass
-                        process.join(timeout=1)
-
-                elapsed = max(0.0, time.time() - start_time)
-                lines_so_far[0] = f"[{eval_id}][{'Error' if error_occurred else 'Done'}] {elapsed:.2f} seconds..."
-                update_output_block(lines_so_far.copy())
+            except Exception:
+                continue
 
+    def _run_background_eval(self, item, job: BackgroundEval):
+        try:
+            self._run_eval_item(item, job)
+        finally:
+            if job.status == BackgroundStatus.RUNNING:
+                job.finish(error=True)
+
+    def _run_eval_item(self, item, job: Optional[BackgroundEval] = None):
+        bufnr = item["bufnr"]
+        expr = item["expr"]
+        start_line = item["start_line"]
+        end_line = item["end_line"]
+        eval_id = item["eval_id"]
+        cursor_pos = item["cursor_pos"]
+        win_handle = item["win_handle"]
+        delay = item.get("delay", False)
+        limits = item.get("limits") or EvalLimits()
+
+        output_id = item.get("output_id")
+
+        def update_output_block(lines, final=False):
+            def _do_update():
                 try:
-                    tmp = load_namespaces + ".tmp"
-                    with open(tmp, "w", encoding="utf-8") as f:
-                        json.dump(ns, f, indent=2, ensure_ascii=False)
-                    os.replace(tmp, load_namespaces)
+                    self._write_output(bufnr, eval_id, output_id, lines, final)
                 except Exception:
                     pass
+            self.nvim.async_call(_do_update)
 
-                self.eval_queue.task_done()
+        ns_result = []
+        ns_ready = threading.Event()
+        def _load_namespaces():
+            try:
+                namespaces_path = f"{self.nvim.eval('expand(\"%:p\")')}.json"
+                if os.path.exists(namespaces_path):
+                    try:
+                        with open(namespaces_path, "r", encoding="utf-8") as f:
+                            ns = json.load(f)
+                    except Exception:
+                        ns = {"variables": {}, "imports": []}
+                else:
+                    ns = {"variables": {}, "imports": []}
+                ns_result.append((namespaces_path, ns))
+            finally:
+                ns_ready.set()
+        self.nvim.async_call(_load_namespaces)
+        ns_ready.wait()
+        load_namespaces, ns = ns_result[0]
+
+        lines_so_far = [f"[{eval_id}][*] 0.00 seconds..."]
+
+        if delay:
+            while self.eval_wait:
+                time.sleep(1)
+
+        address = item.get("eval_worker")
+        if address:
+            worker = RemoteEvalWorker(
+                self._get_eval_connection(address),
+                expr,
+                eval_id,
+                ns["variables"],
+                ns.get("imports", []),
+                item.get("parallel"),
+                limits,
+            )
+        elif job is None:
+            # queued cells share the notebook's worker and its event loop, so their tasks live on
+            worker = self._get_notebook_worker(bufnr).cell(
+                expr,
+                eval_id,
+                ns["variables"],
+                ns.get("imports", []),
+                load_namespaces,
+                item.get("parallel"),
+                limits,
+            )
+        else:
+            worker = EvalWorker(
+                expr,
+                eval_id,
+                ns["variables"],
+                ns.get("imports", []),
+                load_namespaces,
+                item.get("parallel"),
+                limits,
+            )
+        worker.start()
+        if job is not None:
+            job.attach(worker)
+
+        start_time = time.time()
+        last_update_time = start_time
+        update_interval = 0.3
+        saw_done = False
+        error_occurred = False
+        # index of the line that progress events overwrite
+        progress_line = None
+        # which limit the worker was killed for, if any
+        killed = None
+        # what this cell defined, other cells may be saving theirs at the same time
+        own_vars: Dict[str, Any] = {}
+        own_imports: List[str] = []
 
+        try:
+            while True:
+                got_item = False
+                try:
+                    kind, payload = worker.get(timeout=0.05)
+                    got_item = True
+                except queue.Empty:
+                    pass
+                if got_item:
+                    if kind == "line":
+                        lines_so_far.append(str(payload))
+                    elif kind == "progress":
+                        if progress_line is None:
+                            progress_line = len(lines_so_far)
+                            lines_so_far.append(str(payload))
+                        else:
+                            lines_so_far[progress_line] = str(payload)
+
+                    elif kind == "globals":
+                        new_vars, new_imports = payload
+                        own_vars.update(new_vars)
+                        for imp in new_imports:
+                            if imp not in own_imports:
+                                own_imports.append(imp)
+                    elif kind == "killed":
+                        killed = payload
+                    elif kind == "done":
+                        saw_done = True
+                        error_occurred = bool(payload)
+
+                elapsed = time.time() - start_time
+                lines_so_far[0] = f"[{eval_id}][*] {elapsed:.2f} seconds..."
+                now = time.time()
+                if killed is None:
+                    killed = worker.watchdog(elapsed)
+                if now - last_update_time > update_interval:
+                    update_output_block(lines_so_far.copy())
+                    last_update_time = now
+                if not worker.is_alive() and saw_done:
+                    break
+                if not worker.is_alive() and not got_item:
+                    break
+        finally:
+            if worker.is_alive():
+                worker.kill()
+
+        cancelled = job is not None and job.status == BackgroundStatus.CANCELLED
+        if killed is None and not cancelled:
+            killed = worker.exit_reason()
+        if killed is not None:
+            lines_so_far.append(limits.killed_message(killed))
+            error_occurred = True
+
+        elapsed = max(0.0, time.time() - start_time)
+        status = "Error" if error_occurred else "Done"
+        if job is not None:
+            if cancelled:
+                status = "Cancelled"
+            job.finish(error_occurred)
+        lines_so_far[0] = f"[{eval_id}][{status}] {elapsed:.2f} seconds..."
+        update_output_block(lines_so_far.copy(), final=True)
+
+        # local workers save their namespace themselves, after every statement
+        if address:
+            self._merge_namespace(load_namespaces, own_vars, own_imports)
+
+    def _get_notebook_worker(self, bufnr: int) -> NotebookWorker:
+        """The notebook's worker, a new one if it's not running, eg. after a limit killed it"""
+        worker = self.notebook_workers.get(bufnr)
+        if worker is not None and worker.is_alive():
+            return worker
+        worker = self.notebook_workers[bufnr] = NotebookWorker()
+        worker.start()
+        return worker
+
+    def _stop_notebook_workers(self) -> None:
+        for worker in self.notebook_workers.values():
+            worker.stop()
+        self.notebook_workers.clear()
+
+    def _merge_namespace(self, path: str, variables: Dict[str, Any], imports: List[str]) -> None:
+        """Add what a cell defined to the namespace file. Queued and %%background cells finish in
+        any order, so only the cell's own keys are written, over what's on disk by then."""
+        if not variables and not imports:
+            return
+        with self.namespace_lock:
+            try:
+                if os.path.exists(path):
+                    with open(path, "r", encoding="utf-8") as f:
+                        ns = json.load(f)
+                else:
+                    ns = {"variables": {}, "imports": []}
+                ns.setdefault("variables", {}).update(variables)
+                for imp in imports:
+                    if imp not in ns.setdefault("imports", []):
+                        ns["imports"].append(imp)
+                tmp = path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(ns, f, indent=2, ensure_ascii=False)
+                os.replace(tmp, path)
             except Exception:
-                continue
+                pass
 
 
     def _restart_kernel(self):
         """Restart the entire Molten kernel environment and reset eval state."""
+        # background cells belong to the old session, and their ids are about to be reused
+        for job in self.background_evals.values():
+            job.cancel()
+        self.background_evals.clear()
+        self._stop_notebook_workers()
+
         # terminate any running evaluation process
         if self.current_eval_process and self.current_eval_process.is_alive():
             pid = self.current_eval_pid
@@ -1153,16 +1194,7 @@ class Molten:
 
                     # Write as interpreted Python script
                     with open(interpreted_path, "w", encoding="utf-8") as f_out:
-                        for cell in nb_data.get("cells", []):
-                            if cell.get("cell_type") == "code":
-                                f_out.write("<cell>\n")
-                                source_lines = cell.get("source", [])
-                                if source_lines:
-                                    for line in source_lines:
-                                        f_out.write(line if line.endswith("\n") else line + "\n")
-                                else:
-                                    f_out.write("\n")  # empty line for empty cells
-                                f_out.write("</cell>\n\n")
+                        f_out.write("\n".join(cells_to_lines(nb_data.get("cells", []))) + "\n")
 
                     # Verify the interpreted file exists
                     if os.path.isfile(interpreted_path):
@@ -1177,6 +1209,9 @@ class Molten:
                 except Exception as e:
                     self.nvim.command(f"echoerr 'Failed to convert notebook: {e}'")
 
+        self._update_large_notebook(self.nvim.current.buffer)
+        self._render_stored_outputs(self.nvim.current.buffer)
+
         self._initialize_if_necessary()
 
         shared = False
@@ -1213,6 +1248,8 @@ class Molten:
                 self.buffers[buf.number].remove(kernel)
                 if len(self.buffers[buf.number]) == 0:
                     del self.buffers[buf.number]
+                    if buf.valid and buf.number not in self.output_stores:
+                        buf.vars["molten_attached"] = 0
             del self.molten_kernels[kernel.kernel_id]
 
     def _do_evaluate_expr(self, kernel_name: str, expr):
@@ -1261,26 +1298,8 @@ class Molten:
                 nb_data = json.load(f)
 
             # Parse buffer contents
-            cells = []
-            cell_lines = []
-            in_cell = False
-
-            for line in self.nvim.current.buffer:
-                if line.strip() == "<cell>":
-                    in_cell = True
-                    cell_lines = []
-                elif line.strip() == "</cell>":
-                    in_cell = False
-                    # Always write as code cell
-                    cells.append({
-                        "cell_type": "code",
-                        "execution_count": None,
-                        "metadata": {},
-                        "outputs": [],
-                        "source": [l for l in cell_lines]
-                    })
-                elif in_cell:
-                    cell_lines.append(line)
+            lines = self.nvim.current.buffer[:]
+            cells = blocks_to_cells(lines, parse_blocks(lines))
 
             # Update and save
             nb_data["cells"] = cells
@@ -1307,7 +1326,55 @@ class Molten:
     @pynvim.command("VolcanoInfo", nargs=0, sync=True)  # type: ignore
     @nvimui  # type: ignore
     def command_info(self) -> None:
-        create_info_window(self.nvim, self.molten_kernels, self.buffers, self.initialized)
+        create_info_window(
+            self.nvim, self.molten_kernels, self.buffers, self.initialized, self.background_evals
+        )
+
+    @pynvim.command("VolcanoCancelBackground", nargs="*", sync=True)  # type: ignore
+    @nvimui  # type: ignore
+    def command_cancel_background(self, args: List[str]) -> None:
+        """Cancel the %%background cell with the given eval id, or every running background cell
+        of the current buffer when no id is given."""
+        if len(args) > 0:
+            try:
+                eval_id = int(args[0])
+            except ValueError:
+                raise MoltenException(f"Invalid eval id: {args[0]}")
+            job = self.background_evals.get(eval_id)
+            if job is None:
+                raise MoltenException(f"No background cell with eval id {eval_id}")
+            jobs = [job]
+        else:
+            bufnr = self.nvim.current.buffer.number
+            jobs = [x for x in self.background_evals.values() if x.bufnr == bufnr]
+
+        cancelled = [str(job.eval_id) for job in jobs if job.cancel()]
+        if len(cancelled) == 0:
+            notify_warn(self.nvim, "No running background cells to cancel")
+        else:
+            notify_info(self.nvim, f"Cancelled background cell(s): {', '.join(cancelled)}")
+
+    @pynvim.command("VolcanoOpenOutput", nargs=0, sync=True)  # type: ignore
+    @nvimui
+    def command_open_output(self) -> None:
+        """Open the whole stored output of the cell under the cursor in a scratch window"""
+        buf = self.nvim.current.buffer
+        row = self.nvim.current.window.cursor[0] - 1
+        block = self.cell_index.block_at(buf, row)
+        if block is not None and block.kind != "output":
+            block = self.cell_index.output_after(buf, block.end)
+        output_id = parse_output_anchor(buf[block.start]) if block is not None else None
+        store = self._get_output_store(buf)
+        if output_id is None or store is None:
+            raise MoltenException("No stored output under the cursor")
+
+        lines = store.get(output_id)
+        self.nvim.command("botright new")
+        scratch = self.nvim.current.buffer
+        scratch.options["buftype"] = "nofile"
+        scratch.options["bufhidden"] = "wipe"
+        scratch.api.set_lines(0, -1, False, lines)
+        scratch.options["modifiable"] = False
 
     def _do_evaluate(self, kernel_name: str, pos: Tuple[Tuple[int, int], Tuple[int, int]]) -> None:
         self._initialize_if_necessary()
@@ -1586,43 +1653,26 @@ class Molten:
         buf = self.nvim.current.buffer
         win = self.nvim.current.window
         cursor_pos = win.cursor
-        total_lines = len(buf)
 
         # Find current cell
-        active_block = None
-        cell_blocks = []
-        i = 0
-        while i < total_lines:
-            if buf[i].strip() == "<cell>":
-                start = i
-                i += 1
-                while i < total_lines and buf[i].strip() != "</cell>":
-                    i += 1
-                if i < total_lines:
-                    end = i
-                    cell_blocks.append((start, end))
-                    if start <= cursor_pos[0]-1 <= end:
-                        active_block = (start, end)
-            i += 1
-
+        active_block = self.cell_index.cell_at(buf, cursor_pos[0] - 1)
         if not active_block:
             return
 
-        _, end_line = active_block
+        end_line = active_block.end
 
         # Move to next cell or create one
         def _move_cursor_after_output():
-            buf_lines = buf[:]
-            for i in range(end_line + 1, len(buf_lines)):
-                if buf_lines[i].strip() == "<cell>":
-                    win.cursor = (i + 1, 0)
-                    return
+            next_cell = self.cell_index.next_block(buf, end_line + 1, "cell")
+            if next_cell is not None:
+                win.cursor = (next_cell.start + 1, 0)
+                return
 
             # No next cell — insert one with spacing
-            insert_line = len(buf_lines)
+            insert_line = len(buf)
 
             # Add a newline if the last line isn't empty
-            if buf_lines and buf_lines[-1].strip() != "":
+            if buf[-1].strip() != "":
                 buf.api.set_lines(insert_line, insert_line, False, [""])
                 insert_line += 1
 
@@ -1637,10 +1687,7 @@ class Molten:
     def command_volcano_evaluate_above(self, args: List[str]) -> None:
         buf = self.nvim.current.buffer
         win = self.nvim.current.window
-        cursor_pos = win.cursor
-        old_buf = buf[:]
-        buf.api.set_lines(0, -1, False, self._delete_output_block_elements(script_in_parts=buf[:], cursor_pos=cursor_pos, delete="Up", amount=0))
-        self._restore_cursor_pos(old_buf, buf, win, cursor_pos)
+        self._delete_outputs(buf, win.cursor[0] - 1, delete="Up")
         cursor_pos = win.cursor[0] - 1
         try:
             while True:
@@ -1660,36 +1707,21 @@ class Molten:
         win = self.nvim.current.window
         cursor_row = win.cursor[0]
 
-        buf_obj[cursor_row:] = self._clean_output_blocks(buf_obj[cursor_row:])
-
-        buf = buf_obj[:]
-        cursor_line = win.cursor[0] - 1 
-
-        def run():
-            cell_lines = []
-            for i in range(cursor_line, len(buf)):
-                if buf[i].strip() == "<cell>":
-                    cell_lines.append(i)
-
-            first_cell = True
-            first_offset = 4
-            offset_accumulator = 0 
-
-            for cell_line in cell_lines:
-                adjusted_line = cell_line + offset_accumulator
-
-                if first_cell:
-                    self.nvim.async_call(lambda l=adjusted_line: setattr(win, "cursor", (l + 1, 0)))
-                    self.nvim.async_call(lambda: self._evaluate_cell(delay=True))
-                    first_cell = False
-                else:
-                    self.nvim.async_call(lambda l=adjusted_line + first_offset: setattr(win, "cursor", (l + 1, 0)))
-                    self.nvim.async_call(lambda: self._evaluate_cell())
-                    offset_accumulator += first_offset
+        self._delete_outputs(buf_obj, cursor_row, delete="Down")
 
-                time.sleep(0.01)
+        def evaluate_from(row: int, first: bool) -> None:
+            # looked up again every time, the outputs inserted so far moved the cells below them
+            # by however many lines they took
+            if self.nvim.current.window != win or self.nvim.current.buffer != buf_obj:
+                return
+            block = self.cell_index.next_block(buf_obj, row, "cell")
+            if block is None:
+                return
+            win.cursor = (block.start + 1, 0)
+            self._evaluate_cell(delay=first)
+            self.nvim.async_call(evaluate_from, block.end + 1, False)
 
-        threading.Thread(target=run, daemon=True).start()
+        evaluate_from(cursor_row - 1, True)
 
     @pynvim.command("VolcanoDeleteOutput", nargs="*", sync=True)
     @nvimui
@@ -1699,72 +1731,39 @@ class Molten:
         cursor_pos = win.cursor
         if self._is_cursor_above_cell_block(buf, win, cursor_pos) == True:
             if self._is_output_block_under_current_element_block(buf, win, cursor_pos) == True:
-                buf.api.set_lines(0, -1, False, self._delete_output_block_elements(script_in_parts=buf[:], cursor_pos=cursor_pos, delete="Down", amount=1))
+                self._delete_outputs(buf, cursor_pos[0] - 1, delete="Down", amount=1)
 
     @pynvim.command("VolcanoDeleteAllOutputs", nargs="*", sync=True)
     @nvimui
     def command_volcano_delete_all_outputs(self, args: List[str]) -> None:
-        buf = self.nvim.current.buffer
-        win = self.nvim.current.window
-        cursor_pos = win.cursor
-        buf.api.set_lines(0, -1, False, self._delete_output_block_elements(script_in_parts=buf[:], cursor_pos=cursor_pos, delete="Entire"))
+        self._delete_outputs(self.nvim.current.buffer)
 
 
     @pynvim.command("VolcanoDeleteOutputsAbove", nargs="*", sync=True)
     @nvimui
     def command_volcano_delete_outputs_above(self, args: List[str]) -> None:
         buf = self.nvim.current.buffer
-        cursor_row = self.nvim.current.window.cursor[0]
-
-        if '<output>' in buf[cursor_row - 1]:
-            if cursor_row < len(buf): 
-                cursor_row += 1
-                self.nvim.current.window.cursor = (cursor_row, 0)
+        row = self.nvim.current.window.cursor[0] - 1
 
-        new_buf = self._clean_output_blocks(buf[0:cursor_row - 1])
-
-        if new_buf == False:
-            while new_buf == False:
-                if cursor_row < len(buf):
-                    cursor_row += 1
-                    self.nvim.current.window.cursor = (cursor_row, 0)
-                    new_buf = self._clean_output_blocks(buf[0:cursor_row - 1])
-                else:
-                    break
+        # an output the cursor is in goes too
+        block = self.cell_index.block_at(buf, row)
+        if block is not None and block.kind == "output":
+            row = block.end
 
-        if new_buf != False:
-            buf[0:cursor_row - 1] = self._clean_output_blocks(buf[0:cursor_row - 1])
+        self._delete_outputs(buf, row, delete="Up")
 
     @pynvim.command("VolcanoDeleteOutputsBelow", nargs="*", sync=True)
     @nvimui
     def command_volcano_delete_outputs_below(self, args: List[str]) -> None:
         buf = self.nvim.current.buffer
-        win = self.nvim.current.window
-        cursor_row = self.nvim.current.window.cursor[0]
+        row = self.nvim.current.window.cursor[0] - 1
 
-        for line in range(cursor_row, len(buf) + 1):
-            if buf[line - 1].strip() == "<cell>":
-                cursor_row = line - 1
-                break
-            elif buf[line - 1].strip() == "</cell>":
-                back_line = line - 2
-                while back_line >= 0:
-                    if back_line == 1:
-                        cursor_row = 1
-                        break
-                    elif buf[back_line].strip() == "<cell>":
-                        cursor_row = back_line
-                        break
-                    back_line -= 1
-                break
-
-        win.cursor = (cursor_row, 0)
-
-        buf = self.nvim.current.buffer
-        win = self.nvim.current.window
-        cursor_row = self.nvim.current.window.cursor[0]
+        # starting with the output of the cell the cursor is in
+        block = self.cell_index.block_at(buf, row)
+        if block is not None:
+            row = block.start
 
-        buf[cursor_row:] = self._clean_output_blocks(buf[cursor_row:])
+        self._delete_outputs(buf, row, delete="Down")
 
     @pynvim.command("VolcanoSwitchCellTypeForward", nargs="*", sync=True)
     @nvimui
@@ -1802,85 +1801,33 @@ class Molten:
     def command_volcano_delete_cell(self, args: List[str]) -> None:
         buf = self.nvim.current.buffer
         cursor_row = self.nvim.current.window.cursor[0] - 1  # 0-based
-        total_lines = len(buf)
-
-        def find_tag_block(start_row: int, open_tag: str, close_tag: str):
-            """Find the inclusive range for a tag block surrounding the cursor."""
-            open_idx, close_idx = None, None
-
-            # Search upward for opening tag
-            for i in range(start_row, -1, -1):
-                if buf[i].strip() == open_tag:
-                    open_idx = i
-                    break
-
-            # Search downward for closing tag
-            for j in range(start_row, total_lines):
-                if buf[j].strip() == close_tag:
-                    close_idx = j
-                    break
-
-            if open_idx is not None and close_idx is not None:
-                return (open_idx, close_idx)
-            return None
-
-        def find_output_block(after_row: int):
-            """Find next <output> block (if any) after a given line index."""
-            open_idx, close_idx = None, None
-
-            for i in range(after_row + 1, total_lines):
-                if buf[i].strip() == "<output>":
-                    open_idx = i
-                    break
-
-            if open_idx is not None:
-                for j in range(open_idx, total_lines):
-                    if buf[j].strip() == "</output>":
-                        close_idx = j
-                        break
-
-            if open_idx is not None and close_idx is not None:
-                return (open_idx, close_idx)
-            return None
-
-        def delete_range(start: int, end: int):
-            """Delete inclusive range and clean up extra blank lines."""
-            del buf[start:end + 1]
-
-            # Remove stray blank line before
-            if start - 1 >= 0 and buf[start - 1].strip() == "":
-                del buf[start - 1]
-                start -= 1
-
-            # Remove stray blank line after (if not EOF)
-            if start < len(buf) and buf[start].strip() == "":
-                del buf[start]
 
         def run():
-            cell_block = find_tag_block(cursor_row, "<cell>", "</cell>")
+            cell_block = self.cell_index.cell_at(buf, cursor_row)
             if not cell_block:
                 self.nvim.err_write("No <cell> block found under cursor.\n")
                 return
 
-            cell_start, cell_end = cell_block
-            output_block = find_output_block(cell_end)
-
-            # Delete output block first (if exists)
-            if output_block:
-                delete_range(output_block[0], output_block[1])
-
-            # Adjust in case lines shifted
-            new_total = len(buf)
-            shift = (total_lines - new_total)
-            if shift > 0 and output_block and output_block[0] < cell_start:
-                cell_start -= shift
-                cell_end -= shift
-
-            delete_range(cell_start, cell_end)
-
-            # Reposition cursor safely
-            new_cursor = min(cell_start, len(buf) - 1)
-            self.nvim.current.window.cursor = (new_cursor + 1, 0)
+            # the cell goes together with its output, if it has one
+            start = cell_block.start
+            output_block = self.cell_index.output_after(buf, cell_block.end)
+            end = output_block.end if output_block else cell_block.end
+
+            with BufferTransaction(self.nvim, buf) as transaction:
+                lines = transaction.snapshot(max(start - 1, 0), end + 2)
+                assert transaction.line_count is not None
+                end += 1
+                # along with a stray blank line before and after it
+                if start > 0 and not lines[0].strip():
+                    start -= 1
+                if end < transaction.line_count and not lines[-1].strip():
+                    end += 1
+                transaction.set_lines(start, end, [])
+
+                # Reposition cursor safely
+                new_total = transaction.line_count - (end - start)
+                new_cursor = max(min(start, new_total - 1), 0)
+                transaction.set_cursor(self.nvim.current.window, new_cursor + 1)
 
         self.nvim.async_call(run)
 
@@ -1889,77 +1836,30 @@ class Molten:
     def command_volcano_copy_cell(self, args: List[str]) -> None:
         buf = self.nvim.current.buffer
         cursor_row = self.nvim.current.window.cursor[0] - 1  # 0-based
-        total_lines = len(buf)
-
-        def find_tag_block(start_row: int, open_tag: str, close_tag: str):
-            """Find inclusive range for a tag block surrounding the cursor."""
-            open_idx, close_idx = None, None
-
-            # Search upward for <cell>
-            for i in range(start_row, -1, -1):
-                if buf[i].strip() == open_tag:
-                    open_idx = i
-                    break
-
-            # Search downward for </cell>
-            for j in range(start_row, total_lines):
-                if buf[j].strip() == close_tag:
-                    close_idx = j
-                    break
-
-            if open_idx is not None and close_idx is not None:
-                return (open_idx, close_idx)
-            return None
-
-        def find_output_block(after_row: int):
-            """Find next <output> block (if any) after a given line index."""
-            open_idx, close_idx = None, None
-
-            for i in range(after_row + 1, total_lines):
-                if buf[i].strip() == "<output>":
-                    open_idx = i
-                    break
-
-            if open_idx is not None:
-                for j in range(open_idx, total_lines):
-                    if buf[j].strip() == "</output>":
-                        close_idx = j
-                        break
-
-            if open_idx is not None and close_idx is not None:
-                return (open_idx, close_idx)
-            return None
-
 
         def run():
-            cell_block = find_tag_block(cursor_row, "<cell>", "</cell>")
+            cell_block = self.cell_index.cell_at(buf, cursor_row)
             if not cell_block:
                 self.nvim.err_write("No <cell> block found under cursor.\n")
                 return
 
-            cell_start, cell_end = cell_block
-            final_start, final_end = cell_start, cell_end
-
-            # Search for <output> directly after *this* cell
-            next_line = cell_end + 1
-            while next_line < total_lines and buf[next_line].strip() == "":
-                # skip blank lines between </cell> and <output>
-                next_line += 1
-
-            if next_line < total_lines and buf[next_line].strip() == "<output>":
-                output_block = find_tag_block(next_line, "<output>", "</output>")
-                if output_block:
-                    final_end = output_block[1]
-
-            # Move cursor to start
-            self.nvim.command(f"normal! {final_start + 1}G")
-            # Enter Visual Line mode
-            self.nvim.command("normal! V")
-            # Move down to end line
-            if final_end > final_start:
-                self.nvim.command(f"normal! {final_end - final_start}j")
-            # Yank selection
-            self.nvim.command("normal! y")
+            final_start, final_end, _ = cell_block
+
+            # Take the <output> directly after *this* cell along
+            output_block = self.cell_index.output_after(buf, final_end)
+            self.copied_outputs = {}
+            if output_block:
+                final_end = output_block.end
+                # the anchor is pasted with a new id, the stored output is copied then
+                output_id = parse_output_anchor(buf[output_block.start])
+                store = self.output_stores.get(buf.number)
+                if output_id is not None and store is not None:
+                    self.copied_outputs[output_id] = list(store.get(output_id))
+
+            # Move cursor to start and yank the lines
+            with BufferTransaction(self.nvim, buf) as transaction:
+                transaction.set_cursor(self.nvim.current.window, final_start + 1)
+                transaction.command(f"{final_start + 1},{final_end + 1}yank")
 
         self.nvim.async_call(run)
 
@@ -1968,46 +1868,6 @@ class Molten:
     def command_volcano_Paste_cell(self, args: List[str]) -> None:
         buf = self.nvim.current.buffer
         cursor_row = self.nvim.current.window.cursor[0] - 1  # 0-based
-        total_lines = len(buf)
-
-        def find_tag_block(start_row: int, open_tag: str, close_tag: str):
-            """Find inclusive range for a tag block surrounding the cursor."""
-            open_idx, close_idx = None, None
-
-            # Search upward for opening tag
-            for i in range(start_row, -1, -1):
-                if buf[i].strip() == open_tag:
-                    open_idx = i
-                    break
-
-            # Search downward for closing tag
-            for j in range(start_row, total_lines):
-                if buf[j].strip() == close_tag:
-                    close_idx = j
-                    break
-
-            if open_idx is not None and close_idx is not None:
-                return (open_idx, close_idx)
-            return None
-
-        def find_output_block(after_row: int):
-            """Find the next <output> block after a given line index."""
-            open_idx, close_idx = None, None
-
-            for i in range(after_row + 1, total_lines):
-                if buf[i].strip() == "<output>":
-                    open_idx = i
-                    break
-
-            if open_idx is not None:
-                for j in range(open_idx, total_lines):
-                    if buf[j].strip() == "</output>":
-                        close_idx = j
-                        break
-
-            if open_idx is not None and close_idx is not None:
-                return (open_idx, close_idx)
-            return None
 
         def run():
             try:
@@ -2026,18 +1886,17 @@ class Molten:
                 return
 
             # Find the current cell block
-            cell_block = find_tag_block(cursor_row, "<cell>", "</cell>")
+            cell_block = self.cell_index.cell_at(buf, cursor_row)
             if not cell_block:
                 self.nvim.err_write("No <cell> block found under cursor.\n")
                 return
 
-            cell_start, cell_end = cell_block
-            insert_after = cell_end
+            insert_after = cell_block.end
 
             # If the current cell has an output, insert after it
-            output_block = find_output_block(cell_end)
+            output_block = self.cell_index.output_after(buf, cell_block.end)
             if output_block:
-                insert_after = output_block[1]
+                insert_after = output_block.end
 
             insert_row = insert_after + 1  # position just after current block
 
@@ -2045,12 +1904,14 @@ class Molten:
             insert_content = [""] + yank_lines
             if not insert_content[-1].strip():
                 insert_content = insert_content[:-1]  # remove trailing empty line
+            insert_content, anchors = self._copy_stored_outputs(buf, insert_content)
 
-            # Insert new block
-            buf[insert_row:insert_row] = insert_content
-
-            # Move cursor to start of newly inserted block
-            self.nvim.command(f"normal! {insert_row + 1}G")
+            # Insert new block and move cursor to its start
+            with BufferTransaction(self.nvim, buf) as transaction:
+                transaction.set_lines(insert_row, insert_row, insert_content)
+                transaction.set_cursor(self.nvim.current.window, insert_row + 1)
+            for offset, output_id in anchors:
+                self._render_stored_output(buf, output_id, insert_row + offset)
 
         self.nvim.async_call(run)
 
@@ -2110,17 +1971,13 @@ class Molten:
         # update queued cells to reflect that they were interrupted
         try:
             for buf in self.nvim.buffers:
-                lines = list(buf[:])
-                changed = False
-                for i, line in enumerate(lines):
-                    # replace queued status indicator with Kernel_Interrupted
-                    if "[*]" in line and "queue" in line:
-                        idx = line.find("[*]")
-                        prefix = line[:idx]
-                        lines[i] = f"{prefix}[Kernel_Interrupted]"
-                        changed = True
-                if changed:
-                    buf[:] = lines
+                with BufferTransaction(self.nvim, buf) as transaction:
+                    for i, line in enumerate(buf[:]):
+                        # replace queued status indicator with Kernel_Interrupted
+                        if "[*]" in line and "queue" in line:
+                            idx = line.find("[*]")
+                            prefix = line[:idx]
+                            transaction.set_lines(i, i + 1, [f"{prefix}[Kernel_Interrupted]"])
         except Exception:
             pass
 
@@ -2135,9 +1992,8 @@ class Molten:
         buf_obj = self.nvim.current.buffer
         win = self.nvim.current.window
         win.cursor = (1, 0)
-        cursor_row = self.nvim.current.window.cursor[0]
         self._restart_kernel()
-        buf_obj[cursor_row:] = self._clean_output_blocks(buf_obj[cursor_row:])
+        self._delete_outputs(buf_obj)
 
     @pynvim.command("VolcanoRestartAndEvaluateAll", nargs="*", sync=True, bang=True)
     @nvimui  # type: ignore
@@ -2177,7 +2033,7 @@ class Molten:
         assert molten_kernels is not None
 
         for molten in molten_kernels:
-            if molten.current_output is not None:
+            if molten.outputs:
                 molten.should_show_floating_win = True
                 self._update_interface()
                 return
@@ -2346,6 +2202,15 @@ class Molten:
         if not abuf_str:
             return
 
+        notebook_worker = self.notebook_workers.pop(int(abuf_str), None)
+        if notebook_worker is not None:
+            notebook_worker.stop()
+
+        # the finished background cells of the buffer go with it, running ones are still listed
+        for job in list(self.background_evals.values()):
+            if job.bufnr == int(abuf_str) and job.status != BackgroundStatus.RUNNING:
+                del self.background_evals[job.eval_id]
+
         molten = self.buffers.get(int(abuf_str))
         if molten is None:
             return
@@ -2361,23 +2226,57 @@ class Molten:
     @nvimui  # type: ignore
     def function_molten_tick(self, _: Any) -> None:
         self._initialize_if_necessary()
+        self.timer = None
+        # the next tick is scheduled even if this one fails, or ticking would stop until a kernel
+        # gets a request
+        delay = self.options.tick_rate
+        try:
+            # Messages are applied as they come by _apply_messages, for every kernel. The tick is
+            # left with waiting for kernels to be ready and keeping the running clock up to date.
+            molten_kernels = self._get_current_buf_kernels(False)
+            if molten_kernels is not None:
+                for m in molten_kernels:
+                    m.tick()
+
+            # Tick at tick_rate while a kernel has work in flight. Once they're all idle, back off
+            # up to 16 times slower, nothing comes in without a request anyway and _wake_tick is
+            # called as soon as a kernel gets one.
+            if molten_kernels and any(kernel.has_backlog() for kernel in molten_kernels):
+                # this tick ran out of budget, carry on once the editor had its turn
+                self.idle_ticks = 0
+                delay = 0
+            elif any(kernel.is_busy() for kernel in self.molten_kernels.values()):
+                self.idle_ticks = 0
+            else:
+                delay = self.options.tick_rate * 2 ** min(self.idle_ticks, 4)
+                self.idle_ticks += 1
+        finally:
+            self._schedule_tick(delay)
+
+    def _notify_messages(self) -> None:
+        """Called from the kernel loop when runtimes received messages. Schedules
+        one _apply_messages on the main thread, however many kernels call this before it runs."""
+        with self.apply_lock:
+            if self.apply_scheduled:
+                return
+            self.apply_scheduled = True
+        self.nvim.async_call(self._apply_messages)
 
-        molten_kernels = self._get_current_buf_kernels(False)
-        if molten_kernels is None:
-            return
-
+    def _apply_messages(self) -> None:
+        with self.apply_lock:
+            self.apply_scheduled = False
+        molten_kernels = list(self.molten_kernels.values())
         for m in molten_kernels:
-            m.tick()
-
-    @pynvim.function("MoltenTickInput", sync=False) 
-    @nvimui  # type: ignore
-    def function_molten_tick_input(self, _: Any) -> None:
-        self._initialize_if_necessary()
-
-        molten_kernels = self._get_current_buf_kernels(False)
-        if molten_kernels is None:
-            return
-
+            # a kernel that just became ready is ticked too, to say so
+            if m.has_backlog() or not m.runtime.is_ready():
+                m.tick()
+        # input requests are checked outside of the ticks, a prompt mustn't hold them up
+        self.nvim.async_call(self._tick_input, molten_kernels)
+        if any(m.has_backlog() for m in molten_kernels):
+            # out of budget, carry on once the editor had its turn
+            self._notify_messages()
+
+    def _tick_input(self, molten_kernels: List[MoltenKernel]) -> None:
         for m in molten_kernels:
             m.tick_input()
 
@@ -2397,14 +2296,16 @@ class Molten:
     def function_update_interface(self, _: Any) -> None:
         self._update_interface()
 
-    @pynvim.function("MoltenOnCursorMoved", sync=True)
+    @pynvim.function("MoltenOnCursorMoved", sync=False)
     @nvimui
     def function_on_cursor_moved(self, _) -> None:
         self._on_cursor_moved()
 
-    @pynvim.function("MoltenOnWinScrolled", sync=True)
+    @pynvim.function("MoltenOnWinScrolled", sync=False)
     @nvimui
     def function_on_win_scrolled(self, _) -> None:
+        if self.output_stores:
+            self._render_stored_outputs(self.nvim.current.buffer)
         self._on_cursor_moved(scrolled=True)
 
     @pynvim.function("MoltenOperatorfunc", sync=True)
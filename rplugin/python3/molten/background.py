@@ -0,0 +1,86 @@
+import time
+from enum import Enum
+from typing import TYPE_CHECKING, Dict, Optional, Union
+
+if TYPE_CHECKING:
+    from molten.eval_remote import RemoteEvalWorker
+    from molten.eval_worker import EvalWorker, NotebookCell
+
+
+# finished background cells kept around for :VolcanoInfo and :VolcanoCancelBackground
+MAX_FINISHED_BACKGROUND = 20
+
+
+class BackgroundStatus(Enum):
+    RUNNING = 0
+    DONE = 1
+    ERROR = 2
+    CANCELLED = 3
+
+
+class BackgroundEval:
+    """A cell that runs outside of the eval queue. It gets its own worker process and streams into
+    its own <output> block, while the queued cells keep running against the shared namespace."""
+
+    eval_id: int
+    bufnr: int
+    start_time: float
+    end_time: Optional[float]
+    status: BackgroundStatus
+    worker: Optional[Union["EvalWorker", "RemoteEvalWorker", "NotebookCell"]]
+
+    def __init__(self, eval_id: int, bufnr: int):
+        self.eval_id = eval_id
+        self.bufnr = bufnr
+        self.start_time = time.time()
+        self.end_time = None
+        self.status = BackgroundStatus.RUNNING
+        self.worker = None
+
+    def elapsed(self) -> float:
+        end = self.end_time if self.end_time is not None else time.time()
+        return max(0.0, end - self.start_time)
+
+    def attach(self, worker: Union["EvalWorker", "RemoteEvalWorker", "NotebookCell"]) -> None:
+        self.worker = worker
+        # cancelled before the worker was up
+        if self.status == BackgroundStatus.CANCELLED:
+            self._kill()
+
+    def finish(self, error: bool) -> None:
+        self.end_time = time.time()
+        if self.status == BackgroundStatus.RUNNING:
+            self.status = BackgroundStatus.ERROR if error else BackgroundStatus.DONE
+
+    def cancel(self) -> bool:
+        """Kill the worker. Returns False if the cell already finished."""
+        if self.status != BackgroundStatus.RUNNING:
+            return False
+        self.status = BackgroundStatus.CANCELLED
+        self._kill()
+        return True
+
+    def _kill(self) -> None:
+        if self.worker is not None and self.worker.is_alive():
+            self.worker.kill()
+
+    def status_text(self) -> str:
+        match self.status:
+            case BackgroundStatus.RUNNING:
+                return "running"
+            case BackgroundStatus.DONE:
+                return "done"
+            case BackgroundStatus.ERROR:
+                return "error"
+            case BackgroundStatus.CANCELLED:
+                return "cancelled"
+
+
+def prune_finished(jobs: Dict[int, BackgroundEval], keep: int = MAX_FINISHED_BACKGROUND) -> None:
+    """Drop all but the keep most recent finished cells from jobs, running ones all stay"""
+    finished = sorted(
+        (job for job in jobs.values() if job.status != BackgroundStatus.RUNNING),
+        key=lambda job: job.eval_id,
+    )
+    for job in finished[: max(0, len(finished) - keep)]:
+        del jobs[job.eval_id]
@@ -0,0 +1,88 @@
+from typing import Any, List, Optional, Tuple
+
+from pynvim import Nvim
+from pynvim.api import Buffer, Window
+
+from molten.utils import MoltenException
+
+
+class BufferTransaction:
+    """Batches the changes a command makes to a buffer. Lines are read in one snapshot, and the
+    edits, cursor moves and commands are queued up and sent in a single nvim_call_atomic on
+    commit, so a command costs the same number of round trips whatever the size of the cells.
+
+    Used as a context manager, the transaction is committed when the block exits normally."""
+
+    nvim: Nvim
+    buf: Buffer
+    calls: List[List[Any]]
+    edits: List[Tuple[int, int, List[str]]]
+    line_count: Optional[int]
+
+    def __init__(self, nvim: Nvim, buf: Buffer, undojoin: bool = False):
+        self.nvim = nvim
+        self.buf = buf
+        self.undojoin = undojoin
+        self.calls = []
+        self.edits = []
+        self.cursor: Optional[Tuple[Window, int, int]] = None
+        self.line_count = None
+
+    def __enter__(self) -> "BufferTransaction":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.commit()
+
+    def snapshot(self, start: int, end: int) -> List[str]:
+        """Read lines [start, end) of the buffer, also fetches line_count in the same request"""
+        lines, self.line_count = self._call_atomic(
+            [
+                ["nvim_buf_get_lines", [self.buf, start, end, False]],
+                ["nvim_buf_line_count", [self.buf]],
+            ]
+        )
+        return lines
+
+    def set_lines(self, start: int, end: int, lines: List[str]) -> None:
+        """Replace lines [start, end). Edits must not overlap, they are applied bottom up on commit
+        so every edit is given in the line numbers from before the transaction."""
+        self.edits.append((start, end, lines))
+
+    def set_cursor(self, win: Window, row: int, col: int = 0) -> None:
+        """Move the cursor after the edits are applied, row is 1-indexed"""
+        self.cursor = (win, row, col)
+
+    def command(self, command: str) -> None:
+        """Run an ex command after the edits and the cursor move"""
+        self.calls.append(["nvim_command", [command]])
+
+    def call(self, function: str, *args: Any) -> None:
+        """Call an API function after the edits and the cursor move"""
+        self.calls.append([function, list(args)])
+
+    def commit(self) -> List[Any]:
+        """Apply everything in one request. Returns the results of the queued calls, in order."""
+        calls: List[List[Any]] = []
+        if self.undojoin and self.edits:
+            calls.append(["nvim_command", ["silent! undojoin"]])
+        for start, end, lines in sorted(self.edits, key=lambda edit: edit[0], reverse=True):
+            calls.append(["nvim_buf_set_lines", [self.buf, start, end, False, lines]])
+        if self.cursor is not None:
+            win, row, col = self.cursor
+            calls.append(["nvim_win_set_cursor", [win, [row, col]]])
+        calls.extend(self.calls)
+
+        queued = len(self.calls)
+        self.edits, self.calls, self.cursor = [], [], None
+        if not calls:
+            return []
+        results = self._call_atomic(calls)
+        return results[len(results) - queued :]
+
+    def _call_atomic(self, calls: List[List[Any]]) -> List[Any]:
+        results, error = self.nvim.api.call_atomic(calls)
+        if error is not None:
+            raise MoltenException(f"Failed to edit the buffer: {error[2]}")
+        return results
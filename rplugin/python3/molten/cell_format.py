@@ -0,0 +1,144 @@
+"""The Volcano notebook format: <cell>, <markdown> and <raw> blocks holding the cells, each code
+cell optionally followed by an <output> block. Tags sit on lines of their own."""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from molten.output_store import parse_output_anchor
+
+OPENING_TAGS = {"<cell>": "cell", "<markdown>": "markdown", "<raw>": "raw", "<output>": "output"}
+CLOSING_TAGS = {"</cell>": "cell", "</markdown>": "markdown", "</raw>": "raw", "</output>": "output"}
+
+# notebook cell_type to block kind, and back
+CELL_TYPES = {"code": "cell", "markdown": "markdown", "raw": "raw"}
+BLOCK_KINDS = {kind: cell_type for cell_type, kind in CELL_TYPES.items()}
+
+
+@dataclass
+class Block:
+    kind: str
+    """cell, markdown, raw or output"""
+    start: int
+    """0-indexed line of the opening tag"""
+    end: int
+    """0-indexed line of the closing tag, or the last line of the file if the block isn't closed"""
+    closed: bool = True
+    output_id: Optional[int] = None
+    """for outputs kept in the OutputStore, the id of the `<output id=N/>` anchor"""
+
+    def body(self, lines: Sequence[str]) -> Sequence[str]:
+        """The lines between the tags"""
+        return lines[self.start + 1 : self.end if self.closed else self.end + 1]
+
+
+def parse_blocks(lines: Sequence[str]) -> List[Block]:
+    """Split the lines of a notebook into blocks, in a single pass. Inside a block every line up to
+    the matching closing tag is content, so output that prints tags doesn't end the block early.
+    Lines outside of any block aren't part of the result."""
+    blocks = []
+    current: Optional[Block] = None
+    for i, line in enumerate(lines):
+        tag = line.strip()
+        if current is None:
+            kind = OPENING_TAGS.get(tag)
+            if kind is not None:
+                current = Block(kind, i, i, closed=False)
+            elif tag.startswith("<output id="):
+                output_id = parse_output_anchor(tag)
+                if output_id is not None:
+                    blocks.append(Block("output", i, i, output_id=output_id))
+        elif CLOSING_TAGS.get(tag) == current.kind:
+            current.end = i
+            current.closed = True
+            blocks.append(current)
+            current = None
+    if current is not None:
+        current.end = len(lines) - 1
+        blocks.append(current)
+    return blocks
+
+
+def output_range(lines: Sequence[str], block: Block) -> Tuple[int, int]:
+    """The lines taken up by an output block as [start, end), including the blank line that's put
+    between a cell and its output"""
+    start = block.start
+    if start > 0 and not lines[start - 1].strip():
+        start -= 1
+    return start, block.end + 1
+
+
+def remove_line_ranges(lines: Sequence[str], ranges: Iterable[Tuple[int, int]]) -> List[str]:
+    """Copy of lines without the given sorted, non-overlapping [start, end) ranges"""
+    result: List[str] = []
+    position = 0
+    for start, end in ranges:
+        result.extend(lines[position:start])
+        position = end
+    result.extend(lines[position:])
+    return result
+
+
+def select_outputs(
+    blocks: Sequence[Block], row: Optional[int] = None, direction: str = "Entire", amount: int = 0
+) -> List[Block]:
+    """The closed output blocks that are entirely above ("Up") or below ("Down") the 0-indexed
+    row, or all of them ("Entire"). amount limits how many, starting with the closest to row; 0
+    means all of them."""
+    outputs = [block for block in blocks if block.kind == "output" and block.closed]
+    if direction == "Up":
+        assert row is not None
+        outputs = [block for block in outputs if block.end <= row]
+        outputs.reverse()
+    elif direction == "Down":
+        assert row is not None
+        outputs = [block for block in outputs if block.start >= row]
+    if amount:
+        outputs = outputs[:amount]
+    return sorted(outputs, key=lambda block: block.start)
+
+
+def remove_outputs(lines: Sequence[str], outputs: Sequence[Block]) -> List[str]:
+    return remove_line_ranges(lines, (output_range(lines, block) for block in outputs))
+
+
+def cell_source(lines: Sequence[str], block: Block) -> List[str]:
+    """Source of a block in the notebook format, a list of lines ending with newlines"""
+    body = list(block.body(lines))
+    return [line + "\n" for line in body[:-1]] + body[-1:]
+
+
+def blocks_to_cells(lines: Sequence[str], blocks: Sequence[Block]) -> List[Dict[str, Any]]:
+    cells = []
+    for block in blocks:
+        cell_type = BLOCK_KINDS.get(block.kind)
+        if cell_type is None:
+            continue
+        cell: Dict[str, Any] = {
+            "cell_type": cell_type,
+            "metadata": {},
+            "source": cell_source(lines, block),
+        }
+        if cell_type == "code":
+            cell["execution_count"] = None
+            cell["outputs"] = []
+        cells.append(cell)
+    return cells
+
+
+def cells_to_lines(cells: Iterable[Dict[str, Any]]) -> List[str]:
+    """Lay notebook cells out as Volcano blocks, separated by blank lines"""
+    lines: List[str] = []
+    for cell in cells:
+        kind = CELL_TYPES.get(cell.get("cell_type", ""))
+        if kind is None:
+            continue
+        source = cell.get("source", [])
+        if isinstance(source, list):
+            source = "".join(source)
+        source = source.removesuffix("\n")
+        lines.append(f"<{kind}>")
+        # empty cells still get a line to type in
+        lines.extend(source.split("\n") if source else [""])
+        lines.append(f"</{kind}>")
+        lines.append("")
+    return lines
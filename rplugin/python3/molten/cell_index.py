@@ -0,0 +1,55 @@
+from typing import NamedTuple, Optional
+
+from pynvim import Nvim
+from pynvim.api import Buffer
+
+
+class TagBlock(NamedTuple):
+    start: int
+    """0-indexed line of the opening tag"""
+    end: int
+    """0-indexed line of the closing tag"""
+    kind: str
+    """cell, markdown, raw or output"""
+
+
+class CellIndex:
+    """Looks up the <cell>, <markdown>, <raw> and <output> blocks of Volcano buffers. The index
+    itself lives in lua/cell_index.lua, which keeps it up to date through nvim_buf_attach, so every
+    lookup is a single RPC no matter the size of the notebook."""
+
+    nvim: Nvim
+
+    def __init__(self, nvim: Nvim):
+        self.nvim = nvim
+
+    def _call(self, function: str, *args) -> Optional[TagBlock]:
+        block = self.nvim.exec_lua(f"return require('cell_index').{function}(...)", *args)
+        if block is None:
+            return None
+        return TagBlock(*block)
+
+    def block_at(self, buf: Buffer, row: int) -> Optional[TagBlock]:
+        """The block containing the 0-indexed row, tag lines included"""
+        return self._call("block_at", buf.number, row)
+
+    def cell_at(self, buf: Buffer, row: int) -> Optional[TagBlock]:
+        block = self.block_at(buf, row)
+        if block is None or block.kind != "cell":
+            return None
+        return block
+
+    def next_block(self, buf: Buffer, row: int, kind: Optional[str] = None) -> Optional[TagBlock]:
+        """The first block starting on or after row, of the given kind if there is one"""
+        return self._call("next_block", buf.number, row, kind)
+
+    def prev_block(self, buf: Buffer, row: int, kind: Optional[str] = None) -> Optional[TagBlock]:
+        """The last block ending before row, of the given kind if there is one"""
+        return self._call("prev_block", buf.number, row, kind)
+
+    def output_after(self, buf: Buffer, row: int) -> Optional[TagBlock]:
+        """The <output> block directly following the block that ends on row, if it has one"""
+        block = self.next_block(buf, row + 1)
+        if block is None or block.kind != "output":
+            return None
+        return block
@@ -0,0 +1,17 @@
+from typing import Dict, Tuple
+
+
+def parse_cell_magics(code: str) -> Tuple[Dict[str, str], str]:
+    """Split the leading `%%name args` lines off a cell.
+    Returns: the magics by name, and the code with every magic line blanked out. The lines are
+    blanked instead of removed so that line numbers in tracebacks still match the cell."""
+    magics: Dict[str, str] = {}
+    lines = code.split("\n")
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped.startswith("%%"):
+            break
+        name, _, args = stripped[2:].partition(" ")
+        magics[name] = args.strip()
+        lines[i] = ""
+    return magics, "\n".join(lines)
@@ -0,0 +1,570 @@
+"""Volcano eval workers over a local socket.
+
+The Volcano evaluator normally forks one worker process per cell. With g:volcano_eval_worker set
+to "unix:/path/to.sock" or "tcp:host:port" the cells are sent to a long lived worker server
+instead, which can be started with:
+
+    VOLCANO_EVAL_TOKEN=<secret> python -m molten.eval_remote unix:/tmp/volcano.sock
+
+The server runs whatever code it's sent, so it only listens on a unix socket (readable by its user
+only) or a loopback address unless it's started with --allow-remote, and every connection has to
+start with the shared token. The server takes the token from $VOLCANO_EVAL_TOKEN, or makes one up
+and prints it. Volcano sends g:volcano_eval_worker_token, falling back to $VOLCANO_EVAL_TOKEN.
+
+Every message is a 4 byte big endian length followed by that many bytes of UTF-8 JSON.
+
+client -> server
+    {"type": "hello", "token"}  (first message, anything else is dropped until it's accepted)
+    {"type": "run", "key", "eval_id", "code", "variables", "imports", "parallel", "limits", "from"}
+    {"type": "cancel", "key"}
+    {"type": "ack", "key", "seq"}
+server -> client
+    {"type": "welcome"} or {"type": "error", "message"}  (reply to hello, closed after an error)
+    {"type": "events", "key", "start", "events": [[kind, payload], ...]}
+
+Events are the ones the eval worker process produces, sent in batches. The server keeps them until
+they're acked, so when the connection drops the client reconnects and sends "run" again for every
+cell it hasn't seen finish, with "from" set to the number of events it already has. Cells the
+server knows about carry on from there instead of being run again.
+"""
+
+import hmac
+import ipaddress
+import json
+import os
+import queue
+import secrets
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import asdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from molten.eval_worker import EvalWorker
+from molten.limits import EvalLimits
+from molten.parallel import ParallelSpec
+from molten.utils import MoltenException
+
+HEADER = struct.Struct(">I")
+MAX_MESSAGE_SIZE = 1 << 30
+# how long events are collected before they're sent as one batch
+BATCH_INTERVAL = 0.05
+MAX_RECONNECT_DELAY = 5.0
+TOKEN_ENV = "VOLCANO_EVAL_TOKEN"
+# bytes read from a connection before it has sent a valid token
+MAX_HELLO_SIZE = 4096
+
+
+def parse_address(address: str) -> Tuple[int, Any]:
+    """Parse "unix:/path/to.sock" or "tcp:host:port" into a socket family and address"""
+    kind, _, rest = address.partition(":")
+    if kind == "unix" and rest:
+        return socket.AF_UNIX, rest
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        if host and port.isdigit():
+            return socket.AF_INET, (host, int(port))
+    raise MoltenException(
+        f"Invalid eval worker address: {address}, expected unix:<path> or tcp:<host>:<port>"
+    )
+
+
+def is_local_address(family: int, sockaddr: Any) -> bool:
+    """Whether only this machine can connect to sockaddr"""
+    if family == socket.AF_UNIX:
+        return True
+    host = sockaddr[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def send_message(sock: socket.socket, message: Dict[str, Any]) -> None:
+    data = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 16))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_message(
+    sock: socket.socket, max_size: int = MAX_MESSAGE_SIZE
+) -> Optional[Dict[str, Any]]:
+    """Read one message, None once the connection is closed"""
+    header = _recv_exact(sock, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    if size > max_size:
+        raise ConnectionError(f"Message too large: {size} bytes")
+    data = _recv_exact(sock, size)
+    if data is None:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+
+class EvalConnection:
+    """Client side of the connection to an eval worker server. One is shared by all the cells sent
+    to the same address. It reconnects on its own and resends the cells that haven't finished."""
+
+    address: str
+    session: str
+    workers: Dict[str, "RemoteEvalWorker"]
+
+    def __init__(self, address: str, token: str):
+        self.address = address
+        self.family, self.sockaddr = parse_address(address)
+        self.token = token
+        self.session = uuid.uuid4().hex
+        self.workers = {}
+        self.sock: Optional[socket.socket] = None
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.closed = False
+        # set when the server turns the connection down, cells sent after that fail right away
+        self.error: Optional[str] = None
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def register(self, worker: "RemoteEvalWorker") -> None:
+        with self.lock:
+            error = self.error
+            if error is None:
+                self.workers[worker.key] = worker
+            sock = self.sock
+        if error is not None:
+            worker.fail(error)
+        elif sock is not None:
+            self._send(sock, worker.run_message())
+
+    def unregister(self, key: str) -> None:
+        with self.lock:
+            self.workers.pop(key, None)
+
+    def send(self, message: Dict[str, Any]) -> None:
+        """Best effort, messages sent while disconnected are dropped"""
+        with self.lock:
+            sock = self.sock
+        if sock is not None:
+            self._send(sock, message)
+
+    def close(self) -> None:
+        self.closed = True
+        with self.lock:
+            sock, self.sock = self.sock, None
+        if sock is not None:
+            sock.close()
+
+    def _send(self, sock: socket.socket, message: Dict[str, Any]) -> None:
+        try:
+            with self.send_lock:
+                send_message(sock, message)
+        except OSError:
+            # the reader notices the broken connection and reconnects
+            pass
+
+    def _run(self) -> None:
+        delay = 0.1
+        while not self.closed:
+            try:
+                sock = socket.socket(self.family, socket.SOCK_STREAM)
+                sock.connect(self.sockaddr)
+            except OSError:
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            delay = 0.1
+
+            try:
+                send_message(sock, {"type": "hello", "token": self.token})
+                reply = recv_message(sock)
+            except (OSError, ValueError, ConnectionError):
+                reply = None
+            if reply is None or reply.get("type") != "welcome":
+                sock.close()
+                if reply is not None:
+                    self._reject(str(reply.get("message", "Connection refused")))
+                    return
+                continue
+
+            with self.lock:
+                self.sock = sock
+                pending = list(self.workers.values())
+            for worker in pending:
+                self._send(sock, worker.run_message())
+
+            try:
+                while True:
+                    message = recv_message(sock)
+                    if message is None:
+                        break
+                    if message.get("type") != "events":
+                        continue
+                    with self.lock:
+                        worker = self.workers.get(message["key"])
+                    if worker is not None:
+                        seq = worker.receive(message["start"], message["events"])
+                        self._send(sock, {"type": "ack", "key": worker.key, "seq": seq})
+            except (OSError, ValueError, ConnectionError):
+                pass
+            finally:
+                with self.lock:
+                    if self.sock is sock:
+                        self.sock = None
+                sock.close()
+
+    def _reject(self, message: str) -> None:
+        error = f"Eval worker {self.address} refused the connection: {message}"
+        with self.lock:
+            self.error = error
+            self.closed = True
+            pending = list(self.workers.values())
+            self.workers.clear()
+        for worker in pending:
+            worker.fail(error)
+
+
+class RemoteEvalWorker:
+    """Stands in for an EvalWorker, running the cell on the server behind connection. Limits are
+    enforced by the server, which reports them as killed events."""
+
+    def __init__(
+        self,
+        connection: EvalConnection,
+        code: str,
+        eval_id: int,
+        variables: Dict[str, Any],
+        imports: List[str],
+        parallel: Optional[ParallelSpec] = None,
+        limits: Optional[EvalLimits] = None,
+    ):
+        self.connection = connection
+        self.key = f"{connection.session}:{eval_id}"
+        self.code = code
+        self.eval_id = eval_id
+        self.variables = variables
+        self.imports = imports
+        self.parallel = parallel
+        self.limits = limits or EvalLimits()
+        self.events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+        # number of events received so far
+        self.received = 0
+        self.finished = False
+
+    def run_message(self) -> Dict[str, Any]:
+        return {
+            "type": "run",
+            "key": self.key,
+            "eval_id": self.eval_id,
+            "code": self.code,
+            "variables": self.variables,
+            "imports": self.imports,
+            "parallel": asdict(self.parallel) if self.parallel is not None else None,
+            "limits": asdict(self.limits),
+            "from": self.received,
+        }
+
+    def receive(self, start: int, events: List[Any]) -> int:
+        """Called by the connection with a batch of events. Returns the number received so far."""
+        # skip the ones that were already received before a reconnect
+        for kind, payload in events[max(0, self.received - start):]:
+            if self.finished:
+                break
+            self.events.put((kind, payload))
+            self.received += 1
+            if kind == "done":
+                self.finished = True
+                self.connection.unregister(self.key)
+        return self.received
+
+    def start(self) -> None:
+        self.connection.register(self)
+
+    def get(self, timeout: float) -> Tuple[str, Any]:
+        """Next event from the worker, raises queue.Empty on timeout"""
+        return self.events.get(timeout=timeout)
+
+    def is_alive(self) -> bool:
+        return not self.finished
+
+    def kill(self) -> None:
+        if self.finished:
+            return
+        self.finished = True
+        self.connection.unregister(self.key)
+        self.connection.send({"type": "cancel", "key": self.key})
+        self.events.put(("done", True))
+
+    def fail(self, message: str) -> None:
+        """Finish without running, with message as the output"""
+        if self.finished:
+            return
+        self.finished = True
+        self.events.put(("line", message))
+        self.events.put(("done", True))
+
+    def watchdog(self, elapsed: float) -> Optional[str]:
+        return None
+
+    def exit_reason(self) -> Optional[str]:
+        return None
+
+
+class ServerCell:
+    """A cell running on the server, with the events that haven't been acked yet"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.events: List[Any] = []
+        # sequence number of events[0]
+        self.base = 0
+        # sequence number of the next event to send
+        self.sent = 0
+        self.done = False
+        self.worker: Optional[EvalWorker] = None
+        self.cancelled = False
+        self.client: Optional["ServerClient"] = None
+
+    def ack(self, seq: int) -> None:
+        count = min(max(0, seq - self.base), len(self.events))
+        del self.events[:count]
+        self.base += count
+
+
+class ServerClient:
+    def __init__(self, server: "EvalServer", sock: socket.socket):
+        self.server = server
+        self.sock = sock
+        self.closed = False
+
+    def serve(self) -> None:
+        try:
+            if not self._handshake():
+                self.closed = True
+                self.sock.close()
+                return
+        except (OSError, ValueError, ConnectionError):
+            self.closed = True
+            self.sock.close()
+            return
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        try:
+            while True:
+                message = recv_message(self.sock)
+                if message is None:
+                    break
+                self.server.handle(self, message)
+        except (OSError, ValueError, ConnectionError):
+            pass
+        finally:
+            self.closed = True
+            self.server.detach(self)
+            self.sock.close()
+
+    def _handshake(self) -> bool:
+        """Wait for the hello with the server's token, nothing else is read before it"""
+        message = recv_message(self.sock, MAX_HELLO_SIZE)
+        if message is None:
+            return False
+        token = message.get("token")
+        if (
+            message.get("type") != "hello"
+            or not isinstance(token, str)
+            or not hmac.compare_digest(token.encode("utf-8"), self.server.token.encode("utf-8"))
+        ):
+            send_message(self.sock, {"type": "error", "message": "invalid token"})
+            return False
+        send_message(self.sock, {"type": "welcome"})
+        return True
+
+    def _flush_loop(self) -> None:
+        while not self.closed:
+            time.sleep(BATCH_INTERVAL)
+            for key, start, events in self.server.pending_batches(self):
+                try:
+                    send_message(
+                        self.sock, {"type": "events", "key": key, "start": start, "events": events}
+                    )
+                except OSError:
+                    return
+
+
+class EvalServer:
+    """Runs cells sent by Volcano, each one in its own eval worker process"""
+
+    def __init__(self, address: str, token: str, allow_remote: bool = False):
+        if not token:
+            raise MoltenException("The eval worker server needs a token")
+        self.address = address
+        self.token = token
+        self.allow_remote = allow_remote
+        self.cells: Dict[str, ServerCell] = {}
+        self.lock = threading.Lock()
+
+    def serve_forever(self) -> None:
+        family, sockaddr = parse_address(self.address)
+        if not self.allow_remote and not is_local_address(family, sockaddr):
+            raise MoltenException(
+                f"Refusing to listen on {self.address}, which isn't a loopback address."
+                " Pass --allow-remote to do it anyway."
+            )
+        listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            if os.path.exists(sockaddr):
+                os.unlink(sockaddr)
+            # only our user can connect, created that way so there's no window before the chmod
+            old_umask = os.umask(0o177)
+            try:
+                listener.bind(sockaddr)
+            finally:
+                os.umask(old_umask)
+        else:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(sockaddr)
+        listener.listen()
+        while True:
+            sock, _ = listener.accept()
+            client = ServerClient(self, sock)
+            threading.Thread(target=client.serve, daemon=True).start()
+
+    def handle(self, client: ServerClient, message: Dict[str, Any]) -> None:
+        key = message.get("key")
+        with self.lock:
+            cell = self.cells.get(key)  # type: ignore
+            match message.get("type"):
+                case "run":
+                    if cell is None:
+                        cell = self.cells[key] = ServerCell(key)  # type: ignore
+                        threading.Thread(
+                            target=self._run_cell, args=(cell, message), daemon=True
+                        ).start()
+                    cell.client = client
+                    # resend whatever the client is missing
+                    cell.sent = max(cell.base, int(message.get("from", 0)))
+                case "ack" if cell is not None:
+                    cell.ack(int(message["seq"]))
+                    if cell.done and not cell.events and cell.sent >= cell.base:
+                        del self.cells[key]  # type: ignore
+                case "cancel" if cell is not None:
+                    cell.cancelled = True
+                    if cell.worker is not None:
+                        cell.worker.kill()
+
+    def detach(self, client: ServerClient) -> None:
+        with self.lock:
+            for cell in self.cells.values():
+                if cell.client is client:
+                    cell.client = None
+
+    def pending_batches(self, client: ServerClient) -> List[Tuple[str, int, List[Any]]]:
+        batches = []
+        with self.lock:
+            for cell in self.cells.values():
+                end = cell.base + len(cell.events)
+                if cell.client is client and cell.sent < end:
+                    batches.append((cell.key, cell.sent, cell.events[cell.sent - cell.base :]))
+                    cell.sent = end
+        return batches
+
+    def _emit(self, cell: ServerCell, kind: str, payload: Any) -> None:
+        with self.lock:
+            cell.events.append([kind, payload])
+
+    def _run_cell(self, cell: ServerCell, message: Dict[str, Any]) -> None:
+        parallel = message.get("parallel")
+        worker = EvalWorker(
+            message["code"],
+            int(message.get("eval_id", 0)),
+            message.get("variables") or {},
+            message.get("imports") or [],
+            None,
+            ParallelSpec(**parallel) if parallel else None,
+            EvalLimits(**(message.get("limits") or {})),
+        )
+        with self.lock:
+            cell.worker = worker
+            cancelled = cell.cancelled
+        if cancelled:
+            self._emit(cell, "done", True)
+            self._finish(cell)
+            return
+
+        worker.start()
+        start_time = time.time()
+        saw_done = False
+        killed = None
+        try:
+            while True:
+                got_item = False
+                try:
+                    kind, payload = worker.get(timeout=0.05)
+                    got_item = True
+                    self._emit(cell, kind, payload)
+                    if kind == "done":
+                        saw_done = True
+                except queue.Empty:
+                    pass
+                if killed is None and not cell.cancelled:
+                    killed = worker.watchdog(time.time() - start_time)
+                    if killed is not None:
+                        self._emit(cell, "killed", killed)
+                if not worker.is_alive() and (saw_done or not got_item):
+                    break
+        finally:
+            if worker.is_alive():
+                worker.kill()
+        if not saw_done:
+            reason = worker.exit_reason()
+            if killed is None and reason is not None and not cell.cancelled:
+                self._emit(cell, "killed", reason)
+            self._emit(cell, "done", True)
+        self._finish(cell)
+
+    def _finish(self, cell: ServerCell) -> None:
+        with self.lock:
+            cell.done = True
+
+
+def default_address() -> str:
+    directory = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return f"unix:{os.path.join(directory, f'volcano-eval-{os.getuid()}.sock')}"
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    allow_remote = "--allow-remote" in args
+    args = [arg for arg in args if arg != "--allow-remote"]
+    if len(args) > 1 or any(arg.startswith("-") for arg in args):
+        print(
+            "usage: python -m molten.eval_remote [--allow-remote] [unix:<path> | tcp:<host>:<port>]"
+        )
+        sys.exit(2)
+    address = args[0] if args else default_address()
+    token = os.environ.get(TOKEN_ENV)
+    if not token:
+        token = secrets.token_urlsafe(32)
+        print(f"{TOKEN_ENV} is not set, using token {token}", flush=True)
+    print(f"Listening on {address}", flush=True)
+    try:
+        EvalServer(address, token, allow_remote).serve_forever()
+    except MoltenException as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,588 @@
+import ast
+import asyncio
+import codeop
+import inspect
+import io
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import traceback
+from types import ModuleType
+from typing import Any, Dict, List, Optional, Tuple
+
+from molten.limits import (
+    CPU_LIMIT_GRACE,
+    EvalLimits,
+    apply_worker_limits,
+    cpu_time,
+    descendants,
+    set_cell_limits,
+    tree_memory,
+)
+from molten.parallel import ParallelSpec, parallel_map
+
+
+class StreamingStdout(io.TextIOBase):
+    def __init__(self, qq):
+        self.q = qq
+        self._buffer = ""
+
+    def write(self, text):
+        if not text:
+            return
+        self._buffer += text
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            self.q.put(("line", line))
+
+    def flush(self):
+        if self._buffer:
+            self.q.put(("line", self._buffer))
+            self._buffer = ""
+
+
+def jsonable_vars(globs, baseline_keys):
+    out = {}
+    for k, v in globs.items():
+        if k in baseline_keys or k.startswith("__"):
+            continue
+        if isinstance(v, ModuleType):
+            continue
+        try:
+            json.dumps(v)
+        except Exception:
+            continue
+        out[k] = v
+    return out
+
+
+def extract_imports_from_src(src):
+    imps = []
+    for _line in src.splitlines():
+        s = _line.strip()
+        if s.startswith("import ") or s.startswith("from "):
+            imps.append(s)
+    return imps
+
+
+def atomic_json_write(path, payload):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def start_event_loop() -> asyncio.AbstractEventLoop:
+    """A new event loop, running on a daemon thread"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+def run_eval(
+    code,
+    q,
+    eval_id,
+    pre_vars,
+    imports_initial,
+    load_namespaces,
+    parallel=None,
+    limits=None,
+    globs=None,
+    loop=None,
+):
+    """Runs a cell, this is the target of the eval worker process. Events are put on q:
+    ("line", str), ("progress", str), ("globals", (variables, imports)), ("killed", reason) and
+    finally ("done", error_happened). When load_namespaces is None the namespace is only reported
+    through the globals events, and not persisted to disk by the worker.
+
+    Every statement runs on the thread of an event loop, the way it would in Jupyter, so it can
+    create tasks, and the ones that await are awaited there. A NotebookWorker passes its namespace
+    as globs and its event loop as loop, both outlive the cell. Otherwise they're made for this
+    cell, and the tasks still running at the end are cancelled."""
+    if limits is not None:
+        apply_worker_limits(limits)
+
+    error_happened = False
+    if globs is None:
+        globs = {}
+    globs.update(pre_vars)
+
+    imports_live = list(imports_initial) if imports_initial else []
+    for imp in imports_live:
+        try:
+            exec(imp, globs)
+        except Exception:
+            pass
+
+    old_stdout, old_stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = StreamingStdout(q)
+
+    def report_exception(e, start_idx):
+        if isinstance(e, MemoryError) and limits is not None and limits.memory is not None:
+            q.put(("killed", "memory"))
+            return
+        tb = traceback.extract_tb(e.__traceback__)
+        code_lines = code.splitlines()
+        user_lineno = None
+        if start_idx is not None:
+            for frame in tb:
+                if frame.filename == "<string>":
+                    user_lineno = frame.lineno + start_idx
+                    break
+        q.put(("line", "-" * 75))
+        q.put(("line", f"{type(e).__name__}{' ' * 33}Traceback (most recent call last)"))
+        if user_lineno is not None and 1 <= user_lineno <= len(code_lines):
+            q.put(("line", f"Cell In[{eval_id}], line {user_lineno}"))
+            q.put(("line", f"----> {user_lineno} {code_lines[user_lineno - 1].strip()}"))
+            q.put(("line", ""))
+        q.put(("line", f"{type(e).__name__}: {e}"))
+
+    own_loop = loop is None
+    if loop is None:
+        loop = start_event_loop()
+
+    async def run_statement(codeobj):
+        if codeobj.co_flags & inspect.CO_COROUTINE:
+            await eval(codeobj, globs)
+        else:
+            exec(codeobj, globs)
+
+    async def cancel_tasks():
+        """Cancel the tasks still running, returns how many there were"""
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return len(tasks)
+
+    compiler = codeop.CommandCompiler()
+    compiler.compiler.flags |= ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+    lines = code.splitlines()
+    buf_accum = []
+    baseline_keys = set(globs.keys())
+    start_idx = 0
+
+    try:
+        for i, line in enumerate(lines):
+            buf_accum.append(line)
+            src = "\n".join(buf_accum)
+            try:
+                codeobj = compiler(src, filename="<string>", symbol="exec")
+                if codeobj is None:
+                    continue
+                asyncio.run_coroutine_threadsafe(run_statement(codeobj), loop).result()
+            except BaseException as e:
+                error_happened = True
+                report_exception(e, start_idx)
+                break
+
+            new_imps = extract_imports_from_src(src)
+            for imp in new_imps:
+                if imp not in imports_live:
+                    imports_live.append(imp)
+            new_vars = jsonable_vars(globs, baseline_keys)
+            baseline_keys = set(globs.keys())
+            q.put(("globals", (new_vars, new_imps)))
+
+            if load_namespaces is None:
+                buf_accum = []
+                start_idx = i + 1
+                continue
+
+            try:
+                if os.path.exists(load_namespaces):
+                    try:
+                        with open(load_namespaces, "r", encoding="utf-8") as f:
+                            ns_disk = json.load(f)
+                    except Exception:
+                        ns_disk = {"variables": {}, "imports": []}
+                else:
+                    ns_disk = {"variables": {}, "imports": []}
+
+                ns_disk["variables"].update(new_vars)
+                for imp in imports_live:
+                    if imp not in ns_disk.get("imports", []):
+                        ns_disk.setdefault("imports", []).append(imp)
+
+                atomic_json_write(load_namespaces, ns_disk)
+
+            except Exception as _e:
+                q.put(("line", f"[persist warning] {type(_e).__name__}: {_e}"))
+
+            buf_accum = []
+            start_idx = i + 1
+
+        if own_loop:
+            # the worker exits with the cell, its tasks can't outlive it
+            cancelled = asyncio.run_coroutine_threadsafe(cancel_tasks(), loop).result()
+            if cancelled:
+                q.put(("line", f"[{cancelled} unfinished task(s) cancelled at the end of the cell]"))
+
+        if parallel is not None and not error_happened:
+            last_progress = [0.0]
+
+            def on_progress(done, total):
+                now = time.time()
+                if done == total or now - last_progress[0] > 0.1:
+                    last_progress[0] = now
+                    q.put(("progress", f"[parallel] {done}/{total} tasks done"))
+
+            try:
+                globs[parallel.target] = parallel_map(
+                    eval(parallel.function, globs),
+                    eval(parallel.iterable, globs),
+                    parallel.workers,
+                    parallel.chunksize,
+                    on_progress,
+                )
+            except BaseException as e:
+                error_happened = True
+                report_exception(e, None)
+            else:
+                q.put(("globals", (jsonable_vars(globs, baseline_keys), [])))
+    finally:
+        sys.stdout = old_stdout
+        sys.stderr = old_stderr
+        q.put(("done", error_happened))
+
+
+def kill_tree(pid: int) -> None:
+    """Kill the process and its descendants, the pool of a %%parallel cell would outlive it"""
+    # listed first, once the process is gone they're reparented
+    for process in [pid] + descendants(pid):
+        try:
+            os.kill(process, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class EvalWorker:
+    """Runs a single cell in its own process and watches it. The Volcano evaluator drives this
+    through get/watchdog/exit_reason, the same way it drives a RemoteEvalWorker."""
+
+    limits: EvalLimits
+    process: multiprocessing.Process
+    events: "multiprocessing.Queue[Tuple[str, Any]]"
+    killed_by: Optional[str]
+    """why the worker was killed from here: a limit, or "cancelled". None if it wasn't."""
+    cpu_used: float
+    """CPU time of the worker when the watchdog last looked, in seconds"""
+
+    def __init__(
+        self,
+        code: str,
+        eval_id: int,
+        variables: Dict[str, Any],
+        imports: List[str],
+        load_namespaces: Optional[str],
+        parallel: Optional[ParallelSpec] = None,
+        limits: Optional[EvalLimits] = None,
+    ):
+        self.limits = limits or EvalLimits()
+        self.events = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=run_eval,
+            args=(
+                code,
+                self.events,
+                eval_id,
+                variables,
+                imports,
+                load_namespaces,
+                parallel,
+                self.limits,
+            ),
+        )
+        self._last_memory_check = 0.0
+        self.killed_by = None
+        self.cpu_used = 0.0
+
+    def start(self) -> None:
+        self.process.start()
+
+    def get(self, timeout: float) -> Tuple[str, Any]:
+        """Next event from the worker, raises queue.Empty on timeout"""
+        return self.events.get(timeout=timeout)
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def kill(self, reason: str = "cancelled") -> None:
+        if self.process.pid is None:
+            return
+        if self.killed_by is None and self.process.is_alive():
+            self.killed_by = reason
+        kill_tree(self.process.pid)
+        self.process.join(timeout=1)
+
+    def watchdog(self, elapsed: float) -> Optional[str]:
+        """Kill the worker if it's over the wall-clock or memory limit.
+        Returns: the limit that was hit, or None"""
+        if not self.process.is_alive():
+            return None
+        if self.limits.timeout is not None and elapsed > self.limits.timeout:
+            self.kill("timeout")
+            return "timeout"
+        now = time.time()
+        if now - self._last_memory_check > 0.5:
+            self._last_memory_check = now
+            if self.limits.cpu is not None:
+                self.cpu_used = cpu_time(self.process.pid) or self.cpu_used  # type: ignore
+            memory = None
+            if self.limits.memory is not None:
+                memory = tree_memory(self.process.pid)  # type: ignore
+            if memory is not None and memory > self.limits.memory:  # type: ignore
+                self.kill("memory")
+                return "memory"
+        return None
+
+    def exit_reason(self) -> Optional[str]:
+        """After the worker is gone, the limit the OS killed it for, if any. Kills made from here
+        aren't, the watchdog already reported those and a cancelled cell hit no limit."""
+        if self.limits.cpu is None or self.killed_by is not None:
+            return None
+        if self.process.exitcode == -signal.SIGXCPU:
+            return "cpu"
+        # SIGXCPU was handled and the hard limit, a few seconds later, sent SIGKILL. Anything
+        # else can send SIGKILL too, so only count it once the CPU time got to the limit.
+        if self.process.exitcode == -signal.SIGKILL and self.cpu_used >= self.limits.cpu:
+            return "cpu"
+        return None
+
+
+class CellEvents:
+    """The event queue of a NotebookWorker as the running cell sees it, events are tagged with its
+    eval id. What tasks print between cells is dropped."""
+
+    def __init__(self, events: "multiprocessing.Queue[Tuple[int, Tuple[str, Any]]]"):
+        self.events = events
+        self.eval_id: Optional[int] = None
+
+    def put(self, event: Tuple[str, Any]) -> None:
+        if self.eval_id is not None:
+            self.events.put((self.eval_id, event))
+
+
+def read_namespace_variables(path: Optional[str]) -> Dict[str, Any]:
+    if path is None or not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("variables", {})
+    except Exception:
+        return {}
+
+
+def serve_notebook(commands, events):
+    """Target of the NotebookWorker process. Runs the cells sent on commands one after the other,
+    in one namespace and with one event loop, until None is sent."""
+    loop = start_event_loop()
+    cell_events = CellEvents(events)
+    # output of tasks that outlive their cell goes to the cell running at the time
+    sys.stdout = sys.stderr = StreamingStdout(cell_events)
+    globs: Dict[str, Any] = {}
+    # the variables of the namespace file as they were when the last cell finished
+    synced: Dict[str, Any] = {}
+    while True:
+        command = commands.get()
+        if command is None:
+            return
+        eval_id, code, variables, imports, load_namespaces, parallel, limits = command
+        # the live values win over the saved ones, which can be out of date or lossy, unless
+        # another worker saved something new since
+        for name, value in variables.items():
+            if name not in globs or name not in synced or synced[name] != value:
+                globs[name] = value
+        set_cell_limits(limits)
+        cell_events.eval_id = eval_id
+        run_eval(
+            code,
+            cell_events,
+            eval_id,
+            {},
+            imports,
+            load_namespaces,
+            parallel,
+            globs=globs,
+            loop=loop,
+        )
+        cell_events.eval_id = None
+        synced = read_namespace_variables(load_namespaces)
+
+
+class NotebookWorker:
+    """A worker process that lives as long as its notebook and runs all of its queued cells, one
+    after the other. It keeps one namespace and one event loop, so tasks started by a cell keep
+    running while the following cells execute. Limits are set for each cell, and killing a cell
+    for one of them kills the process, with its tasks and namespace."""
+
+    process: multiprocessing.Process
+    commands: "multiprocessing.Queue[Any]"
+    events: "multiprocessing.Queue[Tuple[int, Tuple[str, Any]]]"
+    cells: Dict[int, "NotebookCell"]
+
+    def __init__(self):
+        self.commands = multiprocessing.Queue()
+        self.events = multiprocessing.Queue()
+        self.process = multiprocessing.Process(
+            target=serve_notebook, args=(self.commands, self.events)
+        )
+        self.cells = {}
+
+    def start(self) -> None:
+        self.process.start()
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def _dispatch(self) -> None:
+        """Hands the events of the process to the cells they're for"""
+        while True:
+            try:
+                eval_id, event = self.events.get(timeout=0.5)
+            except queue.Empty:
+                if not self.process.is_alive():
+                    return
+                continue
+            cell = self.cells.get(eval_id)
+            if cell is None:
+                continue
+            cell.events.put(event)
+            if event[0] == "done":
+                cell.finished = True
+                del self.cells[eval_id]
+
+    def is_alive(self) -> bool:
+        return self.process.is_alive()
+
+    def cell(
+        self,
+        code: str,
+        eval_id: int,
+        variables: Dict[str, Any],
+        imports: List[str],
+        load_namespaces: Optional[str],
+        parallel: Optional[ParallelSpec] = None,
+        limits: Optional[EvalLimits] = None,
+    ) -> "NotebookCell":
+        return NotebookCell(
+            self, code, eval_id, variables, imports, load_namespaces, parallel, limits
+        )
+
+    def submit(self, cell: "NotebookCell") -> None:
+        self.cells[cell.eval_id] = cell
+        self.commands.put(cell.command())
+
+    def kill(self) -> None:
+        if self.process.pid is None:
+            return
+        kill_tree(self.process.pid)
+        self.process.join(timeout=1)
+
+    def stop(self) -> None:
+        if self.is_alive():
+            self.kill()
+
+
+class NotebookCell:
+    """A cell run by a NotebookWorker, driven the same way as an EvalWorker. The CPU limit counts
+    the CPU time the process used since the cell started."""
+
+    events: "queue.Queue[Tuple[str, Any]]"
+    finished: bool
+    killed_by: Optional[str]
+    cpu_used: float
+
+    def __init__(
+        self,
+        notebook: NotebookWorker,
+        code: str,
+        eval_id: int,
+        variables: Dict[str, Any],
+        imports: List[str],
+        load_namespaces: Optional[str],
+        parallel: Optional[ParallelSpec],
+        limits: Optional[EvalLimits],
+    ):
+        self.notebook = notebook
+        self.code = code
+        self.eval_id = eval_id
+        self.variables = variables
+        self.imports = imports
+        self.load_namespaces = load_namespaces
+        self.parallel = parallel
+        self.limits = limits or EvalLimits()
+        self.events = queue.Queue()
+        self.finished = False
+        self.killed_by = None
+        self.cpu_used = 0.0
+        self._cpu_start: Optional[float] = None
+        self._last_check = 0.0
+
+    def command(self) -> Tuple[Any, ...]:
+        return (
+            self.eval_id,
+            self.code,
+            self.variables,
+            self.imports,
+            self.load_namespaces,
+            self.parallel,
+            self.limits,
+        )
+
+    def start(self) -> None:
+        self.notebook.submit(self)
+
+    def get(self, timeout: float) -> Tuple[str, Any]:
+        return self.events.get(timeout=timeout)
+
+    def is_alive(self) -> bool:
+        if not self.events.empty():
+            return True
+        return not self.finished and self.notebook.is_alive()
+
+    def kill(self, reason: str = "cancelled") -> None:
+        if self.killed_by is None and self.notebook.is_alive():
+            self.killed_by = reason
+        self.notebook.kill()
+
+    def watchdog(self, elapsed: float) -> Optional[str]:
+        """Kill the notebook's worker if the cell is over one of its limits.
+        Returns: the limit that was hit, or None"""
+        if not self.notebook.is_alive():
+            return None
+        if self.limits.timeout is not None and elapsed > self.limits.timeout:
+            self.kill("timeout")
+            return "timeout"
+        now = time.time()
+        if now - self._last_check > 0.5:
+            self._last_check = now
+            pid: int = self.notebook.process.pid  # type: ignore
+            if self.limits.cpu is not None:
+                used = cpu_time(pid)
+                if used is not None:
+                    if self._cpu_start is None:
+                        self._cpu_start = used
+                    self.cpu_used = used - self._cpu_start
+                    # the soft limit sends SIGXCPU, this is the fallback in case that's handled
+                    if self.cpu_used > self.limits.cpu + CPU_LIMIT_GRACE:
+                        self.kill("cpu")
+                        return "cpu"
+            if self.limits.memory is not None:
+                memory = tree_memory(pid)
+                if memory is not None and memory > self.limits.memory:
+                    self.kill("memory")
+                    return "memory"
+        return None
+
+    def exit_reason(self) -> Optional[str]:
+        """Once the notebook's worker is gone, whether the OS killed it for the cell's CPU limit"""
+        if self.notebook.is_alive() or self.limits.cpu is None or self.killed_by is not None:
+            return None
+        if self.notebook.process.exitcode == -signal.SIGXCPU:
+            return "cpu"
+        return None
@@ -2,7 +2,7 @@ import math
 import jupyter_client
 
 
-def create_info_window(nvim, molten_kernels, buffers, initialized):
+def create_info_window(nvim, molten_kernels, buffers, initialized, background_evals):
     buf = nvim.current.buffer.number
     info_buf = nvim.api.create_buf(False, True)
     kernel_info = jupyter_client.kernelspec.KernelSpecManager().get_all_specs()  # type: ignore
@@ -38,7 +38,13 @@ def create_info_window(nvim, molten_kernels, buffers, initialized):
             if spec.resource_dir.endswith("/.config/nvim/venv/share/jupyter/kernels/python3"):
                 display_name = "default volcano python3"
             draw_kernel_info(
-                info_buf, running, display_name, spec.language, spec.argv, spec.resource_dir
+                info_buf,
+                running,
+                display_name,
+                spec.language,
+                spec.argv,
+                spec.resource_dir,
+                m_kernel.runtime.backlog,
             )
 
 
@@ -52,7 +58,13 @@ def create_info_window(nvim, molten_kernels, buffers, initialized):
             running = f"(running, bufnr: [{', '.join(running_buffers)}])"
             spec = m_kernel.runtime.kernel_manager.kernel_spec
             draw_kernel_info(
-                info_buf, running, m_kernel.kernel_id, spec.language, spec.argv, spec.resource_dir
+                info_buf,
+                running,
+                m_kernel.kernel_id,
+                spec.language,
+                spec.argv,
+                spec.resource_dir,
+                m_kernel.runtime.backlog,
             )
 
     if len(other_kernels) > 0:
@@ -67,6 +79,14 @@ def create_info_window(nvim, molten_kernels, buffers, initialized):
                 spec["resource_dir"],
             )
 
+    if len(background_evals) > 0:
+        running = [x for x in background_evals.values() if x.status_text() == "running"]
+        info_buf.append([f" {len(running)} running background cell(s):", ""])
+        for job in sorted(background_evals.values(), key=lambda x: x.eval_id):
+            draw_background_info(info_buf, job)
+        info_buf.append([" cancel with :VolcanoCancelBackground [eval id]", ""])
+        info_buf.api.add_highlight(-1, "Comment", len(info_buf) - 2, 0, -1)
+
     nvim_width = nvim.api.get_option("columns")
     nvim_height = nvim.api.get_option("lines")
     height = math.floor(nvim_height * 0.75)
@@ -94,11 +114,22 @@ def create_info_window(nvim, molten_kernels, buffers, initialized):
     )
 
 
-def draw_kernel_info(buf, running, kernel_name, language, argv, resource_dir):
+def draw_kernel_info(buf, running, kernel_name, language, argv, resource_dir, backlog=0):
     buf.append(f" Kernel: {kernel_name} {running}")
     buf.api.add_highlight(-1, "Title", len(buf) - 1, 8, 9 + len(kernel_name))
     buf.append(f"   language:     {language}")
     buf.api.add_highlight(-1, "LspInfoFiletype", len(buf) - 1, 16, -1)
     buf.append(f"   cmd:          {' '.join(argv)}")
     buf.api.add_highlight(-1, "String", len(buf) - 1, 16, -1)
+    if backlog:
+        buf.append(f"   backlog:      {backlog} iopub messages")
+        buf.api.add_highlight(-1, "DiagnosticWarn", len(buf) - 1, 16, -1)
     buf.append([f"   resource_dir: {resource_dir}", ""])
+
+
+def draw_background_info(buf, job):
+    status = job.status_text()
+    buf.append(f" [{job.eval_id}] {status} {job.elapsed():.2f} seconds (bufnr: {job.bufnr})")
+    hl = {"running": "DiagnosticWarn", "done": "String"}.get(status, "Error")
+    col = 4 + len(str(job.eval_id))
+    buf.api.add_highlight(-1, hl, len(buf) - 1, col, col + len(status))
@@ -70,6 +70,7 @@ def import_outputs(nvim: Nvim, kernel: MoltenKernel, filepath: str):
                     m_chunk, success = handle_output_types(nvim, output_data.get("output_type"), kernel, output_data)
                     output.chunks.append(m_chunk)
                     output.success &= success
+                output.limit_text(kernel.options.limit_output_chars, kernel.runtime.spill_path)
 
                 start = DynamicPosition(
                     nvim,
@@ -1,16 +1,18 @@
+import asyncio
 import json
-import time
+import threading
 import uuid
 from queue import Empty as EmptyQueueException
-from queue import Queue
-from threading import Thread
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from urllib.parse import parse_qs, urlparse
 
 from molten.runtime_state import RuntimeState
 
 
 class JupyterAPIClient:
+    """Talks to a kernel of a Jupyter server over its websocket. Used on the kernel loop, with
+    the same async interface as jupyter_client's AsyncKernelClient."""
+
     def __init__(self,
                  url: str,
                  kernel_info: Dict[str, Any],
@@ -19,58 +21,81 @@ class JupyterAPIClient:
         self._kernel_info = kernel_info
         self._headers = headers
 
-        self._recv_queue: Queue[Dict[str, Any]] = Queue()
+        self._recv_queue: asyncio.Queue[Dict[str, Any]] = asyncio.Queue()
 
         import requests
         self.requests = requests
 
-    def get_stdin_msg(self, **kwargs):
-        return None
-
-    def wait_for_ready(self, timeout: float = 0.):
-        start = time.time()
+    async def wait_for_ready(self, timeout: Optional[float] = None):
+        loop = asyncio.get_running_loop()
         while True:
-            response = self.requests.get(self._kernel_api_base,
-                                    headers=self._headers)
+            # requests blocks, don't hold up the other kernels on the loop
+            response = await loop.run_in_executor(
+                None, lambda: self.requests.get(self._kernel_api_base, headers=self._headers)
+            )
             response = json.loads(response.text)
+            if response["execution_state"] == "idle":
+                break
+            await asyncio.sleep(0.2)
 
-            if response["execution_state"] != "idle" and time.time() - start > timeout:
-                raise RuntimeError
-
-            # Discard unnecessary messages.
-            while True:
-                try:
-                    response = self.get_iopub_msg()
-                except EmptyQueueException:
-                    return
-
+        # Discard unnecessary messages.
+        while True:
+            try:
+                await self.get_iopub_msg(timeout=0)
+            except EmptyQueueException:
+                return
 
     def start_channels(self) -> None:
         import websocket
 
         parsed_url = urlparse(self._base_url)
-        self._socket = websocket.create_connection(f"ws://{parsed_url.hostname}:{parsed_url.port}"
+        scheme = "wss" if parsed_url.scheme == "https" else "ws"
+        self._socket = websocket.create_connection(f"{scheme}://{parsed_url.netloc}"
                                                    f"/api/kernels/{self._kernel_info['id']}/channels",
                                                    header=self._headers,
                                                    )
         self._kernel_api_base = f"{self._base_url}/api/kernels/{self._kernel_info['id']}"
 
-        self._iopub_recv_thread = Thread(target=self._recv_message)
-        self._iopub_recv_thread.start()
+        # websocket-client only reads whole frames, blocking until the rest of one arrives, and
+        # with wss the data it needs can already be decrypted and buffered with nothing left on
+        # the fd to wake the loop. So the socket is read on a thread of its own, which hands the
+        # messages over to the loop.
+        self._reader = threading.Thread(
+            target=self._recv_messages, args=(asyncio.get_running_loop(),), daemon=True
+        )
+        self._reader.start()
 
-    def _recv_message(self) -> None:
-        while True:
-            response = json.loads(self._socket.recv())
-            self._recv_queue.put(response)
+    def _recv_messages(self, loop: asyncio.AbstractEventLoop) -> None:
+        from websocket import ABNF, WebSocketException
 
-    def get_iopub_msg(self, **kwargs):
-        if self._recv_queue.empty():
+        while True:
+            try:
+                # control frames are returned instead of waited past, pings are answered by the
+                # call
+                opcode, frame = self._socket.recv_data_frame(control_frame=True)
+            except (OSError, WebSocketException):
+                return
+            if opcode in (ABNF.OPCODE_TEXT, ABNF.OPCODE_BINARY):
+                try:
+                    loop.call_soon_threadsafe(self._recv_queue.put_nowait, json.loads(frame.data))
+                except RuntimeError:
+                    # the loop is closed
+                    return
+            elif opcode == ABNF.OPCODE_CLOSE:
+                return
+
+    async def get_iopub_msg(self, timeout: Optional[float] = None):
+        """Raises EmptyQueueException if no message comes within timeout"""
+        if timeout == 0:
+            try:
+                return self._recv_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                raise EmptyQueueException
+        try:
+            return await asyncio.wait_for(self._recv_queue.get(), timeout)
+        except asyncio.TimeoutError:
             raise EmptyQueueException
 
-        response = self._recv_queue.get()
-
-        return response
-
     def execute(self, code: str):
         header = {
             'msg_type': 'execute_request',
@@ -88,10 +113,13 @@ class JupyterAPIClient:
             }
         })
         self._socket.send(message)
+        return header['msg_id']
 
     def shutdown(self):
         self.requests.delete(self._kernel_api_base,
                         headers=self._headers)
+        # ends the reader thread
+        self._socket.close()
 
     def cleanup_connection_file(self):
         pass
@@ -0,0 +1,43 @@
+"""The event loop the kernel connections of every JupyterRuntime run on. It lives on one daemon
+thread for the life of the plugin. Reading from a kernel is a task waiting on its sockets, so an
+idle kernel costs nothing and dozens of them cost no more per message than one."""
+
+import asyncio
+from concurrent.futures import Future
+from threading import Thread
+from typing import Any, Callable, Coroutine, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class KernelLoop:
+    loop: asyncio.AbstractEventLoop
+    thread: Thread
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def call(self, function: Callable[..., Any], *args: Any) -> None:
+        """Call function on the loop thread, without waiting for it"""
+        self.loop.call_soon_threadsafe(function, *args)
+
+    def spawn(self, coroutine: Coroutine[Any, Any, T]) -> "Future[T]":
+        """Run coroutine as a task on the loop. Cancelling the future cancels the task."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def run(self, coroutine: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+        """Run coroutine on the loop and wait for its result"""
+        return self.spawn(coroutine).result(timeout)
+
+
+_kernel_loop: Optional[KernelLoop] = None
+
+
+def get_kernel_loop() -> KernelLoop:
+    """The loop shared by all the runtimes, started by the first one"""
+    global _kernel_loop
+    if _kernel_loop is None:
+        _kernel_loop = KernelLoop()
+    return _kernel_loop
@@ -0,0 +1,181 @@
+import math
+import os
+import re
+import resource
+from dataclasses import dataclass, fields
+from typing import Any, Dict, List, Optional
+
+from molten.utils import MoltenException
+
+SIZE_REGEX = re.compile(r"^\s*(?P<amount>\d+(?:\.\d+)?)\s*(?P<unit>[kmgt]?)(?:i?b)?\s*$", re.I)
+SIZE_UNITS = {"": 1, "k": 1 << 10, "m": 1 << 20, "g": 1 << 30, "t": 1 << 40}
+# seconds of CPU time past the limit before the worker is killed, when SIGXCPU is handled
+CPU_LIMIT_GRACE = 5
+
+
+@dataclass
+class EvalLimits:
+    """Resource limits for a single Volcano eval worker. None means unlimited."""
+
+    memory: Optional[int] = None
+    """address space / resident memory, in bytes"""
+    cpu: Optional[int] = None
+    """CPU time, in seconds"""
+    timeout: Optional[float] = None
+    """wall-clock time, in seconds"""
+
+    def merge(self, other: "EvalLimits") -> "EvalLimits":
+        """Limits set in other take precedence over the ones set here"""
+        merged = EvalLimits()
+        for field in fields(self):
+            value = getattr(other, field.name)
+            setattr(merged, field.name, value if value is not None else getattr(self, field.name))
+        return merged
+
+    def killed_message(self, reason: str) -> str:
+        match reason:
+            case "memory":
+                return f"[Killed: memory limit {format_size(self.memory or 0)}]"
+            case "cpu":
+                return f"[Killed: CPU limit {self.cpu} s]"
+            case "timeout":
+                return f"[Killed: wall-clock limit {self.timeout:g} s]"
+            case _:
+                return f"[Killed: {reason}]"
+
+
+def parse_size(value: Any) -> int:
+    """Parse a memory size given as a number of bytes, or a string such as 512M, 8G or 8 GiB"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = SIZE_REGEX.match(str(value))
+    if match is None:
+        raise MoltenException(f"Invalid memory size: {value}")
+    return int(float(match["amount"]) * SIZE_UNITS[match["unit"].lower()])
+
+
+def format_size(size: int) -> str:
+    for unit in ("TiB", "GiB", "MiB", "KiB"):
+        scale = SIZE_UNITS[unit[0].lower()]
+        if size >= scale:
+            return f"{size / scale:g} {unit}"
+    return f"{size} B"
+
+
+def limits_from_values(memory: Any, cpu: Any, timeout: Any) -> EvalLimits:
+    try:
+        return EvalLimits(
+            memory=parse_size(memory) if memory else None,
+            cpu=int(cpu) if cpu else None,
+            timeout=float(timeout) if timeout else None,
+        )
+    except ValueError as err:
+        raise MoltenException(f"Invalid eval limit: {err}")
+
+
+def parse_limits_magic(args: str) -> EvalLimits:
+    """Parse the arguments of %%limits, eg. `%%limits memory=8G cpu=60 timeout=30`"""
+    values = {}
+    for option in args.split():
+        key, sep, value = option.partition("=")
+        if not sep or key not in ("memory", "cpu", "timeout"):
+            raise MoltenException(
+                f"Invalid %%limits option: {option}, expected memory=, cpu= or timeout="
+            )
+        values[key] = value
+    return limits_from_values(values.get("memory"), values.get("cpu"), values.get("timeout"))
+
+
+def apply_worker_limits(limits: EvalLimits) -> None:
+    """Called from inside the eval worker, before running any user code"""
+    if limits.memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (limits.memory, limits.memory))
+    if limits.cpu is not None:
+        # the soft limit sends SIGXCPU, the hard limit is a fallback in case that's handled
+        resource.setrlimit(resource.RLIMIT_CPU, (limits.cpu, limits.cpu + CPU_LIMIT_GRACE))
+
+
+def set_cell_limits(limits: EvalLimits) -> None:
+    """Called from inside a worker that runs many cells, before each one. Only the soft limits are
+    set, so the next cell can raise them again. The CPU limit starts from the CPU time used so far,
+    and the watchdog kills the worker if SIGXCPU is handled."""
+    _, memory_hard = resource.getrlimit(resource.RLIMIT_AS)
+    resource.setrlimit(
+        resource.RLIMIT_AS,
+        (limits.memory if limits.memory is not None else memory_hard, memory_hard),
+    )
+    _, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+    cpu_soft = cpu_hard
+    if limits.cpu is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        cpu_soft = math.ceil(usage.ru_utime + usage.ru_stime) + limits.cpu
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_soft, cpu_hard))
+
+
+def cpu_time(pid: int) -> Optional[float]:
+    """User plus system CPU time of the given process in seconds, None if it can't be read"""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # the command name is in parentheses and can hold spaces, the fields follow it
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def resident_memory(pid: int) -> Optional[int]:
+    """Resident set size of the given process in bytes, None if it can't be read"""
+    try:
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def proportional_memory(pid: int) -> Optional[int]:
+    """Proportional set size of the given process in bytes, its resident memory with the pages it
+    shares counted in part. Falls back to the resident set size."""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                if line.startswith("Pss:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return resident_memory(pid)
+
+
+def descendants(pid: int) -> List[int]:
+    """The children of the given process, their children and so on"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    result = []
+    pending = list(children.get(pid, []))
+    while pending:
+        child = pending.pop()
+        result.append(child)
+        pending.extend(children.get(child, []))
+    return result
+
+
+def tree_memory(pid: int) -> Optional[int]:
+    """Memory of the given process and all of its descendants, eg. the pool of a %%parallel cell,
+    in bytes. Pages shared between them, as forked processes do, are only counted once. None if
+    the process is gone."""
+    total = proportional_memory(pid)
+    if total is None:
+        return None
+    for child in descendants(pid):
+        total += proportional_memory(child) or 0
+    return total
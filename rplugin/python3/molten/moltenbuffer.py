@@ -1,7 +1,6 @@
 from contextlib import AbstractContextManager
 from datetime import datetime
 from typing import IO, Callable, List, Optional, Dict, Tuple
-from queue import Queue
 import hashlib
 
 from pynvim import Nvim
@@ -10,7 +9,7 @@ from molten.code_cell import CodeCell
 
 from molten.options import MoltenOptions
 from molten.images import Canvas
-from molten.position import Position
+from molten.position import DynamicPosition, Position
 from molten.utils import notify_error, notify_info, notify_warn
 from molten.outputbuffer import OutputBuffer
 from molten.outputchunks import ImageOutputChunk, OutputChunk, OutputStatus
@@ -33,12 +32,20 @@ class MoltenKernel:
     """name unique to this specific jupyter runtime. Only used within Molten. Human Readable"""
 
     outputs: Dict[CodeCell, OutputBuffer]
-    current_output: Optional[CodeCell]
-    queued_outputs: "Queue[CodeCell]"
+    executions: Dict[str, OutputBuffer]
+    """msg_id of each execute request that isn't done yet to the output it goes to, in the order
+    they were sent. The kernel runs them one after the other, they're all sent straight away."""
+    last_run: Optional[CodeCell]
+    """the cell of the last request sent, other clients' output goes there once ours are done"""
 
     selected_cell: Optional[CodeCell]
     should_show_floating_win: bool
     updating_interface: bool
+    wake_tick: Callable[[], None]
+    """set by the plugin, asks for a tick as soon as possible once the kernel has been given work"""
+    large_notebook: bool
+    """only the outputs in the window itself get virtual text when set, instead of the outputs
+    within a window height of it"""
 
     options: MoltenOptions
 
@@ -65,12 +72,14 @@ class MoltenKernel:
         self.kernel_id = kernel_id
 
         self.outputs = {}
-        self.current_output = None
-        self.queued_outputs = Queue()
+        self.executions = {}
+        self.last_run = None
 
         self.selected_cell = None
         self.should_show_floating_win = False
         self.updating_interface = False
+        self.large_notebook = False
+        self.wake_tick = lambda: None
 
         self.options = options
 
@@ -102,18 +111,29 @@ class MoltenKernel:
                 if output.output.status == OutputStatus.RUNNING:
                     output.output.status = OutputStatus.DONE
                     output.output.success = False
+                    output.invalidate_virt_output()
+            # the requests that were waiting their turn are lost with the kernel
+            for output in self.executions.values():
+                if output.output.status == OutputStatus.HOLD:
+                    output.output.status = OutputStatus.DONE
+                    output.output.success = False
+                    output.invalidate_virt_output()
+        self.executions = {}
 
         self.runtime.restart()
+        self.wake_tick()
 
     def run_code(self, code: str, span: CodeCell) -> None:
         if not self.try_delete_overlapping_cells(span):
             return
-        self.runtime.run_code(code)
+        msg_id = self.runtime.run_code(code)
+        self.wake_tick()
 
         self.outputs[span] = OutputBuffer(
             self.nvim, self.canvas, self.extmark_namespace, self.options
         )
-        self.queued_outputs.put(span)
+        self.executions[msg_id] = self.outputs[span]
+        self.last_run = span
 
         self.selected_cell = span
 
@@ -122,8 +142,6 @@ class MoltenKernel:
 
         self.update_interface()
 
-        self._check_if_done_running()
-
     def reevaluate_all(self) -> None:
         for span in sorted(self.outputs.keys(), key=lambda s: s.begin):
             code = span.get_text(self.nvim)
@@ -205,36 +223,46 @@ class MoltenKernel:
 
         return True
 
-    def _check_if_done_running(self) -> None:
-        # TODO: refactor
-        is_idle = (self.current_output is None or not self.current_output in self.outputs) or (
-            self.current_output is not None
-            and self.outputs[self.current_output].output.status == OutputStatus.DONE
-        )
-        if is_idle and not self.queued_outputs.empty():
-            key = self.queued_outputs.get_nowait()
-            self.current_output = key
+    def is_busy(self) -> bool:
+        """Whether the kernel is starting up or has cells running or queued"""
+        return not self.runtime.is_ready() or len(self.executions) > 0
 
-    def tick(self) -> None:
-        self._check_if_done_running()
+    def _default_output(self) -> Optional[OutputBuffer]:
+        """Where the messages of other clients' requests go, for external kernels: the output of
+        the oldest request of ours that isn't done, or of the last one run when they all are"""
+        if not self.runtime.external_kernel:
+            return None
+        pending = next(iter(self.executions.values()), None)
+        if pending is not None or self.last_run is None:
+            return pending
+        return self.outputs.get(self.last_run)
 
+    def tick(self) -> None:
         was_ready = self.runtime.is_ready()
-        if self.current_output is None or not self.current_output in self.outputs:
-            did_stuff = self.runtime.tick(None)
-        else:
-            output = self.outputs[self.current_output].output
-            starting_status = output.status
-            did_stuff = self.runtime.tick(output)
-
-            if starting_status != OutputStatus.DONE and output.status == OutputStatus.DONE:
-                if self.options.auto_open_html_in_browser:
-                    self.open_in_browser(silent=True)
-                if self.options.auto_image_popup:
-                    self.open_image_popup(silent=True)
 
-                output.end_time = datetime.now()
-
-        if self.options.output_show_exec_time or did_stuff:
+        default = self._default_output()
+        changed = self.runtime.tick(
+            {msg_id: output.output for msg_id, output in self.executions.items()},
+            default.output if default is not None else None,
+        )
+        for msg_id in changed:
+            output = self.executions.get(msg_id, default)
+            if output is not None:
+                output.invalidate_virt_output()
+
+        for msg_id, output in list(self.executions.items()):
+            if output.output.status != OutputStatus.DONE:
+                continue
+            del self.executions[msg_id]
+            if self.options.auto_open_html_in_browser:
+                self.open_in_browser(silent=True)
+            if self.options.auto_image_popup:
+                self.open_image_popup(silent=True)
+
+            output.output.end_time = datetime.now()
+
+        did_stuff = len(changed) > 0 or was_ready != self.runtime.is_ready()
+        if did_stuff or self._running_clock_visible():
             self.update_interface()
 
         if not was_ready and self.runtime.is_ready():
@@ -251,11 +279,28 @@ class MoltenKernel:
                 f"Kernel '{self.runtime.kernel_name}' (id: {self.kernel_id}) is ready.",
             )
 
+    def has_backlog(self) -> bool:
+        """Whether there are received messages that the last tick didn't get to"""
+        return self.runtime.backlog > 0 and self.runtime.is_ready()
+
+    def _running_clock_visible(self) -> bool:
+        """Whether the exec time of a running output is on screen, it changes on every tick"""
+        if not self.options.output_show_exec_time:
+            return False
+        selected = self.outputs.get(self.selected_cell) if self.selected_cell else None
+        for output in self.executions.values():
+            if output.output.status != OutputStatus.RUNNING:
+                continue
+            # virtual text shows every output, the floating window only the selected one
+            if self.options.virt_text_output or output is selected:
+                return True
+        return False
+
     def tick_input(self) -> None:
         self.runtime.tick_input()
 
     def send_stdin(self, input: str) -> None:
-        self.runtime.kernel_client.input(input)
+        self.runtime.send_stdin(input)
 
     def enter_output(self) -> None:
         if self.selected_cell is not None:
@@ -321,12 +366,15 @@ class MoltenKernel:
                     "Cannot delete a running cell. Wait for it to finish or use :MoltenInterrupt before creating an overlapping cell.",
                 )
             return False
-        self.outputs[cell].clear_float_win()
-        self.outputs[cell].clear_virt_output(cell.bufno)
+        output = self.outputs[cell]
+        output.clear_float_win()
+        output.clear_virt_output(cell.bufno)
         cell.clear_interface(self.highlight_namespace)
         del self.outputs[cell]
-        if self.current_output == cell:
-            self.current_output = None
+        # a request still waiting its turn runs anyway, its messages are dropped
+        self.executions = {
+            msg_id: running for msg_id, running in self.executions.items() if running is not output
+        }
         if self.selected_cell == cell:
             self.selected_cell = None
         return True
@@ -368,14 +416,42 @@ class MoltenKernel:
             self._show_selected(self.selected_cell)
 
         if self.options.virt_text_output:
-            for span, output in self.outputs.items():
-                output.show_virtual_output(span.end)
+            # Only outputs near the window are (re)built, the rest are rendered when they're
+            # scrolled into view. Outputs that didn't change since they were last shown are skipped
+            # by show_virtual_output.
+            for span in self._spans_near_window():
+                self.outputs[span].show_virtual_output(span.end)
 
         self.canvas.present()
 
         self.updating_interface = False
 
 
+    def _spans_near_window(self) -> List[CodeCell]:
+        """The cells of the current buffer that have an output and end in the window, or within a
+        window height of it. The end positions of the cells are found with a single
+        nvim_buf_get_extmarks call rather than one lookup per cell."""
+        bufno = self.nvim.current.buffer.number
+        top, bottom = self.nvim.eval("[line('w0') - 1, line('w$') - 1]")
+        margin = 0 if self.large_notebook else bottom - top + 1
+        top, bottom = max(top - margin, 0), bottom + margin
+        in_range = {
+            extmark_id
+            for extmark_id, _, _ in self.nvim.funcs.nvim_buf_get_extmarks(
+                bufno, self.extmark_namespace, [top, 0], [bottom, -1], {}
+            )
+        }
+        spans = []
+        for span in self.outputs:
+            if span.bufno != bufno:
+                continue
+            if isinstance(span.end, DynamicPosition):
+                if span.end.extmark_id in in_range:
+                    spans.append(span)
+            elif top <= span.end.lineno <= bottom:
+                spans.append(span)
+        return spans
+
     def on_cursor_moved(self, scrolled=False) -> None:
         self.update_interface()
 
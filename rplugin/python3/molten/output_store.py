@@ -0,0 +1,65 @@
+import json
+import os
+import re
+from typing import Dict, List, Optional
+
+# the anchor that stands in for an output block when outputs are kept in the store
+OUTPUT_ANCHOR_REGEX = re.compile(r"^<output id=(?P<id>\d+)/>$")
+
+
+def output_anchor(output_id: int) -> str:
+    return f"<output id={output_id}/>"
+
+
+def parse_output_anchor(line: str) -> Optional[int]:
+    match = OUTPUT_ANCHOR_REGEX.match(line.strip())
+    return int(match["id"]) if match is not None else None
+
+
+class OutputStore:
+    """Outputs of a Volcano notebook kept next to it, in <notebook>.outputs.json, instead of inline
+    in the buffer. The buffer only holds an `<output id=N/>` anchor for each one. The file is read
+    the first time an output is needed, and written back with save()."""
+
+    path: str
+    _outputs: Optional[Dict[int, List[str]]]
+
+    def __init__(self, notebook_path: str):
+        self.path = f"{notebook_path}.outputs.json"
+        self._outputs = None
+        self.dirty = False
+
+    @property
+    def outputs(self) -> Dict[int, List[str]]:
+        if self._outputs is None:
+            self._outputs = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self._outputs = {int(k): v for k, v in json.load(f).items()}
+                except (OSError, ValueError):
+                    pass
+        return self._outputs
+
+    def new_id(self) -> int:
+        return max(self.outputs.keys(), default=0) + 1
+
+    def get(self, output_id: int) -> List[str]:
+        return self.outputs.get(output_id, [])
+
+    def put(self, output_id: int, lines: List[str]) -> None:
+        self.outputs[output_id] = lines
+        self.dirty = True
+
+    def remove(self, output_id: int) -> None:
+        if self.outputs.pop(output_id, None) is not None:
+            self.dirty = True
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.outputs, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self.dirty = False
@@ -1,16 +1,45 @@
+import copy
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Any, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from pynvim import Nvim
 from pynvim.api import Buffer, Window
 
+from molten.buffer_transaction import BufferTransaction
 from molten.images import Canvas
-from molten.outputchunks import ImageOutputChunk, Output, OutputStatus
+from molten.outputchunks import (
+    ImageOutputChunk,
+    Output,
+    OutputChunk,
+    OutputStatus,
+    TextOutputChunk,
+)
 from molten.options import MoltenOptions
 from molten.position import DynamicPosition, Position
 from molten.utils import notify_error
 
 
+@dataclass
+class RenderedText:
+    """The leading text chunks of an output as build_output_text placed them, for one window width.
+    Text chunks have no side effects when placed, so they only need to be placed again when they
+    change."""
+
+    key: Tuple[bool, int, bool]
+    """virtual, window width and wrap_output"""
+    chunks: List[OutputChunk]
+    texts: List[str]
+    """the text of each chunk when it was placed, placing a chunk doesn't change this one"""
+    placed: List[str]
+    """the text each chunk was placed as"""
+    virtual_lines: List[int]
+    line_ends: List[Tuple[int, int]]
+    """how many lines there were after each chunk was placed, and the length of the last one"""
+    lines: List[str]
+    """the placed text split into lines"""
+
+
 class OutputBuffer:
     nvim: Nvim
     canvas: Canvas
@@ -18,11 +47,22 @@ class OutputBuffer:
     output: Output
 
     display_buf: Buffer
+    display_lines: Optional[List[str]]
+    """the lines of display_buf, as show_floating_win last set them"""
+    display_tick: int
+    """changedtick of display_buf after it was last set"""
     display_win: Optional[Window]
+    display_win_opts: Optional[Dict[str, Any]]
     display_virt_lines: Optional[DynamicPosition]
+    display_virt_lines_at: Optional[Tuple[int, int]]
     extmark_namespace: int
     virt_text_id: Optional[int]
-    displayed_status: OutputStatus
+    virt_lines: Optional[List[List[Tuple[str, str]]]]
+    """the payload of the virt_text_id extmark, as it was last set"""
+    virt_dirty: bool
+    """the output changed since the virtual text was last built"""
+    rendered: Dict[bool, RenderedText]
+    """build_output_text's cache, for virtual text and for the floating window"""
 
     options: MoltenOptions
     lua: Any
@@ -34,11 +74,17 @@ class OutputBuffer:
         self.output = Output(None)
 
         self.display_buf = self.nvim.buffers[self.nvim.funcs.nvim_create_buf(False, True)]
+        self.display_lines = None
+        self.display_tick = 0
         self.display_win = None
+        self.display_win_opts = None
         self.display_virt_lines = None
+        self.display_virt_lines_at = None
         self.extmark_namespace = extmark_namespace
         self.virt_text_id = None
-        self.displayed_status = OutputStatus.HOLD
+        self.virt_lines = None
+        self.virt_dirty = True
+        self.rendered = {}
 
         self.options = options
         self.nvim.exec_lua("_ow = require('output_window')")
@@ -138,10 +184,14 @@ class OutputBuffer:
         if self.display_virt_lines is not None:
             del self.display_virt_lines
             self.display_virt_lines = None
+        self.display_virt_lines_at = None
 
     def clear_virt_output(self, bufnr: int) -> None:
         if self.virt_text_id is not None:
             self.nvim.funcs.nvim_buf_del_extmark(bufnr, self.extmark_namespace, self.virt_text_id)
+            self.virt_text_id = None
+        self.virt_lines = None
+        self.virt_dirty = True
         # clear the image too
         redraw = False
         for chunk in self.output.chunks:
@@ -159,64 +209,98 @@ class OutputBuffer:
                 {"scope": "local", "win": self.display_win.handle},
             )
 
-    def build_output_text(self, shape, buf: int, virtual: bool) -> Tuple[List[str], int]:
-        lineno = 1 # we add a status line at the top in the end
-        lines_str = ""
-        # images are rendered with virtual lines by image.nvim
-        virtual_lines = 0
-        if len(self.output.chunks) > 0:
-            x = 0
-            for chunk in self.output.chunks:
-                y = lineno
-                if virtual:
-                    y = shape[1]
-                chunktext, virt_lines = chunk.place(
-                    buf,
-                    self.options,
-                    x,
-                    y,
-                    shape,
-                    self.canvas,
-                    virtual,
-                    winnr=self.nvim.current.window.handle if virtual else None,
-                )
-                lines_str += chunktext
-                lineno += chunktext.count("\n")
-                virtual_lines += virt_lines
-                x = len(lines_str) - lines_str.rfind("\n")
-
-            limit = self.options.limit_output_chars
-            if limit and len(lines_str) > limit:
-                lines_str = lines_str[:limit]
-                lines_str += f"\n...truncated to {limit} chars\n"
-
-            lines = lines_str.split("\n")
-            lineno = len(lines) + virtual_lines
-        else:
-            lines = []
-
-        # Remove trailing empty lines
-        while len(lines) > 0 and lines[-1] == "":
-            lines.pop()
+    def _reusable_text(self, key: Tuple[bool, int, bool]) -> RenderedText:
+        """The part of the cached text that's still good: the chunks up to the first one that was
+        replaced or changed since it was placed"""
+        rendered = self.rendered.get(key[0])
+        if rendered is None or rendered.key != key:
+            return RenderedText(key, [], [], [], [], [], [""])
+
+        chunks = self.output.chunks
+        keep = 0
+        for cached, chunk, text in zip(rendered.chunks, chunks, rendered.texts):
+            if cached is not chunk or getattr(chunk, "text", None) is not text:
+                break
+            keep += 1
+        if keep < len(rendered.chunks):
+            # cut the lines back to where they were after the last chunk kept, the list belongs
+            # to the cache so this is done in place
+            count, last_length = rendered.line_ends[keep - 1] if keep > 0 else (1, 0)
+            lines = rendered.lines
+            del lines[count:]
+            lines[-1] = lines[-1][:last_length]
+            del rendered.chunks[keep:]
+            del rendered.texts[keep:]
+            del rendered.placed[keep:]
+            del rendered.virtual_lines[keep:]
+            del rendered.line_ends[keep:]
+        return rendered
 
-        lines.insert(0, self._get_header_text(self.output))
-        return lines, len(lines) - 1 + virtual_lines
+    def build_output_text(self, shape, buf: int, virtual: bool) -> Tuple[List[str], int]:
+        # The leading text chunks are kept from the last call, so only the chunks that came in
+        # since then are placed and split. Chunks from the first image on are placed every time,
+        # placing an image adds it to the canvas.
+        key = (virtual, shape[2], bool(self.options.wrap_output))
+        rendered = self._reusable_text(key)
+        self.rendered[virtual] = rendered
+
+        chunks = self.output.chunks
+        lines = rendered.lines
+        virtual_lines = sum(rendered.virtual_lines)
+        cached = len(rendered.chunks)
+        for i in range(cached, len(chunks)):
+            chunk = chunks[i]
+            if cached == i and not isinstance(chunk, TextOutputChunk):
+                # the end of the cached text, lines belongs to the cache
+                lines = lines[:]
+            x = len(lines[-1]) + 1 if i > 0 else 0
+            # we add a status line at the top in the end
+            y = shape[1] if virtual else len(lines)
+            chunktext, virt_lines = chunk.place(
+                buf,
+                self.options,
+                x,
+                y,
+                shape,
+                self.canvas,
+                virtual,
+                winnr=self.nvim.current.window.handle if virtual else None,
+            )
+            new_lines = chunktext.split("\n")
+            lines[-1] += new_lines[0]
+            lines.extend(new_lines[1:])
+            virtual_lines += virt_lines
+            if cached == i and isinstance(chunk, TextOutputChunk):
+                rendered.chunks.append(chunk)
+                rendered.texts.append(chunk.text)
+                rendered.placed.append(chunktext)
+                rendered.virtual_lines.append(virt_lines)
+                rendered.line_ends.append((len(lines), len(lines[-1])))
+                cached += 1
+
+        # trailing empty lines are left out
+        end = len(lines) if chunks else 0
+        while end > 0 and lines[end - 1] == "":
+            end -= 1
+
+        # a single copy, lines can belong to the cache
+        result = [self._get_header_text(self.output)]
+        result.extend(lines[:end] if end < len(lines) else lines)
+        return result, len(result) - 1 + virtual_lines
+
+    def invalidate_virt_output(self) -> None:
+        """Rebuild the virtual text the next time it's shown"""
+        self.virt_dirty = True
 
     def show_virtual_output(self, anchor: Position) -> None:
-        if self.displayed_status == OutputStatus.DONE and self.virt_text_id is not None:
+        # the header of a running output has a clock in it when output_show_exec_time is set
+        clock = self.options.output_show_exec_time and self.output.status == OutputStatus.RUNNING
+        if self.virt_text_id is not None and not self.virt_dirty and not clock:
             return
         offset = self.calculate_offset(anchor) if self.options.cover_empty_lines else 0
-        self.displayed_status = self.output.status
 
         buf = self.nvim.buffers[anchor.bufno]
 
-        # clear the existing virtual text
-        if self.virt_text_id is not None:
-            self.nvim.funcs.nvim_buf_del_extmark(
-                anchor.bufno, self.extmark_namespace, self.virt_text_id
-            )
-            self.virt_text_id = None
-
         win = self.nvim.current.window
         win_info = self.nvim.funcs.getwininfo(win.handle)[0]
         win_col = win_info["wincol"]
@@ -238,19 +322,23 @@ class OutputBuffer:
             win_height,
         )
         lines, _ = self.build_output_text(shape, anchor.bufno, True)
+        self.virt_dirty = False
         l = len(lines)
         if l > self.options.virt_text_max_lines:
             lines = lines[: self.options.virt_text_max_lines - 1]
             lines.append(f"󰁅 {l - self.options.virt_text_max_lines + 1} More Lines ")
 
-        self.virt_text_id = buf.api.set_extmark(
-            self.extmark_namespace,
-            win_row,
-            0,
-            {
-                "virt_lines": [[(line, self.options.hl.virtual_text)] for line in lines],
-            },
-        )
+        virt_lines = [[(line, self.options.hl.virtual_text)] for line in lines]
+        if self.virt_text_id is not None and virt_lines == self.virt_lines:
+            self.canvas.present()
+            return
+        self.virt_lines = virt_lines
+
+        opts: Dict[str, Any] = {"virt_lines": virt_lines}
+        if self.virt_text_id is not None:
+            # move and update the existing extmark in place
+            opts["id"] = self.virt_text_id
+        self.virt_text_id = buf.api.set_extmark(self.extmark_namespace, win_row, 0, opts)
         self.canvas.present()
 
     def calculate_offset(self, anchor: Position) -> int:
@@ -296,9 +384,6 @@ class OutputBuffer:
         win_height -= border_h
         win_width -= border_w
 
-        # Clear buffer:
-        self.display_buf.api.set_lines(0, -1, False, [])
-
         sign_col_width = 0
         text_off = self.nvim.funcs.getwininfo(win.handle)[0]["textoff"]
         if not self.options.output_win_cover_gutter:
@@ -311,13 +396,7 @@ class OutputBuffer:
             win_height,
         )
         lines, real_height = self.build_output_text(shape, self.display_buf.number, False)
-
-        # You can't append lines normally, there will be a blank line at the top
-        self.display_buf[0] = lines[0]
-        self.display_buf.append(lines[1:])
-        self.nvim.api.set_option_value(
-            "filetype", "molten_output", {"buf": self.display_buf.handle}
-        )
+        self._set_display_lines(lines)
 
         # Open output window
         # assert self.display_window is None
@@ -357,7 +436,7 @@ class OutputBuffer:
                 and height == self.options.output_win_max_height
             ):
                 # the entire window size is shown, but the buffer still has more lines to render
-                hidden_lines = len(self.display_buf) - height
+                hidden_lines = len(lines) - height
                 if self.options.output_win_cover_gutter and type(border) == list:
                     border_pad = border[5 % len(border)][0] * text_off
                     win_opts["footer"] = [
@@ -382,13 +461,12 @@ class OutputBuffer:
                 self.set_win_option("wrap", self.options.wrap_output)
                 self.set_win_option("cursorline", False)
                 self.canvas.present()
-            else:  # move the current window
+            elif win_opts != self.display_win_opts:  # move the current window
                 self.display_win.api.set_config(win_opts)
+            # set_border_highlight changes the border of the options in place
+            self.display_win_opts = copy.deepcopy(win_opts)
 
-            if self.display_virt_lines is not None:
-                del self.display_virt_lines
-                self.display_virt_lines = None
-
+            virt_lines_at = None
             if self.options.output_virt_lines or self.options.cover_empty_lines:
                 virt_lines_y = anchor.lineno
                 if self.options.cover_empty_lines:
@@ -397,10 +475,46 @@ class OutputBuffer:
                 if self.options.virt_lines_off_by_1:
                     virt_lines_y += 1
                     virt_lines_height -= 1
-                self.display_virt_lines = DynamicPosition(
-                    self.nvim, self.extmark_namespace, anchor.bufno, virt_lines_y, 0
-                )
-                self.display_virt_lines.set_height(virt_lines_height)
+                virt_lines_at = (virt_lines_y, virt_lines_height)
+
+            if virt_lines_at != self.display_virt_lines_at:
+                if self.display_virt_lines is not None:
+                    del self.display_virt_lines
+                    self.display_virt_lines = None
+                if virt_lines_at is not None:
+                    self.display_virt_lines = DynamicPosition(
+                        self.nvim, self.extmark_namespace, anchor.bufno, virt_lines_at[0], 0
+                    )
+                    self.display_virt_lines.set_height(virt_lines_at[1])
+                self.display_virt_lines_at = virt_lines_at
+
+    def _set_display_lines(self, lines: List[str]) -> None:
+        """Bring display_buf up to date with lines. Only the header and the lines from the first
+        one that changed are sent, so output streaming into an open window costs the new lines.
+        The whole buffer is replaced if something else edited it since the last update."""
+        old = self.display_lines
+        tx = BufferTransaction(self.nvim, self.display_buf)
+        if old is None or self.display_buf.api.get_changedtick() != self.display_tick:
+            tx.set_lines(0, -1, lines)
+        else:
+            if old[0] != lines[0]:
+                tx.set_lines(0, 1, lines[:1])
+            first = 1
+            common = min(len(old), len(lines))
+            while first < common and old[first] == lines[first]:
+                first += 1
+            if first < len(old) or first < len(lines):
+                tx.set_lines(first, len(old), lines[first:])
+        if self.display_lines is None:
+            tx.call(
+                "nvim_set_option_value",
+                "filetype",
+                "molten_output",
+                {"buf": self.display_buf.handle},
+            )
+        tx.call("nvim_buf_get_changedtick", self.display_buf)
+        self.display_tick = tx.commit()[-1]
+        self.display_lines = lines
 
     def set_border_highlight(self, border):
         hl = self.options.hl.border_norm
@@ -428,6 +542,7 @@ class OutputBuffer:
     def remove_window_footer(self) -> None:
         if self.display_win is not None:
             self.display_win.api.set_config({"footer": ""})
+            self.display_win_opts = None
 
 
 def border_size(border: Union[str, List[str], List[List[str]]]):
@@ -10,6 +10,7 @@ from typing import (
 from contextlib import AbstractContextManager
 from enum import Enum
 from abc import ABC, abstractmethod
+import os
 import re
 from datetime import datetime
 
@@ -18,6 +19,8 @@ from pynvim import Nvim
 
 from molten.images import Canvas
 from molten.options import MoltenOptions
+from molten.terminal_text import TerminalText, rewrites
+from molten.text_width import extra_rows, wrap_lines
 from molten.utils import notify_error
 
 
@@ -55,10 +58,15 @@ def clean_up_text(text: str) -> str:
 
 class TextOutputChunk(OutputChunk):
     text: str
+    _wrapped: Dict[Tuple[int, int, bool, bool], Tuple[str, int]]
+    """place() results for the current text, by column, width, hard_wrap and wrap_output"""
+    _wrapped_text: Optional[str]
 
     def __init__(self, text: str):
         self.text = text
         self.output_type = "display_data"
+        self._wrapped = {}
+        self._wrapped_text = None
 
     def __repr__(self) -> str:
         return f'TextOutputChunk("{self.text}")'
@@ -73,38 +81,151 @@ class TextOutputChunk(OutputChunk):
         _canvas: Canvas,
         hard_wrap: bool,
         winnr: int | None = None,
+    ) -> Tuple[str, int]:
+        # wrapping only depends on these, so it's done once per window width. The text changes
+        # when chunks are merged, that drops everything wrapped for the old one.
+        if self._wrapped_text is not self.text or len(self._wrapped) >= 8:
+            self._wrapped = {}
+            self._wrapped_text = self.text
+        key = (col, shape[2], hard_wrap, bool(options.wrap_output))
+        placed = self._wrapped.get(key)
+        if placed is None:
+            placed = self._wrapped[key] = self._wrap(options, col, shape[2], hard_wrap)
+        return placed
+
+    def size(self) -> int:
+        return len(self.text)
+
+    def drop_front(self, chars: int) -> str:
+        """Remove whole lines from the start of the text, at least chars characters of them if the
+        text has that many before its last line. Returns the text removed."""
+        end = self.text.find("\n", max(chars - 1, 0)) + 1
+        if end == 0:
+            return ""
+        removed, self.text = self.text[:end], self.text[end:]
+        if self.jupyter_data is not None and "text/plain" in self.jupyter_data:
+            self.jupyter_data = {**self.jupyter_data, "text/plain": self.text}
+        return removed
+
+    def _wrap(
+        self, options: MoltenOptions, col: int, win_width: int, hard_wrap: bool
     ) -> Tuple[str, int]:
         text = clean_up_text(self.text)
         extra_lines = 0
         if options.wrap_output:  # count the number of extra lines this will need when wrapped
-            win_width = shape[2]
             if hard_wrap:
-                lines = []
-                splits = []
                 # Assume this is a progress bar, or similar, we shouldn't try to wrap it
                 if text.find("\r") != -1:
                     return text, 0
-                for line in text.split("\n"):
-                    index = 0
-                    if len(line) + col > win_width:
-                        splits.append(line[: win_width - col])
-                        line = line[win_width - col :]
-
-                    for _ in range(len(line) // win_width):
-                        splits.append(line[index * win_width : (index + 1) * win_width])
-                        index += 1
-                    splits.append(line[index * win_width :])
-
-                lines.extend(splits)
-                text = "\n".join(lines)
+                text = "\n".join(wrap_lines(text.split("\n"), win_width, col))
             else:
-                for line in text.split("\n"):
-                    if len(line) > win_width:
-                        extra_lines += len(line) // win_width
+                extra_lines = extra_rows(text.split("\n"), win_width)
 
         return text, extra_lines
 
 
+class StreamOutputChunk(TextOutputChunk):
+    r"""Text the kernel printed to stdout or stderr, kept as a terminal would show it. Consecutive
+    messages to the same stream are fed to one chunk, rather than each becoming a chunk of its own,
+    so a progress bar going back with \r or moving the cursor up rewrites what it printed before."""
+
+    name: str
+    terminal: TerminalText
+
+    BLOCK_SIZE = 64 * 1024
+    """Once a chunk has this many characters, the stream continues in a new chunk from the next
+    line. Renders place whole chunks again when they change, so this bounds the work of a render
+    to the last block."""
+
+    def __init__(self, name: str, text: str = ""):
+        self.name = name
+        self.terminal = TerminalText()
+        super().__init__(text)
+        self.jupyter_metadata = {}
+
+    def __repr__(self) -> str:
+        return f'StreamOutputChunk("{self.name}", "{self.text}")'
+
+    @property  # type: ignore
+    def text(self) -> str:
+        return self.terminal.text
+
+    @text.setter
+    def text(self, text: str) -> None:
+        self.terminal = TerminalText(text)
+
+    @property  # type: ignore
+    def jupyter_data(self) -> Dict[str, Any]:
+        return {"text/plain": self.text}
+
+    @jupyter_data.setter
+    def jupyter_data(self, _data: Dict[str, Any]) -> None:
+        # always built from the text
+        pass
+
+    def continues(self, name: str, text: str) -> bool:
+        """Whether text printed to the stream name goes in this chunk"""
+        if name != self.name:
+            return False
+        if self.terminal.size < self.BLOCK_SIZE or not self.terminal.at_line_start():
+            return True
+        # text that goes back over earlier lines needs them
+        return rewrites(text)
+
+    def feed(self, text: str) -> None:
+        self.terminal.feed(text)
+
+    def size(self) -> int:
+        return self.terminal.size
+
+    def drop_front(self, chars: int) -> str:
+        return self.terminal.drop_front(chars)
+
+
+class SpilledOutputChunk(OutputChunk):
+    """The middle of an output that went over limit_output_chars. Text cut out of the output is
+    appended to a file under the save path, only its length stays in memory. Save and export read
+    the file back, so they still get the whole output."""
+
+    path: str
+    chars: int
+
+    def __init__(self, path: str):
+        self.path = path
+        self.chars = 0
+        self.output_type = "display_data"
+        self.jupyter_metadata = {}
+
+    def append(self, text: str) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(text)
+        self.chars += len(text)
+
+    @property  # type: ignore
+    def jupyter_data(self) -> Dict[str, Any]:
+        text = ""
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                text = f.read()
+        return {"text/plain": text}
+
+    def place(
+        self,
+        _bufnr: int,
+        _options: MoltenOptions,
+        col: int,
+        _lineno: int,
+        _shape: Tuple[int, int, int, int],
+        _canvas: Canvas,
+        _hard_wrap: bool,
+        winnr: int | None = None,
+    ) -> Tuple[str, int]:
+        # col is one past the end of the line the previous chunk stopped on
+        newline = "\n" if col > 1 else ""
+        return f"{newline}[... {self.chars} chars not shown, full output in {self.path} ...]\n", 0
+
+
 class TextLnOutputChunk(TextOutputChunk):
     def __init__(self, text: str):
         super().__init__(text + "\n")
@@ -193,6 +314,16 @@ class Output:
     start_time: datetime | None
     end_time: datetime | None
 
+    spilled: Optional[SpilledOutputChunk]
+    """where the output is cut once it's over limit_output_chars"""
+
+    _sized: int
+    """how many of the leading chunks have their text counted in _sized_chars. Text is only fed to
+    the last chunk, so the ones before it keep their size until limit_text cuts them"""
+    _sized_chars: int
+    _sized_last: Optional[OutputChunk]
+    """the last chunk counted, to notice the chunks were cleared or replaced"""
+
     _should_clear: bool
 
     def __init__(self, execution_count: Optional[int]):
@@ -205,8 +336,83 @@ class Output:
         self.start_time = None
         self.end_time = None
 
+        self.spilled = None
+
+        self._sized = 0
+        self._sized_chars = 0
+        self._sized_last = None
+
         self._should_clear = False
 
+    def _text_size(self) -> int:
+        """The characters of text in the output. Only the chunks added since the last call are
+        counted, and the last chunk."""
+        chunks = self.chunks
+        sized = self._sized
+        if sized > len(chunks) or (sized > 0 and chunks[sized - 1] is not self._sized_last):
+            sized = self._sized_chars = 0
+        for chunk in chunks[sized:-1]:
+            if isinstance(chunk, TextOutputChunk):
+                self._sized_chars += chunk.size()
+        self._sized = max(len(chunks) - 1, 0)
+        self._sized_last = chunks[self._sized - 1] if self._sized > 0 else None
+        last = chunks[-1] if chunks else None
+        return self._sized_chars + (last.size() if isinstance(last, TextOutputChunk) else 0)
+
+    def limit_text(self, limit: int, spill_path: Callable[[], str]) -> None:
+        """Keep the text of the output under about limit characters: the first half of it, and the
+        most recent text. What's in between is moved to a SpilledOutputChunk. Called as the output
+        comes in, it only does something once the output is a quarter over the limit, and then
+        brings it back under the limit."""
+        if not limit:
+            return
+        if self._text_size() <= limit + limit // 4:
+            return
+        chunks = self.chunks
+        sizes = [chunk.size() if isinstance(chunk, TextOutputChunk) else 0 for chunk in chunks]
+        head = limit // 2
+        # the chunks are cut below, they're counted again on the next call
+        self._sized = self._sized_chars = 0
+
+        if self.spilled is None or not any(chunk is self.spilled for chunk in chunks):
+            # split the output after its first head characters
+            seen, i = 0, 0
+            while i < len(chunks) and seen + sizes[i] <= head:
+                seen += sizes[i]
+                i += 1
+            if i < len(chunks) and isinstance(chunks[i], TextOutputChunk) and head > seen:
+                piece = chunks[i].drop_front(head - seen)  # type: ignore
+                if piece:
+                    head_chunk = TextOutputChunk(piece)
+                    head_chunk.jupyter_data = {"text/plain": piece}
+                    head_chunk.jupyter_metadata = {}
+                    chunks.insert(i, head_chunk)
+                    i += 1
+            self.spilled = SpilledOutputChunk(spill_path())
+            chunks.insert(i, self.spilled)
+
+        # move the oldest text after the cut to the spill file
+        start = next(i for i, chunk in enumerate(chunks) if chunk is self.spilled)
+        excess = (
+            sum(chunk.size() for chunk in chunks[start + 1 :] if isinstance(chunk, TextOutputChunk))
+            - (limit - head)
+        )
+        while excess > 0 and start + 1 < len(chunks):
+            chunk = chunks[start + 1]
+            if not isinstance(chunk, TextOutputChunk):
+                # images and such stay, in front of the cut
+                chunks[start], chunks[start + 1] = chunk, self.spilled
+                start += 1
+            elif start + 2 < len(chunks) and chunk.size() <= excess:
+                self.spilled.append(chunk.text)
+                excess -= chunk.size()
+                del chunks[start + 1]
+            else:
+                removed = chunk.drop_front(excess)
+                if removed:
+                    self.spilled.append(removed)
+                break
+
     def merge_text_chunks(self):
         """Merge the last two chunks if they are text chunks, and text on a line before \r
         character, this is b/c outputs before a \r aren't shown, and so, should be deleted"""
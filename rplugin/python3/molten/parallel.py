@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Optional
+
+from molten.utils import MoltenException
+
+# %%parallel <function> <iterable> -> <target> [workers=N] [chunksize=N]
+PARALLEL_REGEX = re.compile(
+    r"^(?P<function>\S+)\s+(?P<iterable>.+?)\s*->\s*(?P<target>[A-Za-z_]\w*)"
+    r"(?P<options>(?:\s+\w+=\d+)*)\s*$"
+)
+
+
+@dataclass
+class ParallelSpec:
+    function: str
+    iterable: str
+    target: str
+    workers: Optional[int] = None
+    chunksize: Optional[int] = None
+
+
+def parse_parallel_spec(args: str) -> ParallelSpec:
+    match = PARALLEL_REGEX.match(args)
+    if match is None:
+        raise MoltenException(
+            "Invalid %%parallel directive, expected: "
+            "%%parallel <function> <iterable> -> <target> [workers=N] [chunksize=N]"
+        )
+
+    spec = ParallelSpec(match["function"], match["iterable"], match["target"])
+    for option in match["options"].split():
+        key, value = option.split("=")
+        if key not in ("workers", "chunksize"):
+            raise MoltenException(f"Unknown %%parallel option: {key}")
+        if int(value) < 1:
+            raise MoltenException(f"%%parallel option {key} must be at least 1")
+        setattr(spec, key, int(value))
+    return spec
+
+
+# The function being mapped. Pool workers are forked after this is set, so they inherit it; this
+# way functions defined inside a cell don't need to be picklable.
+_task: Optional[Callable[[Any], Any]] = None
+
+
+def _call_task(item: Any) -> Any:
+    assert _task is not None
+    return _task(item)
+
+
+def parallel_map(
+    function: Callable[[Any], Any],
+    iterable: Iterable[Any],
+    workers: Optional[int],
+    chunksize: Optional[int],
+    on_progress: Callable[[int, int], None],
+) -> List[Any]:
+    """Map function over iterable on a local process pool. Items are split into fixed chunks and
+    the results are returned in the order of the input, whatever order the tasks finish in.
+    on_progress is called with (done, total) as results come in."""
+    global _task
+
+    items = list(iterable)
+    total = len(items)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, total))
+    if chunksize is None:
+        # same heuristic as Pool.map
+        chunksize, extra = divmod(total, workers * 4)
+        if extra:
+            chunksize += 1
+    chunksize = max(1, chunksize)
+
+    results = []
+    on_progress(0, total)
+    if total == 0:
+        return results
+
+    _task = function
+    try:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            for result in pool.imap(_call_task, items, chunksize):
+                results.append(result)
+                on_progress(len(results), total)
+    finally:
+        _task = None
+
+    return results
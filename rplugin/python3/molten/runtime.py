@@ -1,9 +1,14 @@
 from datetime import datetime
-from typing import Optional, Tuple, List, Dict, Generator, IO, Any
+from typing import Callable, Optional, Tuple, List, Dict, Generator, IO, Any, Set
 from contextlib import contextmanager
+from concurrent.futures import Future
 from queue import Empty as EmptyQueueException
+from queue import Queue
+import asyncio
 import os
 import tempfile
+import time
+import uuid
 import json
 
 import jupyter_client
@@ -14,6 +19,7 @@ from molten.outputchunks import (
     Output,
     MimetypesOutputChunk,
     ErrorOutputChunk,
+    StreamOutputChunk,
     TextOutputChunk,
     OutputStatus,
     to_outputchunk,
@@ -21,6 +27,21 @@ from molten.outputchunks import (
 )
 from molten.runtime_state import RuntimeState
 from molten.jupyter_server_api import JupyterAPIClient, JupyterAPIManager
+from molten.kernel_loop import KernelLoop, get_kernel_loop
+
+# How many iopub messages a tick handles at most, and for how long. A kernel flooding output gets
+# its output displayed late instead of freezing the editor, the rest waits for the next tick.
+TICK_MESSAGE_BUDGET = 500
+TICK_TIME_BUDGET = 0.03
+
+ASYNC_CLIENT = "jupyter_client.asynchronous.AsyncKernelClient"
+
+# Messages received but not handled yet. Once it's full the reader stops receiving and the kernel's
+# output waits in ZMQ, until there's room again, checked every READ_TIMEOUT.
+MESSAGE_QUEUE_SIZE = 10 * TICK_MESSAGE_BUDGET
+READ_TIMEOUT = 0.05
+# how long to wait before asking a kernel that died while starting whether it's ready again
+READY_RETRY = 1.0
 
 
 class JupyterRuntime:
@@ -29,9 +50,22 @@ class JupyterRuntime:
     kernel_id: str
 
     kernel_manager: jupyter_client.KernelManager | JupyterAPIManager  # type: ignore
-    kernel_client: jupyter_client.KernelClient | JupyterAPIClient  # type: ignore
+    kernel_client: jupyter_client.AsyncKernelClient | JupyterAPIClient  # type: ignore
+    """only used on the kernel loop thread"""
 
     allocated_files: List[str]
+    loop: KernelLoop
+    messages: "Queue[Dict[str, Any]]"
+    """iopub messages received on the kernel loop but not handled yet"""
+    input_requests: "Queue[Dict[str, Any]]"
+    """stdin messages received on the kernel loop"""
+    notify: Callable[[], None]
+    """called from the kernel loop when it queued messages. Set by the plugin."""
+    executions: Set[str]
+    """msg_ids of the execute requests sent that aren't done yet. Only used on the kernel loop."""
+    kernel_ready: bool
+    """set on the kernel loop once the kernel answered, the main thread then moves state on"""
+    reader: "Optional[Future[None]]"
 
     options: MoltenOptions
     nvim: Nvim
@@ -48,18 +82,14 @@ class JupyterRuntime:
             self.kernel_manager = JupyterAPIManager(kernel_name)
             self.kernel_manager.start_kernel()
             self.kernel_client = self.kernel_manager.client()
-            self.kernel_client.start_channels()
             self.options = options
         elif ".json" not in self.kernel_name:
             self.external_kernel = False
-            self.kernel_manager = jupyter_client.manager.KernelManager(kernel_name=kernel_name)
+            self.kernel_manager = jupyter_client.manager.KernelManager(
+                kernel_name=kernel_name, client_class=ASYNC_CLIENT
+            )
             self.kernel_manager.start_kernel()
             self.kernel_client = self.kernel_manager.client()
-            assert isinstance(
-                self.kernel_client,
-                jupyter_client.blocking.client.BlockingKernelClient,
-            )
-            self.kernel_client.start_channels()
             self.kernel_client.connection_file = (
                 f"{self.kernel_client.data_dir}/runtime/kernel-{self.kernel_manager.kernel_id}.json"
             )
@@ -75,7 +105,7 @@ class JupyterRuntime:
 
             # we have a kernel json
             self.kernel_manager = jupyter_client.manager.KernelManager(
-                kernel_name=kernel_json["kernel_name"]
+                kernel_name=kernel_json["kernel_name"], client_class=ASYNC_CLIENT
             )
             self.kernel_client = self.kernel_manager.client()
             self.kernel_client.load_connection_file(connection_file=kernel_file)
@@ -83,6 +113,98 @@ class JupyterRuntime:
         self.allocated_files = []
         self.options = options
 
+        self.messages = Queue(maxsize=MESSAGE_QUEUE_SIZE)
+        self.input_requests = Queue()
+        self.notify = lambda: None
+        self.executions = set()
+        self.kernel_ready = False
+        self.reader = None
+        self.loop = get_kernel_loop()
+        self.loop.run(self._start_channels())
+        self._start_reading()
+
+    @property
+    def backlog(self) -> int:
+        """iopub messages received but not handled yet"""
+        return self.messages.qsize()
+
+    async def _start_channels(self) -> None:
+        # the sockets are created on the kernel loop, they belong to it
+        self.kernel_client.start_channels()
+
+    def _start_reading(self) -> None:
+        self.kernel_ready = False
+        if self.reader is not None:
+            self.reader.cancel()
+        self.reader = self.loop.spawn(self._read())
+
+    async def _read(self) -> None:
+        """Waits for the kernel to be ready, then receives its iopub and stdin messages as they
+        come, whatever buffer is current, and calls notify once it has queued some"""
+        while True:
+            try:
+                await self.kernel_client.wait_for_ready()
+                break
+            except RuntimeError:
+                # the kernel died before answering, it might be restarted
+                await asyncio.sleep(READY_RETRY)
+        self.kernel_ready = True
+        self.notify()
+
+        readers = [self._read_iopub()]
+        if not isinstance(self.kernel_client, JupyterAPIClient):
+            readers.append(self._read_stdin())
+        await asyncio.gather(*readers)
+
+    async def _read_iopub(self) -> None:
+        while True:
+            room = MESSAGE_QUEUE_SIZE - self.messages.qsize()
+            if room <= 0:
+                await asyncio.sleep(READ_TIMEOUT)
+                continue
+            received = [await self.kernel_client.get_iopub_msg()]
+            # take whatever else is waiting, so a burst is applied at once
+            while len(received) < room:
+                try:
+                    received.append(await self.kernel_client.get_iopub_msg(timeout=0))
+                except EmptyQueueException:
+                    break
+            routed = [message for message in received if self._route(message)]
+            for message in routed:
+                self.messages.put_nowait(message)
+            if routed:
+                self.notify()
+
+    def _route(self, message: Dict[str, Any]) -> bool:
+        """Whether message belongs to one of our execute requests. Anything goes for an external
+        kernel, other clients' cells are shown too."""
+        parent_id = message.get("parent_header", {}).get("msg_id")
+        if parent_id not in self.executions:
+            return self.external_kernel
+        if (
+            message.get("msg_type") == "status"
+            and message.get("content", {}).get("execution_state") == "idle"
+        ):
+            self.executions.discard(parent_id)
+        return True
+
+    async def _read_stdin(self) -> None:
+        while True:
+            self.input_requests.put(await self.kernel_client.get_stdin_msg())
+            self.notify()
+
+    async def _execute(self, code: str) -> str:
+        msg_id = self.kernel_client.execute(code)
+        self.executions.add(msg_id)
+        return msg_id
+
+    async def _close(self) -> None:
+        if self.reader is not None:
+            self.reader.cancel()
+        if self.external_kernel is False:
+            self.kernel_client.cleanup_connection_file()
+            self.kernel_client.shutdown()
+
     def is_ready(self) -> bool:
         return self.state.value > RuntimeState.STARTING.value
 
@@ -91,19 +213,22 @@ class JupyterRuntime:
             if os.path.exists(path):
                 os.remove(path)
 
-        if self.external_kernel is False:
-            self.kernel_client.cleanup_connection_file()
-            self.kernel_client.shutdown()
+        self.loop.run(self._close())
 
     def interrupt(self) -> None:
         self.kernel_manager.interrupt_kernel()
 
     def restart(self) -> None:
         self.state = RuntimeState.STARTING
+        # the requests sent to the old kernel won't be answered, executions is only used on the
+        # loop thread
+        self.loop.call(self.executions.clear)
         self.kernel_manager.restart_kernel()
+        self._start_reading()
 
-    def run_code(self, code: str) -> None:
-        self.kernel_client.execute(code)
+    def run_code(self, code: str) -> str:
+        """Send an execute request, returns its msg_id"""
+        return self.loop.run(self._execute(code))
 
     @contextmanager
     def _alloc_file(
@@ -114,6 +239,13 @@ class JupyterRuntime:
             yield path, file
         self.allocated_files.append(path)
 
+    def spill_path(self) -> str:
+        """A new file for output cut by limit_output_chars, deleted with the other allocated files
+        on deinit"""
+        path = os.path.join(self.options.save_path, "spill", f"{uuid.uuid4().hex}.txt")
+        self.allocated_files.append(path)
+        return path
+
     def _append_chunk(self, output: Output, data: Dict[str, Any], metadata: Dict[str, Any]) -> None:
         if self.options.show_mimetype_debug:
             output.chunks.append(MimetypesOutputChunk(list(data.keys())))
@@ -123,6 +255,20 @@ class JupyterRuntime:
             output.chunks.append(chunk)
             if isinstance(chunk, TextOutputChunk) and chunk.text.startswith("\r"):
                 output.merge_text_chunks()
+            output.limit_text(self.options.limit_output_chars, self.spill_path)
+
+    def _append_stream(self, output: Output, name: str, text: str) -> None:
+        if not output.success:
+            return
+        last = output.chunks[-1] if output.chunks else None
+        # consecutive stream messages go in one chunk, see StreamOutputChunk.continues
+        if isinstance(last, StreamOutputChunk) and last.continues(name, text):
+            last.feed(text)
+        else:
+            if self.options.show_mimetype_debug:
+                output.chunks.append(MimetypesOutputChunk(["text/plain"]))
+            output.chunks.append(StreamOutputChunk(name, text))
+        output.limit_text(self.options.limit_output_chars, self.spill_path)
 
     def _tick_one(self, output: Output, message_type: str, content: Dict[str, Any]) -> bool:
         def copy_on_demand(content_ctor):
@@ -176,12 +322,13 @@ class JupyterRuntime:
             chunk = ErrorOutputChunk(content["ename"], content["evalue"], content["traceback"])
             chunk.extras = content
             output.chunks.append(chunk)
+            output.limit_text(self.options.limit_output_chars, self.spill_path)
 
             copy_on_demand(lambda: "\n\n".join(map(clean_up_text, content["traceback"])))
             return True
         elif message_type == "stream":
             copy_on_demand(content["text"])
-            self._append_chunk(output, {"text/plain": content["text"]}, {})
+            self._append_stream(output, content["name"], content["text"])
             return True
         elif message_type == "display_data":
             # XXX: consider content['transient'], if we end up saving execution
@@ -201,63 +348,59 @@ class JupyterRuntime:
         else:
             return False
 
-    def tick(self, output: Optional[Output]) -> bool:
-        did_stuff = False
+    def tick(self, outputs: Dict[str, Output], default: Optional[Output] = None) -> Set[str]:
+        """Handle the messages received so far, within the tick budget. outputs maps the msg_id of
+        each execute request to its output, a message goes to the output of the request it's a
+        reply to, in whatever order they come. Messages of other clients' requests go to default,
+        that's only for external kernels, and the rest are dropped.
 
-        assert isinstance(
-            self.kernel_client,
-            (
-                jupyter_client.blocking.client.BlockingKernelClient,
-                JupyterAPIClient,
-            ),
-        )
+        Returns the msg_ids of the outputs that changed, default's is the empty string."""
+        changed: Set[str] = set()
 
         if not self.is_ready():
+            if not self.kernel_ready:
+                return changed
+            self.state = RuntimeState.IDLE
+
+        # what's left when the budget runs out is handled by the next tick
+        deadline = time.monotonic() + TICK_TIME_BUDGET
+        for _ in range(TICK_MESSAGE_BUDGET):
+            if time.monotonic() > deadline:
+                break
             try:
-                self.kernel_client.wait_for_ready(timeout=0)
-                self.state = RuntimeState.IDLE
-                did_stuff = True
-            except RuntimeError:
-                return False
-
-        if output is None:
-            return did_stuff
-
-        while True:
-            try:
-                message = self.kernel_client.get_iopub_msg(timeout=0)
+                message = self.messages.get_nowait()
+            except EmptyQueueException:
+                break
 
-                if "content" not in message or "msg_type" not in message:
-                    continue
+            if "content" not in message or "msg_type" not in message:
+                continue
 
-                did_stuff_now = self._tick_one(output, message["msg_type"], message["content"])
-                did_stuff = did_stuff or did_stuff_now
+            msg_id = message.get("parent_header", {}).get("msg_id", "")
+            output = outputs.get(msg_id)
+            if output is None:
+                output, msg_id = default, ""
+            if output is None:
+                continue
 
-                if output.status == OutputStatus.DONE:
-                    break
-            except EmptyQueueException:
-                break
+            if self._tick_one(output, message["msg_type"], message["content"]):
+                changed.add(msg_id)
 
-        return did_stuff
+        return changed
 
     def tick_input(self):
         """Tick to check input_requests"""
         if not self.is_ready:
             return
 
-        assert isinstance(
-            self.kernel_client,
-            (jupyter_client.blocking.client.BlockingKernelClient,
-             JupyterAPIClient),
-        )
-
         try:
-            msg = self.kernel_client.get_stdin_msg(timeout=0)
-            if msg is not None:
-                self.take_input(msg)
+            msg = self.input_requests.get_nowait()
+            self.take_input(msg)
         except EmptyQueueException:
             pass
 
+    def send_stdin(self, text: str) -> None:
+        self.loop.call(self.kernel_client.input, text)
+
     def take_input(self, msg):
         if msg["msg_type"] == "input_request":
             self.nvim.lua._prompt_stdin(self.kernel_id, msg["content"]["prompt"])
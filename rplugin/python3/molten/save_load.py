@@ -96,6 +96,7 @@ def load(nvim: Nvim, moltenbuffer: MoltenKernel, nvim_buffer: Buffer, data: Dict
                 )
             )
 
+        output.limit_text(moltenbuffer.options.limit_output_chars, moltenbuffer.runtime.spill_path)
         output.old = True
         output.status = OutputStatus.DONE
 
@@ -0,0 +1,162 @@
+r"""Stream output as a terminal shows it. Progress bars rewrite their line with \r or with ANSI
+cursor movement and erase sequences, so the text that's displayed is what's left after those are
+applied to the screen, not the concatenation of everything that was printed."""
+
+import re
+from typing import List, Optional
+
+# \r\n, \r, \n, backspace, CSI sequences (ESC [ params final) and two character escape sequences
+# such as ESC 7
+CONTROL_REGEX = re.compile(r"\r\n|\r|\n|\x08|\x1b\[([0-?]*)[ -/]*([@-~])|\x1b[0-Z\\-~]")
+
+# text that changes what was already printed, rather than only adding to it
+REWRITE_REGEX = re.compile(r"\r(?!\n)|\x08|\x1b")
+
+
+def rewrites(text: str) -> bool:
+    return REWRITE_REGEX.search(text) is not None
+
+
+def _count(params: str, default: int = 1) -> int:
+    first = params.split(";")[0]
+    return int(first) if first.isdigit() and int(first) > 0 else default
+
+
+class TerminalText:
+    r"""Lines of text with a cursor. feed() writes at the cursor and applies \r, \n, backspace and
+    the CSI sequences that move the cursor (A B C D G) or erase (K J). Colors and other sequences
+    are dropped. A feed costs the length of the text fed plus the length of the lines it writes
+    to, the full text is only joined when it's asked for."""
+
+    lines: List[str]
+    row: int
+    col: int
+    size: int
+    """length of text, kept up to date without joining it"""
+    _text: Optional[str]
+
+    def __init__(self, text: str = ""):
+        self.lines = [""]
+        self.row = 0
+        self.col = 0
+        self.size = 0
+        self._text = None
+        self.feed(text)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = "\n".join(self.lines)
+        return self._text
+
+    def at_line_start(self) -> bool:
+        """Whether the cursor is at the start of a new, empty, last line"""
+        return self.col == 0 and self.row == len(self.lines) - 1 and not self.lines[-1]
+
+    def feed(self, text: str) -> None:
+        if not text:
+            return
+        self._text = None
+        if (
+            self.row == len(self.lines) - 1
+            and self.col == len(self.lines[-1])
+            and not rewrites(text)
+        ):
+            # plain text added at the end, the usual case
+            text = text.replace("\r\n", "\n")
+            new_lines = text.split("\n")
+            self.lines[-1] += new_lines[0]
+            self.lines.extend(new_lines[1:])
+            self.size += len(text)
+            self.row = len(self.lines) - 1
+            self.col = len(self.lines[-1])
+            return
+        position = 0
+        for match in CONTROL_REGEX.finditer(text):
+            if match.start() > position:
+                self._write(text[position : match.start()])
+            position = match.end()
+            self._control(match)
+        if position < len(text):
+            self._write(text[position:])
+
+    def drop_front(self, chars: int) -> str:
+        """Remove whole lines from the start, at least chars characters if the lines above the
+        cursor hold that many. Returns the text removed, newlines included."""
+        count = removed = 0
+        while count < self.row and removed < chars:
+            removed += len(self.lines[count]) + 1
+            count += 1
+        if count == 0:
+            return ""
+        text = "\n".join(self.lines[:count]) + "\n"
+        del self.lines[:count]
+        self.row -= count
+        self.size -= removed
+        self._text = None
+        return text
+
+    def _set_line(self, row: int, line: str) -> None:
+        self.size += len(line) - len(self.lines[row])
+        self.lines[row] = line
+
+    def _write(self, segment: str) -> None:
+        line = self.lines[self.row]
+        if self.col > len(line):
+            line += " " * (self.col - len(line))
+        if self.col == len(line):
+            line += segment
+        else:
+            line = line[: self.col] + segment + line[self.col + len(segment) :]
+        self._set_line(self.row, line)
+        self.col += len(segment)
+
+    def _control(self, match: "re.Match[str]") -> None:
+        sequence = match.group(0)
+        if sequence in ("\n", "\r\n"):
+            self.row += 1
+            if self.row == len(self.lines):
+                self.lines.append("")
+                self.size += 1
+            self.col = 0
+        elif sequence == "\r":
+            self.col = 0
+        elif sequence == "\x08":
+            self.col = max(self.col - 1, 0)
+        elif match.group(2) is not None:
+            self._csi(match.group(1), match.group(2))
+
+    def _csi(self, params: str, final: str) -> None:
+        line = self.lines[self.row]
+        if final == "A":
+            self.row = max(self.row - _count(params), 0)
+        elif final == "B":
+            self.row = min(self.row + _count(params), len(self.lines) - 1)
+        elif final == "C":
+            self.col += _count(params)
+        elif final == "D":
+            self.col = max(self.col - _count(params), 0)
+        elif final == "G":
+            self.col = _count(params) - 1
+        elif final == "K":
+            mode = _count(params, 0)
+            if mode == 0:
+                self._set_line(self.row, line[: self.col])
+            elif mode == 1:
+                self._set_line(self.row, " " * min(self.col + 1, len(line)) + line[self.col + 1 :])
+            else:
+                self._set_line(self.row, "")
+        elif final == "J":
+            mode = _count(params, 0)
+            if mode == 0:
+                self._set_line(self.row, line[: self.col])
+                self.size -= sum(len(below) + 1 for below in self.lines[self.row + 1 :])
+                del self.lines[self.row + 1 :]
+            elif mode == 1:
+                # the lines above are left empty rather than removed, so rows keep their place
+                self._set_line(self.row, " " * min(self.col + 1, len(line)) + line[self.col + 1 :])
+                for above in range(self.row):
+                    self._set_line(above, "")
+            elif mode in (2, 3):
+                self.lines = [""]
+                self.row = self.col = self.size = 0
@@ -0,0 +1,74 @@
+"""Display width of output text, in terminal cells, for wrapping it to a window. East Asian wide
+and fullwidth characters (CJK, most emoji) take two cells, combining marks and format characters
+take none, everything else takes one. ASCII text, the common case, skips the per character work."""
+
+import unicodedata
+from functools import lru_cache
+from typing import Iterable, List
+
+
+@lru_cache(maxsize=8192)
+def char_width(char: str) -> int:
+    if unicodedata.combining(char) or unicodedata.category(char) in ("Mn", "Me", "Cf"):
+        return 0
+    if unicodedata.east_asian_width(char) in ("W", "F"):
+        return 2
+    return 1
+
+
+def display_width(text: str) -> int:
+    if text.isascii():
+        return len(text)
+    return sum(map(char_width, text))
+
+
+def split_line(line: str, first: int, width: int) -> List[str]:
+    """Cut line into pieces that fit in first cells for the first piece and width cells for the
+    others. A wide character that doesn't fit at the end of a piece starts the next one."""
+    if line.isascii():
+        if len(line) <= first:
+            return [line]
+        return [line[:first]] + [line[i : i + width] for i in range(first, len(line), width)]
+
+    pieces = []
+    start = used = 0
+    room = first
+    for i, char in enumerate(line):
+        w = char_width(char)
+        if used + w > room and i > start:
+            pieces.append(line[start:i])
+            start, used, room = i, 0, width
+        used += w
+    pieces.append(line[start:])
+    return pieces
+
+
+def wrap_lines(lines: Iterable[str], width: int, col: int = 0) -> List[str]:
+    """Hard wrap lines to width cells, the first one starting at column col"""
+    if width <= 0:
+        return list(lines)
+    wrapped: List[str] = []
+    first = width - col if col < width else width
+    for line in lines:
+        fits = len(line) <= first if line.isascii() else display_width(line) <= first
+        if fits:
+            wrapped.append(line)
+        else:
+            wrapped.extend(split_line(line, first, width))
+        first = width
+    return wrapped
+
+
+def extra_rows(lines: Iterable[str], width: int) -> int:
+    """How many more screen rows lines take up than there are lines, when soft wrapped to width"""
+    if width <= 0:
+        return 0
+    extra = 0
+    for line in lines:
+        if len(line) <= width and line.isascii():
+            continue
+        if line.isascii():
+            extra += (len(line) - 1) // width
+        else:
+            extra += len(split_line(line, width, width)) - 1
+    return extra
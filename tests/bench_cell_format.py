@@ -0,0 +1,38 @@
+"""Time parsing a notebook and removing its outputs at a few sizes, to show the time per line
+stays flat as the file grows:
+
+    python tests/bench_cell_format.py [max lines]
+"""
+
+import os
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "rplugin", "python3"))
+
+from molten.cell_format import parse_blocks, remove_outputs, select_outputs  # noqa: E402
+
+
+def notebook(size: int) -> List[str]:
+    """About size lines of cells, each with an output"""
+    cell = ["<cell>", "for i in range(10):", "    print(i)", "</cell>", ""]
+    output = ["<output>", "[1][done] 0.01 seconds", *map(str, range(10)), "</output>", ""]
+    return (cell + output) * (size // (len(cell) + len(output)))
+
+
+def main() -> None:
+    largest = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    size = 1_000
+    while size <= largest:
+        lines = notebook(size)
+        start = time.perf_counter()
+        remove_outputs(lines, select_outputs(parse_blocks(lines)))
+        elapsed = time.perf_counter() - start
+        per_line = elapsed / len(lines) * 1e9
+        print(f"{len(lines):>9} lines  {elapsed * 1000:9.1f} ms  {per_line:6.0f} ns/line")
+        size *= 10
+
+
+if __name__ == "__main__":
+    main()
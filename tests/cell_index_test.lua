@@ -0,0 +1,114 @@
+-- Checks lua/cell_index.lua against the blocks cell_format.parse_blocks finds, on the fixture
+-- tests/test_cell_format.py uses and under random edits. From the root of the repo:
+--
+--     nvim --headless -u NONE -l tests/cell_index_test.lua
+
+package.path = "lua/?.lua;" .. package.path
+local cell_index = require("cell_index")
+
+local OPENING = { ["<cell>"] = "cell", ["<markdown>"] = "markdown", ["<raw>"] = "raw", ["<output>"] = "output" }
+local CLOSING = { ["</cell>"] = "cell", ["</markdown>"] = "markdown", ["</raw>"] = "raw", ["</output>"] = "output" }
+
+-- the complete blocks of lines, the same way as parse_blocks
+local function reference_blocks(lines)
+  local blocks = {}
+  local current = nil
+  for i, line in ipairs(lines) do
+    local tag = vim.trim(line)
+    if current == nil then
+      if OPENING[tag] then
+        current = { i - 1, nil, OPENING[tag] }
+      elseif tag:match("^<output id=%d+/>$") then
+        table.insert(blocks, { i - 1, i - 1, "output" })
+      end
+    elseif CLOSING[tag] == current[3] then
+      current[2] = i - 1
+      table.insert(blocks, current)
+      current = nil
+    end
+  end
+  return blocks
+end
+
+local function same(a, b)
+  if a == nil or b == nil then
+    return a == b
+  end
+  return a[1] == b[1] and a[2] == b[2] and a[3] == b[3]
+end
+
+local function show(block)
+  return block and string.format("{%d, %d, %s}", block[1], block[2], block[3]) or "nil"
+end
+
+local function check(bufnr, expected, context)
+  local count = vim.api.nvim_buf_line_count(bufnr)
+
+  local found = {}
+  local block = cell_index.next_block(bufnr, 0)
+  while block ~= nil do
+    table.insert(found, block)
+    block = cell_index.next_block(bufnr, block[2] + 1)
+  end
+  assert(#found == #expected, context .. ": found " .. #found .. " blocks, expected " .. #expected)
+  for i = 1, #expected do
+    assert(same(found[i], expected[i]), context .. ": block " .. i .. " is " .. show(found[i]))
+  end
+
+  for row = 0, count - 1 do
+    local want = nil
+    for _, b in ipairs(expected) do
+      if b[1] <= row and row <= b[2] then
+        want = b
+      end
+    end
+    local got = cell_index.block_at(bufnr, row)
+    assert(same(got, want), context .. ": block_at " .. row .. " is " .. show(got) .. ", expected " .. show(want))
+  end
+
+  for i, b in ipairs(expected) do
+    local got = cell_index.prev_block(bufnr, b[2] + 1)
+    assert(same(got, b), context .. ": prev_block after block " .. i .. " is " .. show(got))
+  end
+end
+
+-- the fixture
+local lines = {}
+for line in io.lines("tests/fixtures/tags_in_output.txt") do
+  table.insert(lines, line)
+end
+local file = io.open("tests/fixtures/tags_in_output.json")
+local expected = {}
+for _, b in ipairs(vim.json.decode(file:read("*a"))) do
+  if b.closed then
+    table.insert(expected, { b.start, b["end"], b.kind })
+  end
+end
+file:close()
+
+local bufnr = vim.api.nvim_create_buf(false, true)
+vim.api.nvim_buf_set_lines(bufnr, 0, -1, false, lines)
+check(bufnr, expected, "fixture")
+assert(#reference_blocks(lines) == #expected, "the reference parser disagrees with the fixture")
+
+-- random edits, the index is kept up to date by on_lines
+local CHOICES = { "<cell>", "</cell>", "<output>", "</output>", "<markdown>", "</markdown>", "<raw>",
+  "</raw>", "<output id=7/>", "x = 1", "", "print('<cell>')" }
+math.randomseed(0)
+for edit = 1, 500 do
+  local count = vim.api.nvim_buf_line_count(bufnr)
+  local first = math.random(0, count)
+  local last = math.min(count, first + math.random(0, 3))
+  local replacement = {}
+  for _ = 1, math.random(0, 3) do
+    table.insert(replacement, CHOICES[math.random(#CHOICES)])
+  end
+  if count == 1 and first == 0 and last == 1 and #replacement == 0 then
+    replacement = { "" }
+  end
+  vim.api.nvim_buf_set_lines(bufnr, first, last, false, replacement)
+  local current = vim.api.nvim_buf_get_lines(bufnr, 0, -1, false)
+  check(bufnr, reference_blocks(current), "edit " .. edit)
+end
+
+print("cell_index: ok")
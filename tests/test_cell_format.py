@@ -0,0 +1,157 @@
+"""Checks of molten.cell_format against a naive parser under random edits, and a fixed case"""
+
+import json
+import os
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+from molten.cell_format import (
+    CLOSING_TAGS,
+    OPENING_TAGS,
+    Block,
+    blocks_to_cells,
+    cells_to_lines,
+    parse_blocks,
+    remove_outputs,
+    select_outputs,
+)
+from molten.output_store import output_anchor, parse_output_anchor
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+SEEDS = range(50)
+EDITS = 200
+
+TAGS = list(OPENING_TAGS) + list(CLOSING_TAGS)
+TEXT = ["", "x = 1", "print('<cell>')", "  <cell>  ", "# </output>", "<output id=3/>", "</ cell>"]
+
+
+def reference_blocks(lines: List[str]) -> List[Block]:
+    """Same rules as parse_blocks, looking for each closing tag with a scan of its own"""
+    blocks = []
+    i = 0
+    while i < len(lines):
+        tag = lines[i].strip()
+        kind = OPENING_TAGS.get(tag)
+        if kind is None:
+            output_id = parse_output_anchor(tag)
+            if output_id is not None:
+                blocks.append(Block("output", i, i, output_id=output_id))
+            i += 1
+            continue
+        end: Optional[int] = None
+        for j in range(i + 1, len(lines)):
+            if CLOSING_TAGS.get(lines[j].strip()) == kind:
+                end = j
+                break
+        if end is None:
+            blocks.append(Block(kind, i, len(lines) - 1, closed=False))
+            break
+        blocks.append(Block(kind, i, end))
+        i = end + 1
+    return blocks
+
+
+def random_line(rng: random.Random) -> str:
+    if rng.random() < 0.3:
+        return rng.choice(TAGS) + rng.choice(["", " ", "\t"])
+    if rng.random() < 0.1:
+        return output_anchor(rng.randrange(100))
+    return rng.choice(TEXT)
+
+
+def random_notebook(rng: random.Random) -> List[str]:
+    lines: List[str] = []
+    for _ in range(rng.randrange(10)):
+        kind = rng.choice(["cell", "markdown", "raw"])
+        lines.append(f"<{kind}>")
+        lines.extend(random_body(rng, kind))
+        lines.append(f"</{kind}>")
+        if kind == "cell" and rng.random() < 0.5:
+            lines.append("")
+            if rng.random() < 0.3:
+                lines.append(output_anchor(rng.randrange(100)))
+            else:
+                lines.append("<output>")
+                lines.extend(random_body(rng, "output"))
+                lines.append("</output>")
+        lines.append("")
+    return lines
+
+
+def random_body(rng: random.Random, kind: str) -> List[str]:
+    """Lines that don't close a block of kind"""
+    body = []
+    for _ in range(rng.randrange(5)):
+        line = random_line(rng)
+        if CLOSING_TAGS.get(line.strip()) != kind:
+            body.append(line)
+    return body
+
+
+def random_edit(rng: random.Random, lines: List[str]) -> None:
+    choice = rng.random()
+    if choice < 0.4 or not lines:
+        lines.insert(rng.randint(0, len(lines)), random_line(rng))
+    elif choice < 0.7:
+        del lines[rng.randrange(len(lines))]
+    else:
+        lines[rng.randrange(len(lines))] = random_line(rng)
+
+
+def source_text(cell: Dict[str, Any]) -> Tuple[str, str]:
+    """What has to survive a round trip. Empty cells get a blank line to type in, which makes them
+    look like a cell holding one, and cells_to_lines drops a trailing newline, so blank lines at
+    the end of a cell can go."""
+    return cell["cell_type"], "".join(cell["source"]).rstrip("\n")
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_parse_matches_reference_under_edits(seed: int) -> None:
+    rng = random.Random(seed)
+    lines = random_notebook(rng)
+    for _ in range(EDITS):
+        assert parse_blocks(lines) == reference_blocks(lines), lines
+        random_edit(rng, lines)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_remove_outputs_keeps_the_cells(seed: int) -> None:
+    rng = random.Random(seed)
+    lines = random_notebook(rng)
+    for _ in range(EDITS // 10):
+        random_edit(rng, lines)
+    blocks = parse_blocks(lines)
+    outputs = select_outputs(blocks)
+
+    removed = remove_outputs(lines, outputs)
+    assert select_outputs(parse_blocks(removed)) == []
+    removed_lines = sum(block.end - block.start + 1 for block in outputs)
+    assert len(lines) - removed_lines - len(removed) in range(len(outputs) + 1)
+    assert blocks_to_cells(removed, parse_blocks(removed)) == blocks_to_cells(lines, blocks)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_cells_round_trip(seed: int) -> None:
+    rng = random.Random(seed)
+    lines = random_notebook(rng)
+    cells = blocks_to_cells(lines, parse_blocks(lines))
+
+    relaid = cells_to_lines(cells)
+    assert [source_text(cell) for cell in blocks_to_cells(relaid, parse_blocks(relaid))] == [
+        source_text(cell) for cell in cells
+    ]
+
+
+def test_tags_inside_blocks_are_content() -> None:
+    # shared with tests/cell_index_test.lua, the index has to find the same blocks
+    with open(os.path.join(FIXTURES, "tags_in_output.txt"), encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    with open(os.path.join(FIXTURES, "tags_in_output.json"), encoding="utf-8") as f:
+        expected = json.load(f)
+    blocks = [
+        {"start": block.start, "end": block.end, "kind": block.kind, "closed": block.closed}
+        for block in parse_blocks(lines)
+    ]
+    assert blocks == expected
@@ -0,0 +1,83 @@
+"""Cells run one after the other by a NotebookWorker, sharing its namespace and event loop"""
+
+import time
+from typing import Iterator, List, Tuple
+
+import pytest
+
+from molten.eval_worker import NotebookWorker, read_namespace_variables
+from molten.limits import EvalLimits
+
+
+@pytest.fixture
+def notebook() -> Iterator[NotebookWorker]:
+    worker = NotebookWorker()
+    worker.start()
+    yield worker
+    worker.stop()
+
+
+def run_cell(
+    notebook: NotebookWorker, code: str, eval_id: int, path: str, **kwargs
+) -> Tuple[List[str], bool]:
+    """The lines the cell printed and whether it failed. The variables are read from the namespace
+    file at path, like the plugin does."""
+    cell = notebook.cell(code, eval_id, read_namespace_variables(path), [], path, **kwargs)
+    cell.start()
+    lines = []
+    while True:
+        kind, payload = cell.get(timeout=10)
+        if kind == "line":
+            lines.append(payload)
+        elif kind == "done":
+            return lines, payload
+
+
+def test_task_outlives_its_cell(notebook: NotebookWorker, tmp_path) -> None:
+    path = str(tmp_path / "notebook.json")
+    code = "\n".join(
+        [
+            "import asyncio",
+            "async def work(): await asyncio.sleep(0.2); return 42",
+            # no await in the cell, the task is only created
+            "task = asyncio.create_task(work())",
+        ]
+    )
+    assert run_cell(notebook, code, 1, path) == ([], False)
+
+    assert run_cell(notebook, "print(task.done())", 2, path) == (["False"], False)
+    time.sleep(0.5)
+    assert run_cell(notebook, "print(task.result())", 3, path) == (["42"], False)
+
+
+def test_await_a_task_of_an_earlier_cell(notebook: NotebookWorker, tmp_path) -> None:
+    path = str(tmp_path / "notebook.json")
+    code = "\n".join(
+        [
+            "import asyncio",
+            "async def work(): await asyncio.sleep(0.2); return 'done'",
+            "task = asyncio.ensure_future(work())",
+        ]
+    )
+    assert run_cell(notebook, code, 1, path) == ([], False)
+    assert run_cell(notebook, "print(await task)", 2, path) == (["done"], False)
+
+
+def test_live_values_win_over_saved_ones(notebook: NotebookWorker, tmp_path) -> None:
+    path = str(tmp_path / "notebook.json")
+    assert run_cell(notebook, "counter = [0]", 1, path) == ([], False)
+    assert run_cell(notebook, "counter.append(1)", 2, path) == ([], False)
+    # the file still has [0]
+    assert run_cell(notebook, "print(counter)", 3, path) == (["[0, 1]"], False)
+
+
+def test_limits_are_set_for_each_cell(notebook: NotebookWorker, tmp_path) -> None:
+    path = str(tmp_path / "notebook.json")
+    limits = EvalLimits(memory=1 << 30)
+    _, error = run_cell(notebook, "data = bytearray(2 << 30)", 1, path, limits=limits)
+    assert error
+    # the next cell runs without the limit, in the same worker
+    assert run_cell(notebook, "data = bytearray(512 << 20)\nprint('ok')", 2, path) == (
+        ["ok"],
+        False,
+    )
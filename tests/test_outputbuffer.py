@@ -0,0 +1,61 @@
+"""The text of an output is kept between renders, only what changed since the last one is placed
+again. Whatever was kept, the lines have to come out as if everything was placed from scratch."""
+
+import random
+from types import SimpleNamespace
+from typing import List, Tuple
+
+from molten.outputbuffer import OutputBuffer
+from molten.outputchunks import Output, OutputStatus, TextOutputChunk
+
+SHAPE = (0, 0, 12, 10)
+
+
+def output_buffer(output: Output) -> OutputBuffer:
+    """An OutputBuffer with just what rendering text needs, no nvim"""
+    buffer = object.__new__(OutputBuffer)
+    buffer.output = output
+    buffer.rendered = {}
+    buffer.canvas = None  # type: ignore
+    buffer.options = SimpleNamespace(wrap_output=True, output_show_exec_time=False)  # type: ignore
+    return buffer
+
+
+def from_scratch(output: Output) -> Tuple[List[str], int]:
+    return output_buffer(output).build_output_text(SHAPE, 0, False)
+
+
+def random_text(rng: random.Random) -> str:
+    return "".join(rng.choice(["a", "bcd", "\n", "\n\n", "wide 漢字 ", "x" * 15]) for _ in range(4))
+
+
+def test_incremental_render_matches_from_scratch() -> None:
+    rng = random.Random(41)
+    for _ in range(50):
+        output = Output(1)
+        output.status = OutputStatus.DONE
+        buffer = output_buffer(output)
+        for _ in range(30):
+            action = rng.random()
+            if action < 0.5 or not output.chunks:
+                output.chunks.append(TextOutputChunk(random_text(rng)))
+            elif action < 0.7:
+                output.chunks[-1].text += random_text(rng)
+            elif action < 0.85:
+                # a chunk in the middle changes, everything after it is placed again
+                rng.choice(output.chunks).text = random_text(rng)
+            else:
+                del output.chunks[rng.randrange(len(output.chunks)) :]
+
+            rendered = buffer.build_output_text(SHAPE, 0, False)
+            assert rendered == from_scratch(output)
+
+
+def test_returned_lines_are_not_the_cache() -> None:
+    output = Output(1)
+    output.chunks.append(TextOutputChunk("one\ntwo"))
+    buffer = output_buffer(output)
+    lines, _ = buffer.build_output_text(SHAPE, 0, False)
+    lines.append("changed by the caller")
+    output.chunks.append(TextOutputChunk(" three"))
+    assert buffer.build_output_text(SHAPE, 0, False) == from_scratch(output)
@@ -0,0 +1,79 @@
+"""limit_output_chars: the middle of a long output is moved to a spill file as the output comes in,
+nothing is lost on the way"""
+
+import random
+from typing import Callable, List
+
+from molten.outputchunks import Output, OutputChunk, StreamOutputChunk, TextOutputChunk
+
+
+def text_size(chunks: List[OutputChunk]) -> int:
+    return sum(chunk.size() for chunk in chunks if isinstance(chunk, TextOutputChunk))
+
+
+def jupyter_text(output: Output) -> str:
+    return "".join(
+        chunk.jupyter_data["text/plain"] for chunk in output.chunks if chunk.jupyter_data
+    )
+
+
+def display_text(text: str) -> TextOutputChunk:
+    """A chunk as to_outputchunk makes it for text/plain data"""
+    chunk = TextOutputChunk(text)
+    chunk.jupyter_data = {"text/plain": text}
+    chunk.jupyter_metadata = {}
+    return chunk
+
+
+def append_stream(output: Output, text: str) -> None:
+    """What the runtime does with a stream message"""
+    last = output.chunks[-1] if output.chunks else None
+    if isinstance(last, StreamOutputChunk) and last.continues("stdout", text):
+        last.feed(text)
+    else:
+        output.chunks.append(StreamOutputChunk("stdout", text))
+
+
+def run(messages: List[str], limit: int, spill_path: Callable[[], str]) -> Output:
+    output = Output(1)
+    for message in messages:
+        if message.startswith("display "):
+            output.chunks.append(display_text(message))
+        else:
+            append_stream(output, message)
+        output.limit_text(limit, spill_path)
+        assert output._text_size() == text_size(output.chunks)
+    return output
+
+
+def test_limited_output_has_the_same_text(tmp_path) -> None:
+    rng = random.Random(45)
+    for round in range(20):
+        spills = iter(range(1000))
+        messages = []
+        for _ in range(rng.randrange(50, 300)):
+            line = "x" * rng.randrange(40)
+            if rng.random() < 0.2:
+                messages.append(f"display {line}\n")
+            else:
+                messages.append(line + rng.choice(["\n", "", "\n\n"]))
+        limit = rng.randrange(100, 2000)
+        unlimited = run(messages, 0, lambda: "unused")
+        limited = run(messages, limit, lambda: str(tmp_path / f"{round}-{next(spills)}.txt"))
+        assert jupyter_text(limited) == jupyter_text(unlimited)
+        if text_size(unlimited.chunks) > 2 * limit:
+            assert limited.spilled is not None
+
+
+def test_size_is_counted_again_after_the_chunks_are_cleared(tmp_path) -> None:
+    output = Output(1)
+    output.chunks.append(display_text("a" * 40 + "\n"))
+    output.chunks.append(display_text("b" * 40 + "\n"))
+    output.limit_text(100, lambda: str(tmp_path / "spill.txt"))
+    assert output._text_size() == 82
+    output.chunks.clear()
+    output.chunks.append(display_text("c" * 10))
+    assert output._text_size() == 10
+    output.chunks[0] = display_text("d" * 5)
+    output.chunks.append(display_text("e" * 5))
+    assert output._text_size() == 10
@@ -0,0 +1,127 @@
+"""Stream output applied to a terminal line model, the way a terminal would show it"""
+
+import random
+
+import pytest
+
+from molten.terminal_text import TerminalText
+
+
+def shown(*feeds: str) -> str:
+    terminal = TerminalText()
+    for text in feeds:
+        terminal.feed(text)
+    assert terminal.size == len(terminal.text)
+    return terminal.text
+
+
+def test_plain_text() -> None:
+    assert shown("one\ntwo", " three\r\nfour") == "one\ntwo three\nfour"
+
+
+def test_carriage_return_rewrites_the_line() -> None:
+    assert shown("10%\r", "20%\r", "30%") == "30%"
+    assert shown("loading...\rdone") == "doneing..."
+    assert shown("a\r", "\nb") == "a\nb"
+
+
+def test_backspace() -> None:
+    assert shown("abc\x08\x08X") == "aXc"
+    assert shown("\x08\x08a") == "a"
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        # up, and up no further than the first line
+        ("one\ntwo\x1b[AX", "oneX\ntwo"),
+        ("one\ntwo\x1b[9A\rX", "Xne\ntwo"),
+        # down, no further than the last line
+        ("one\ntwo\x1b[A\x1b[B\rX", "one\nXwo"),
+        ("one\x1b[5B\rX", "Xne"),
+        # forward pads with spaces when written past the end
+        ("ab\x1b[3CX", "ab   X"),
+        ("abcd\r\x1b[2CX", "abXd"),
+        # back, no further than the first column
+        ("abcd\x1b[2DX", "abXd"),
+        ("ab\x1b[9DX", "Xb"),
+        # to a column, counted from 1
+        ("abcd\x1b[2GX", "aXcd"),
+        ("abcd\x1b[GX", "Xbcd"),
+    ],
+)
+def test_cursor_movement(text: str, expected: str) -> None:
+    assert shown(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        # erase in line: to the end, to the start (the cursor included), and the whole line
+        ("abcdef\x1b[3D\x1b[K", "abc"),
+        ("abcdef\x1b[3D\x1b[0K", "abc"),
+        ("abcdef\x1b[3D\x1b[1K", "    ef"),
+        ("abcdef\x1b[3D\x1b[2K", ""),
+        ("abcdef\x1b[2KX", "      X"),
+        # erase in display: to the end, to the start (the cursor included), and everything
+        ("one\ntwo\nthree\x1b[2A\x1b[2G\x1b[J", "o"),
+        ("one\ntwo\nthree\x1b[A\x1b[2G\x1b[1J", "\n  o\nthree"),
+        ("one\ntwo\x1b[1JX", "\n   X"),
+        ("one\ntwo\x1b[2JX", "X"),
+        ("one\ntwo\x1b[3Jthree", "three"),
+    ],
+)
+def test_erase(text: str, expected: str) -> None:
+    assert shown(text) == expected
+
+
+def test_other_sequences_are_dropped() -> None:
+    assert shown("\x1b[1;31mred\x1b[0m \x1b[?25lplain\x1b7") == "red plain"
+
+
+def test_progress_bar_over_two_lines() -> None:
+    feeds = []
+    for percent in range(0, 101, 25):
+        feeds.append(f"step {percent // 25}\n[{'#' * (percent // 25):<4}] {percent}%")
+        if percent < 100:
+            feeds.append("\r\x1b[A")
+    assert shown(*feeds) == "step 4\n[####] 100%"
+
+
+def test_drop_front() -> None:
+    terminal = TerminalText("one\ntwo\nthree\nfour")
+    assert terminal.drop_front(5) == "one\ntwo\n"
+    assert terminal.text == "three\nfour"
+    assert terminal.size == len(terminal.text)
+    # the cursor stays on the line it was on
+    terminal.feed("\r4")
+    assert terminal.text == "three\n4our"
+
+
+def test_drop_front_keeps_the_cursor_line() -> None:
+    terminal = TerminalText("one\ntwo\x1b[A")
+    assert terminal.drop_front(100) == ""
+    terminal = TerminalText("one\ntwo")
+    assert terminal.drop_front(100) == "one\n"
+    assert terminal.text == "two"
+    assert terminal.drop_front(0) == ""
+
+
+def test_fast_path_matches_the_control_path() -> None:
+    # plain text at the end of the last line is added without going through the control
+    # sequences, a sequence that is dropped anyway sends the same text down the slow path
+    rng = random.Random(44)
+    for _ in range(200):
+        pieces = ["a", "bc", "\n", "\r\n", " ", "é"]
+        feeds = [
+            "".join(rng.choice(pieces) for _ in range(rng.randrange(8)))
+            for _ in range(rng.randrange(1, 10))
+        ]
+        fast = TerminalText()
+        slow = TerminalText()
+        for text in feeds:
+            fast.feed(text)
+            slow.feed("\x1b[m" + text)
+        assert fast.lines == slow.lines
+        assert (fast.row, fast.col, fast.size) == (slow.row, slow.col, slow.size)
+        assert fast.text == "".join(feeds).replace("\r\n", "\n")
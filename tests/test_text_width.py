@@ -0,0 +1,82 @@
+"""Wrapping output text to a window, counted in terminal cells rather than characters"""
+
+import random
+
+import pytest
+
+from molten.text_width import display_width, extra_rows, split_line, wrap_lines
+
+
+def test_display_width() -> None:
+    assert display_width("abc") == 3
+    assert display_width("漢字") == 4
+    assert display_width("e\u0301") == 1
+    assert display_width("a\u200bb") == 2
+
+
+def test_wide_character_at_a_piece_boundary_starts_the_next_piece() -> None:
+    assert split_line("abc漢de", 4, 4) == ["abc", "漢de"]
+    assert split_line("ab漢cd", 4, 4) == ["ab漢", "cd"]
+    # the first piece can be narrower than the others
+    assert split_line("a漢字", 2, 4) == ["a", "漢字"]
+    assert wrap_lines(["a漢字"], 4, 2) == ["a", "漢字"]
+
+
+def test_wide_character_wider_than_the_window_gets_a_piece_of_its_own() -> None:
+    assert split_line("漢字a", 1, 1) == ["漢", "字", "a"]
+
+
+def test_combining_marks_stay_with_their_character() -> None:
+    line = "abce\u0301\u0301f"
+    assert split_line(line, 4, 4) == ["abce\u0301\u0301", "f"]
+    assert wrap_lines([line], 4) == ["abce\u0301\u0301", "f"]
+    assert extra_rows([line], 4) == 1
+    assert extra_rows([line[:-1]], 4) == 0
+
+
+def test_column_past_the_width_starts_on_a_full_row() -> None:
+    assert wrap_lines(["abcdef", "ghijkl"], 4, 4) == ["abcd", "ef", "ghij", "kl"]
+    assert wrap_lines(["abcdef"], 4, 9) == ["abcd", "ef"]
+    assert wrap_lines(["ab漢def"], 4, 9) == ["ab漢", "def"]
+    assert wrap_lines(["abcdef"], 4, 3) == ["a", "bcde", "f"]
+
+
+@pytest.mark.parametrize("line", ["abcdefgh", "漢字漢字", "ab漢cd\u00e9f", "abcdefgh" * 3])
+def test_exact_multiples_of_the_width_leave_no_empty_piece(line: str) -> None:
+    rows = display_width(line) // 4
+    assert len(split_line(line, 4, 4)) == rows
+    assert wrap_lines([line], 4) == split_line(line, 4, 4)
+    assert extra_rows([line], 4) == rows - 1
+
+
+def test_lines_that_fit_are_left_alone() -> None:
+    assert wrap_lines(["", "abcd", "漢字"], 4) == ["", "abcd", "漢字"]
+    assert extra_rows(["", "abcd", "漢字"], 4) == 0
+    assert wrap_lines(["abcdef"], 0) == ["abcdef"]
+    assert extra_rows(["abcdef"], 0) == 0
+
+
+def test_pieces_fit_and_add_up_to_the_line() -> None:
+    rng = random.Random(43)
+    for _ in range(500):
+        line = "".join(rng.choice("ab漢字e\u0301\u0301") for _ in range(rng.randrange(30)))
+        width = rng.randrange(1, 8)
+        first = rng.randrange(1, width + 1)
+        pieces = split_line(line, first, width)
+        assert "".join(pieces) == line
+        for room, piece in zip([first] + [width] * len(pieces), pieces):
+            assert display_width(piece) <= room or display_width(piece[1:]) == 0
+        # no piece could have taken the first character of the next one
+        for room, piece, after in zip([first] + [width] * len(pieces), pieces, pieces[1:]):
+            assert display_width(piece + after[0]) > room
+
+
+def test_ascii_takes_the_same_cuts_as_other_text_of_the_same_width() -> None:
+    # é is one cell like the ASCII letters, but sends the line down the per character path
+    for length in range(20):
+        line = "".join("abcdefghij"[i % 10] for i in range(length))
+        other = "\u00e9" + line[1:] if line else line
+        for width in (1, 3, 4):
+            expected = [len(piece) for piece in wrap_lines([line], width, 2)]
+            assert [len(piece) for piece in wrap_lines([other], width, 2)] == expected
+            assert extra_rows([other], width) == extra_rows([line], width)